@@ -0,0 +1,552 @@
+import asyncio
+import os
+import ssl
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Coroutine, Dict, List, Tuple
+from urllib import parse
+from urllib.error import HTTPError
+
+import Transfer
+from Muxer import Muxer
+from Sink import FileSink
+
+# Errors after which the transfer continues from the byte it had reached
+RETRIED_ERRORS = (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ssl.SSLError)
+RETRIED_STATUSES = (429, 500, 502, 503, 504)  # Overloaded server, retried with backoff like the shared session does
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+class _Connection(asyncio.BufferedProtocol):
+    def __init__(self, bufferSize: int):
+        """
+        Connection which receives straight into a fixed buffer. Reading from the socket pauses while the buffer
+        is full, so a slow reader leaves the bytes in the socket instead of growing the memory of the program
+        :param bufferSize: size of the buffer, also the longest response head which can be read
+        """
+        self._buffer: bytearray = bytearray(bufferSize)
+        self._view: memoryview = memoryview(self._buffer)
+        self._start: int = 0  # Received bytes which haven't been read are self._buffer[self._start:self._end]
+        self._end: int = 0
+        self._transport: asyncio.Transport = None
+        self._waiter: asyncio.Future = None
+        self._closed: bool = False
+        self._error: Exception = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        self._transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._start > 0:
+            # Moves unread bytes to the front so the free space is at the end
+            self._buffer[:self._end - self._start] = self._buffer[self._start:self._end]
+            self._end -= self._start
+            self._start = 0
+        return self._view[self._end:]
+
+    def buffer_updated(self, nbytes: int):
+        self._end += nbytes
+        if self._end == len(self._buffer):
+            self._transport.pause_reading()
+        self._wake()
+
+    def eof_received(self) -> bool:
+        self._closed = True
+        self._wake()
+        return False
+
+    def connection_lost(self, exc: Exception):
+        self._closed = True
+        self._error = exc
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _receive(self, timeout: float):
+        """
+        Waits until more bytes have been received
+        """
+        if self._closed:
+            raise ConnectionError(f"Connection closed: {self._error}" if self._error is not None else "Connection closed")
+        if self._end == len(self._buffer):
+            if self._start == 0:
+                raise ConnectionError("Response head doesn't fit the buffer")
+            self.get_buffer(0)  # Makes room, the paused transport doesn't ask for a buffer
+            self._transport.resume_reading()
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self._waiter, timeout)
+        finally:
+            self._waiter = None
+
+    def _take(self, amount: int) -> bytes:
+        data: bytes = bytes(self._view[self._start:self._start + amount])
+        self._start += amount
+        if self._start == self._end:
+            self._start = self._end = 0
+        if not self._closed and not self._transport.is_reading():
+            self._transport.resume_reading()
+        return data
+
+    async def read(self, maxBytes: int, timeout: float) -> bytes:
+        """
+        Reads at least one and at most maxBytes bytes
+        :return: the bytes, empty if the server closed the connection
+        """
+        while self._start == self._end:
+            if self._closed:
+                return b""
+            await self._receive(timeout)
+        return self._take(min(maxBytes, self._end - self._start))
+
+    async def readExactly(self, amount: int, timeout: float) -> bytes:
+        data: bytearray = bytearray()
+        while len(data) < amount:
+            chunk: bytes = await self.read(amount - len(data), timeout)
+            if not chunk:
+                raise ConnectionError("Connection closed before the whole body was received")
+            data += chunk
+        return bytes(data)
+
+    async def readUntil(self, separator: bytes, timeout: float) -> bytes:
+        """
+        Reads until and including a separator, which has to arrive before the buffer is full
+        """
+        while True:
+            index: int = self._buffer.find(separator, self._start, self._end)
+            if index >= 0:
+                return self._take(index + len(separator) - self._start)
+            await self._receive(timeout)
+
+    def write(self, data: bytes):
+        self._transport.write(data)
+
+    def isClosed(self) -> bool:
+        return self._closed or self._transport.is_closing()
+
+    def close(self):
+        self._closed = True
+        self._transport.close()
+
+
+class _Response:
+    def __init__(self, engine: "AsyncEngine", key: Tuple[str, str, int], connection: _Connection, status: int, reason: str, headers: Dict[str, str]):
+        """
+        Response whose body hasn't been read yet. The connection goes back to the pool when the body has been read
+        """
+        self._engine: AsyncEngine = engine
+        self._key: Tuple[str, str, int] = key
+        self._connection: _Connection = connection
+        self.status: int = status
+        self.reason: str = reason
+        self.headers: Dict[str, str] = headers  # Lowercase names
+        self._complete: bool = False
+        self._released: bool = False
+
+    async def iterChunks(self, chunkSize: int) -> AsyncIterator[bytes]:
+        """
+        Reads the body
+        :param chunkSize: largest yielded chunk
+        :return: chunks of the body
+        """
+        timeout: float = self._engine.getReadTimeout()
+        if self.headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                line: bytes = await self._connection.readUntil(b"\r\n", timeout)
+                remaining: int = int(line.split(b";")[0].strip() or b"0", 16)
+                if remaining == 0:
+                    await self._connection.readUntil(b"\r\n", timeout)  # Assumes no trailers
+                    break
+                while remaining > 0:
+                    chunk: bytes = await self._connection.read(min(chunkSize, remaining), timeout)
+                    if not chunk:
+                        raise ConnectionError("Connection closed before the whole body was received")
+                    remaining -= len(chunk)
+                    yield chunk
+                await self._connection.readExactly(2, timeout)
+            self._complete = True
+            return
+
+        length: str = self.headers.get("content-length", None)
+        remaining: int = int(length) if length is not None else -1
+        while remaining != 0:
+            chunk: bytes = await self._connection.read(chunkSize if remaining < 0 else min(chunkSize, remaining), timeout)
+            if not chunk:
+                if remaining < 0:
+                    break  # Body ends when the server closes the connection
+                raise ConnectionError("Connection closed before the whole body was received")
+            if remaining > 0:
+                remaining -= len(chunk)
+                self._complete = remaining == 0  # Before yielding, so a reader which stops at the last byte can reuse the connection
+            yield chunk
+
+    async def drain(self):
+        async for _ in self.iterChunks(Transfer.DEFAULT_CHUNK_SIZE):
+            pass
+
+    def release(self):
+        """
+        Gives the connection back to the pool if the whole body was read, otherwise closes it
+        """
+        if self._released:
+            return
+        self._released = True
+        reusable: bool = self._complete and self.headers.get("connection", "").lower() != "close"
+        self._engine._releaseConnection(self._key, self._connection, reusable)
+
+
+class AsyncEngine:
+    def __init__(self, maxConnectionsPerHost: int = 32, maxProcesses: int = 4, blockingWorkers: int = 4, muxer: Muxer = None,
+                 connectTimeout: float = 10, readTimeout: float = 30, bufferSize: int = Transfer.DEFAULT_CHUNK_SIZE):
+        """
+        Runs transfers and combinations of many downloads as coroutines of a single event loop thread.
+        A waiting download doesn't hold a thread, so hundreds of them can run at once with a handful of threads.
+        Other threads use the engine through submit and run, which return when the coroutine is done
+        :param maxConnectionsPerHost: how many connections can be open to the same host
+        :param maxProcesses: how many ffmpeg processes can run at the same time
+        :param blockingWorkers: threads for the few blocking calls, such as file system bookkeeping and pytube
+        :param muxer: finds ffmpeg and builds its arguments. If None, a default one is created
+        :param connectTimeout: seconds to wait for a connection
+        :param readTimeout: seconds to wait for data
+        :param bufferSize: receive buffer of a connection, the most memory a connection uses for bytes which haven't been read
+        """
+        self._maxConnectionsPerHost: int = maxConnectionsPerHost
+        self._maxProcesses: int = maxProcesses
+        self._blockingWorkers: int = blockingWorkers
+        self._muxer: Muxer = muxer if muxer is not None else Muxer()
+        self._connectTimeout: float = connectTimeout
+        self._readTimeout: float = readTimeout
+        self._bufferSize: int = bufferSize
+
+        self._loop: asyncio.AbstractEventLoop = None
+        self._thread: threading.Thread = None
+        self._startLock: threading.Lock = threading.Lock()
+        self._sslContext: ssl.SSLContext = ssl.create_default_context()
+
+        # Only used inside the loop
+        self._idle: Dict[Tuple[str, str, int], List[_Connection]] = {}
+        self._hostSlots: Dict[Tuple[str, str, int], asyncio.Semaphore] = {}
+        self._processSlots: asyncio.Semaphore = None
+
+        # Read by collectMetrics from other threads, a stale value is fine
+        self._openConnections: int = 0
+        self._activeTransfers: int = 0
+        self._runningProcesses: int = 0
+
+    def start(self) -> "AsyncEngine":
+        """
+        Starts the event loop thread. Called by submit if the engine hasn't been started
+        :return: the engine
+        """
+        with self._startLock:
+            if self._loop is not None:
+                return self
+            self._loop = asyncio.new_event_loop()
+            self._loop.set_default_executor(ThreadPoolExecutor(max_workers=self._blockingWorkers, thread_name_prefix="async-engine-blocking"))
+            self._processSlots = asyncio.Semaphore(self._maxProcesses)
+            ready: threading.Event = threading.Event()
+            self._thread = threading.Thread(target=self._runLoop, args=(ready,), name="async-engine", daemon=True)
+            self._thread.start()
+            ready.wait()
+        return self
+
+    def _runLoop(self, ready: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(ready.set)
+        self._loop.run_forever()
+
+    def stop(self):
+        """
+        Closes the pooled connections and stops the event loop thread. Running coroutines are cancelled
+        """
+        with self._startLock:
+            if self._loop is None:
+                return
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+
+        async def shutdown():
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+            loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop)
+        thread.join()
+        loop.close()
+
+    def getLoop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def getMuxer(self) -> Muxer:
+        return self._muxer
+
+    def getReadTimeout(self) -> float:
+        return self._readTimeout
+
+    def submit(self, coroutine: Coroutine) -> Future:
+        """
+        Runs a coroutine in the event loop. Can be called from any thread except the loop thread
+        :param coroutine: the coroutine
+        :return: future of the result of the coroutine
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def run(self, coroutine: Coroutine, timeout: float = None):
+        """
+        Runs a coroutine in the event loop and waits for its result, which lets blocking code use the engine
+        :param coroutine: the coroutine
+        :param timeout: seconds to wait at most
+        :return: result of the coroutine. Its error is raised
+        """
+        return self.submit(coroutine).result(timeout)
+
+    async def _openConnection(self, key: Tuple[str, str, int]) -> Tuple[_Connection, bool]:
+        """
+        Returns a pooled connection to a host or opens a new one
+        :param key: (scheme, host, port)
+        :return: the connection and whether it was reused
+        """
+        connections: List[_Connection] = self._idle.get(key, [])
+        while connections:
+            connection: _Connection = connections.pop()
+            if not connection.isClosed():
+                return connection, True
+            self._closeConnection(connection)
+
+        scheme, host, port = key
+        _, connection = await asyncio.wait_for(self._loop.create_connection(lambda: _Connection(self._bufferSize), host, port,
+                                                                            ssl=self._sslContext if scheme == "https" else None),
+                                               self._connectTimeout)
+        self._openConnections += 1
+        return connection, False
+
+    def _closeConnection(self, connection: _Connection):
+        connection.close()
+        self._openConnections -= 1
+
+    def _releaseConnection(self, key: Tuple[str, str, int], connection: _Connection, reusable: bool):
+        if reusable and not connection.isClosed():
+            self._idle.setdefault(key, []).append(connection)
+        else:
+            self._closeConnection(connection)
+        self._hostSlots[key].release()
+
+    async def request(self, url: str, headers: Dict[str, str] = None, maxRedirects: int = 5) -> _Response:
+        """
+        Sends a GET request over a pooled connection and reads the status and headers of the response.
+        The caller has to read the body with iterChunks or drain, and call release
+        :param url: the url
+        :param headers: headers sent in addition to the default headers
+        :param maxRedirects: how many redirects are followed
+        :return: the response
+        """
+        for _ in range(maxRedirects + 1):
+            parts = parse.urlsplit(url)
+            port: int = parts.port or (443 if parts.scheme == "https" else 80)
+            key: Tuple[str, str, int] = (parts.scheme, parts.hostname, port)
+            target: str = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+            lines: List[str] = [f"GET {target} HTTP/1.1", f"Host: {parts.netloc}", "Connection: keep-alive"]
+            lines += [f"{name}: {value}" for name, value in dict(Transfer.DEFAULT_HEADERS, **(headers or {})).items()]
+            message: bytes = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+            slots: asyncio.Semaphore = self._hostSlots.setdefault(key, asyncio.Semaphore(self._maxConnectionsPerHost))
+            await slots.acquire()
+            try:
+                response: _Response = await self._send(key, message)
+            except BaseException:
+                slots.release()
+                raise
+
+            if response.status not in REDIRECT_STATUSES or "location" not in response.headers:
+                return response
+            await response.drain()
+            response.release()
+            url = parse.urljoin(url, response.headers["location"])
+        raise ConnectionError(f"Too many redirects: {url}")
+
+    async def _send(self, key: Tuple[str, str, int], message: bytes) -> _Response:
+        while True:
+            connection, reused = await self._openConnection(key)
+            try:
+                connection.write(message)
+                head: bytes = await connection.readUntil(b"\r\n\r\n", self._readTimeout)
+                break
+            except BaseException as e:
+                self._closeConnection(connection)
+                if not reused or not isinstance(e, RETRIED_ERRORS):
+                    raise
+                # The server had closed the pooled connection, a new one is tried right away
+
+        lines: List[str] = head.decode("latin-1").split("\r\n")
+        statusLine: List[str] = lines[0].split(" ", 2)
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return _Response(self, key, connection, int(statusLine[1]), statusLine[2] if len(statusLine) > 2 else "", headers)
+
+    async def streamRange(self, url: str, start: int, size: int, maxRetries: int = 5, rangeSize: int = Transfer.DEFAULT_RANGE_SIZE,
+                          chunkSize: int = Transfer.DEFAULT_CHUNK_SIZE, throttle: Callable[[int], float] = None) -> AsyncIterator[bytes]:
+        """
+        Reads a file with Range requests, like Transfer.streamRange. A dropped connection is continued from the byte it had reached
+        :param url: url of the file
+        :param start: first byte to read
+        :param size: size of the whole file, or the byte after the last byte to read
+        :param maxRetries: how many times in a row a failed request is retried
+        :param rangeSize: how many bytes are asked with a single request
+        :param chunkSize: size of the yielded chunks
+        :param throttle: called with the size of every received chunk, returns seconds to wait before reading more
+        :return: chunks of the file
+        """
+        offset: int = start
+        retries: int = 0
+        while offset < size:
+            end: int = min(offset + rangeSize, size) - 1
+            response: _Response = None
+            try:
+                response = await self.request(url, {"Range": f"bytes={offset}-{end}"})
+                if response.status >= 400:
+                    if response.status not in RETRIED_STATUSES or retries >= maxRetries:
+                        raise HTTPError(url, response.status, response.reason, None, None)
+                    raise ConnectionError(f"Server answered {response.status}")
+
+                skip: int = offset if response.status != 206 else 0  # Server ignored the range and sent the whole file
+                async for chunk in response.iterChunks(chunkSize):
+                    if skip > 0:
+                        chunk, skip = chunk[skip:], max(0, skip - len(chunk))
+                        if not chunk:
+                            continue
+                    chunk = chunk[:size - offset]
+                    offset += len(chunk)
+                    retries = 0
+                    if throttle is not None:
+                        delay: float = throttle(len(chunk))
+                        if delay > 0:
+                            await asyncio.sleep(delay)  # Only this transfer waits, the loop keeps serving the others
+                    yield chunk
+                    if offset >= size:
+                        break
+                if offset <= end:
+                    # Ended early without an error. Retried like a dropped connection, so a server sending nothing can't loop forever
+                    raise ConnectionError(f"Response ended at byte {offset} before the end of its range at {end + 1}")
+            except RETRIED_ERRORS:
+                retries += 1
+                if retries > maxRetries:
+                    raise
+                await asyncio.sleep(min(0.25 * 2 ** retries, 10))  # Backs off so a struggling server isn't hammered
+            finally:
+                if response is not None:
+                    response.release()
+
+    async def downloadToFile(self, url: str, dataPath: str, expectedSize: int, itag: int = None, videoId: str = None,
+                             onProgress: Callable[[int, int], None] = None, isCancelled: Callable[[], bool] = None,
+                             journalInterval: int = 1048576, throttle: Callable[[int], float] = None) -> bool:
+        """
+        Downloads a file and keeps the same journal as Transfer.downloadToFile, so either of them can continue the download.
+        Chunks are written into a sink in the loop thread, they only copy into the page cache of the operating system.
+        Flushes for the journal and closing, which may sync, are done in a blocking thread
+        :param url: url of the file
+        :param dataPath: where the file is written
+        :param expectedSize: size of the complete file
+        :param itag: itag of the stream, used to match the journal
+        :param videoId: id of the video, used to find the file after a restart
+        :param onProgress: called with downloaded and total bytes after every chunk
+        :param isCancelled: returns whether the download should stop
+        :param journalInterval: how many bytes are written between journal updates
+        :param throttle: called with the size of every received chunk, returns seconds to wait before reading more
+        :return: whether the file was completed. False if it was cancelled
+        """
+        offset: int = 0
+        journal: Transfer.Journal = Transfer.Journal.load(dataPath)
+        if journal is not None and journal.itag == itag and journal.expectedSize == expectedSize and os.path.exists(dataPath):
+            # Segmented journals only count their finished prefix, the rest is downloaded again
+            offset = min(journal.offset, os.path.getsize(dataPath))
+
+        journal = Transfer.Journal(dataPath, url, itag, expectedSize, offset, videoId)
+        journal.save()
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        sink: FileSink = await loop.run_in_executor(None, FileSink, dataPath, offset, expectedSize)  # Preallocating can take a while
+        self._activeTransfers += 1
+        chunks: AsyncIterator[bytes] = self.streamRange(url, offset, expectedSize, throttle=throttle)
+        try:
+            complete: bool = False
+            unsaved: int = 0
+            try:
+                async for chunk in chunks:
+                    if isCancelled is not None and isCancelled():
+                        return False
+                    sink.write(chunk)
+                    offset += len(chunk)
+                    unsaved += len(chunk)
+                    if onProgress is not None:
+                        onProgress(offset, expectedSize)
+
+                    if unsaved >= journalInterval:
+                        journal.offset = await loop.run_in_executor(None, sink.flush)  # Journal mustn't claim bytes which aren't in the file yet
+                        journal.save()
+                        unsaved = 0
+                complete = True
+            finally:
+                journal.offset = await loop.run_in_executor(None, sink.close, complete)
+                journal.save()
+        finally:
+            await chunks.aclose()  # Gives the connection of an unfinished range back
+            self._activeTransfers -= 1
+
+        journal.remove()
+        return True
+
+    async def mux(self, inputs: List[str], outputPath: str, options: List[str] = ()) -> bool:
+        """
+        Runs an ffmpeg combination as an asyncio subprocess. The loop serves transfers while ffmpeg runs
+        :param inputs: paths to the input files
+        :param outputPath: path to the output file
+        :param options: options of the output file, see Muxer.buildCommand
+        :return: whether ffmpeg exited successfully
+        """
+        if not self._muxer.isAvailable():
+            print("Couldn't find ffmpeg from PATH or the ffmpeg folder")
+            return False
+
+        async with self._processSlots:
+            try:
+                process = await asyncio.create_subprocess_exec(*self._muxer.buildCommand(inputs, outputPath, options), stdin=subprocess.DEVNULL,
+                                                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            except OSError as e:
+                print(f"Couldn't start the combiner: {e}")
+                return False
+
+            self._runningProcesses += 1
+            try:
+                _, output = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+            finally:
+                self._runningProcesses -= 1
+
+        if process.returncode != 0 and output:
+            print(f"Combiner failed: {output.decode(errors='replace').strip()}")
+        return process.returncode == 0
+
+    def collectMetrics(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """
+        Returns open connections, running transfers and running ffmpeg processes in the form Metrics.addCollector expects
+        :return: list of (metric name, labels, value)
+        """
+        return [
+            ("async_open_connections", {}, self._openConnections),
+            ("async_active_transfers", {}, self._activeTransfers),
+            ("async_running_processes", {}, self._runningProcesses)
+        ]
@@ -0,0 +1,212 @@
+import bisect
+import threading
+import time
+from typing import Dict, List, Tuple
+
+
+def parseRate(text: str) -> float:
+    """
+    Turns a rate such as "500K", "2M" or "1.5MB" into bytes per second
+    :param text: the rate. "0" or an empty text means unlimited
+    :return: bytes per second or None if unlimited
+    """
+    text = text.strip().upper().rstrip("/S").rstrip("B")
+    multiplier: int = 1
+    if text and text[-1] in "KMG":
+        multiplier = 1024 ** ("KMG".index(text[-1]) + 1)
+        text = text[:-1]
+    rate: float = float(text) * multiplier if text else 0
+    return rate if rate > 0 else None
+
+
+class TokenBucket:
+    def __init__(self, burstTime: float = 0.25, minBurst: int = 65536):
+        """
+        Lets bytes through at a rate. Tokens can go negative, the debt is paid back by waiting
+        :param burstTime: how many seconds worth of bytes can be sent at once after an idle moment
+        :param minBurst: smallest burst in bytes, so a chunk always fits
+        """
+        self._burstTime: float = burstTime
+        self._minBurst: int = minBurst
+        self._tokens: float = 0
+        self._updated: float = None
+
+    def take(self, amount: int, rate: float, now: float) -> float:
+        """
+        Takes tokens for bytes
+        :param amount: the bytes
+        :param rate: bytes per second. If None, the bucket doesn't limit
+        :param now: monotonic time
+        :return: seconds to wait before the bytes may be used
+        """
+        if rate is None:
+            self._updated = now
+            return 0.0
+
+        burst: float = max(rate * self._burstTime, self._minBurst)
+        if self._updated is None:
+            self._tokens = burst
+        else:
+            self._tokens = min(burst, self._tokens + (now - self._updated) * rate)
+        self._updated = now
+
+        self._tokens -= amount
+        return -self._tokens / rate if self._tokens < 0 else 0.0
+
+
+class BandwidthLimiter:
+    ACTIVE_TIME: float = 1.0  # Jobs which haven't transferred for this many seconds don't get a share of the rate
+    FORGET_TIME: float = 60.0  # Jobs without own settings are forgotten after this many idle seconds
+
+    def __init__(self, rate: float = None):
+        """
+        Limits the download rate of every transfer together. Active jobs share the rate by their weights,
+        and a job can have a cap of its own. The rate can follow a schedule by the time of day
+        :param rate: bytes per second, None for unlimited
+        """
+        self._lock: threading.Lock = threading.Lock()
+        self._rate: float = rate
+        # Minutes of the day where a rule starts or ends, and the (start minute, end minute, rate) rule used from each of them until
+        # the next, None for the rate of setRate. Made once by setSchedule, where the first matching rule wins, so a lookup is a bisection
+        self._boundaries: Tuple[List[int], List[Tuple[int, int, float]]] = ([], [])
+        self._activeRate: float = rate  # Rate of the current minute, so transfers don't look up the schedule for every chunk
+        self._activeUntil: float = 0  # Monotonic time when the current minute ends
+        self._bucket: TokenBucket = TokenBucket()
+
+        # Job id -> [weight, cap, bucket, last transfer, has own settings]
+        self._jobs: Dict[str, list] = {}
+        self._lastForget: float = 0
+
+    def setRate(self, rate: float):
+        """
+        Changes the rate used outside of scheduled times. Takes effect immediately
+        :param rate: bytes per second, None for unlimited
+        """
+        with self._lock:
+            self._rate = rate
+            self._activeUntil = 0
+
+    def setSchedule(self, rules: List[Tuple[str, str, float]]):
+        """
+        Sets rates for times of the day, for example [("08:00", "18:00", 1048576), ("22:00", "06:00", None)].
+        Times outside the rules use the rate of setRate
+        :param rules: (start "HH:MM", end "HH:MM", bytes per second or None) tuples. A rule can go over midnight
+        """
+        def toMinute(clock: str) -> int:
+            hours, minutes = clock.split(":")
+            return int(hours) * 60 + int(minutes)
+
+        schedule: List[Tuple[int, int, float]] = [(toMinute(start), toMinute(end), rate) for start, end, rate in rules]
+        minutes: List[int] = sorted({0} | {start for start, _, _ in schedule} | {end for _, end, _ in schedule}) if schedule else []
+        with self._lock:
+            self._boundaries = (minutes, [BandwidthLimiter._findRule(schedule, minute) for minute in minutes])
+            self._activeUntil = 0
+
+    @staticmethod
+    def _findRule(schedule: List[Tuple[int, int, float]], minute: int) -> Tuple[int, int, float]:
+        """
+        Returns the first rule of a schedule which covers a minute of the day or None
+        """
+        for start, end, rate in schedule:
+            if start <= minute < end if start <= end else (minute >= start or minute < end):
+                return start, end, rate
+        return None
+
+    def getRate(self, localTime: time.struct_time = None) -> float:
+        """
+        Returns the rate which is used at a time
+        :param localTime: the time, now if None
+        :return: bytes per second or None if unlimited
+        """
+        minutes, rules = self._boundaries
+        if not minutes:
+            return self._rate
+        localTime = localTime if localTime is not None else time.localtime()
+        rule: Tuple[int, int, float] = rules[bisect.bisect_right(minutes, localTime.tm_hour * 60 + localTime.tm_min) - 1]
+        return rule[2] if rule is not None else self._rate
+
+    def setJob(self, jobId: str, weight: float = 1.0, cap: float = None):
+        """
+        Sets how a job shares the rate. Can be changed while the job is transferring
+        :param jobId: id of the job
+        :param weight: a job with weight 2 gets twice the rate of a job with weight 1
+        :param cap: the most bytes per second the job can use, None for no cap of its own
+        """
+        with self._lock:
+            job: list = self._getJob(jobId, time.monotonic())
+            job[0] = max(weight, 0.001)
+            job[1] = cap
+            job[4] = True
+
+    def removeJob(self, jobId: str):
+        with self._lock:
+            self._jobs.pop(jobId, None)
+
+    def _getJob(self, jobId: str, now: float) -> list:
+        job: list = self._jobs.get(jobId, None)
+        if job is None:
+            job = [1.0, None, TokenBucket(), now, False]
+            self._jobs[jobId] = job
+        return job
+
+    def _getShares(self, rate: float, now: float) -> Dict[str, float]:
+        """
+        Divides the rate between active jobs by their weights. A job capped below its share gives the rest to the others
+        """
+        active: List[Tuple[str, list]] = [(jobId, job) for jobId, job in self._jobs.items() if now - job[3] < BandwidthLimiter.ACTIVE_TIME]
+        shares: Dict[str, float] = {}
+        if rate is None:
+            for jobId, job in active:
+                shares[jobId] = job[1]
+            return shares
+
+        # Jobs whose cap is smallest compared to their weight are filled first
+        active.sort(key=lambda item: item[1][1] / item[1][0] if item[1][1] is not None else float("inf"))
+        remaining: float = rate
+        totalWeight: float = sum(job[0] for _, job in active)
+        for jobId, job in active:
+            share: float = remaining * job[0] / totalWeight
+            if job[1] is not None and job[1] < share:
+                share = job[1]
+            shares[jobId] = share
+            remaining -= share
+            totalWeight -= job[0]
+        return shares
+
+    def reserve(self, jobId: str, amount: int) -> float:
+        """
+        Accounts bytes a job has received
+        :param jobId: id of the job
+        :param amount: the bytes
+        :return: seconds the job has to wait before receiving more
+        """
+        with self._lock:
+            now: float = time.monotonic()
+            if now >= self._activeUntil:
+                localTime: time.struct_time = time.localtime()
+                self._activeRate = self.getRate(localTime)
+                self._activeUntil = now + 60 - localTime.tm_sec
+            rate: float = self._activeRate
+            job: list = self._getJob(jobId, now)
+            job[3] = now
+
+            if now - self._lastForget > BandwidthLimiter.FORGET_TIME:
+                self._lastForget = now
+                for idleId in [key for key, value in self._jobs.items() if not value[4] and now - value[3] > BandwidthLimiter.FORGET_TIME]:
+                    del self._jobs[idleId]
+
+            if rate is None and job[1] is None:
+                return 0.0
+
+            jobDelay: float = job[2].take(amount, self._getShares(rate, now).get(jobId, job[1]), now)
+            return max(jobDelay, self._bucket.take(amount, rate, now))
+
+    def consume(self, jobId: str, amount: int):
+        """
+        Accounts bytes a job has received and waits until it may receive more
+        :param jobId: id of the job
+        :param amount: the bytes
+        """
+        delay: float = self.reserve(jobId, amount)
+        if delay > 0:
+            time.sleep(delay)
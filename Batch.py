@@ -0,0 +1,416 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from queue import Queue
+from typing import Callable, Dict, Iterable, Iterator, Tuple, Union
+
+import pytube
+
+import Sink
+import Transfer
+from AsyncEngine import AsyncEngine
+from Bandwidth import parseRate
+from Broker import Broker
+from Catalog import QualityPolicy
+from Download import Video
+from Metrics import metrics
+from Muxer import Muxer
+from Scheduler import Scheduler, Job
+from Sink import SinkSettings
+from Transcode import TranscodeSettings
+from Worker import startWorkers
+
+
+class BatchResult:
+    def __init__(self, link: str, state: str, title: str = None, videoItag: int = None, audioItag: int = None):
+        """
+        Outcome of a single download in a batch
+        :param link: link to the video
+        :param state: one of Job.STATES
+        :param title: title of the video if its options could be fetched
+        :param videoItag: downloaded video option
+        :param audioItag: downloaded audio option
+        """
+        self.link: str = link
+        self.state: str = state
+        self.title: str = title
+        self.videoItag: int = videoItag
+        self.audioItag: int = audioItag
+
+    def isSuccessful(self) -> bool:
+        return self.state == Job.STATES.DONE
+
+    def toDict(self) -> dict:
+        return {"link": self.link, "state": self.state, "title": self.title, "videoItag": self.videoItag, "audioItag": self.audioItag}
+
+
+class BatchDownloader:
+    def __init__(self, outputFolder: str = "downloads", scheduler: Scheduler = None, maxPending: int = 64, streamingMux: bool = False,
+                 engine: AsyncEngine = None, broker: Broker = None, outputMode: str = Video.OUTPUT_MODES.COMBINED,
+                 audioFormat: str = Video.AUDIO_FORMATS.M4A):
+        """
+        Loads and downloads many videos at once
+        :param outputFolder: folder for the downloaded videos
+        :param scheduler: scheduler which limits the concurrency of each stage. If None, a default one is created
+        :param maxPending: how many videos can be queued at the same time. Keeps memory use flat on long lists
+        :param streamingMux: whether videos are combined while downloading, see Video.setStreamingMux
+        :param engine: if given, videos are downloaded and combined as coroutines of this engine and only
+            their options are fetched by the scheduler. Every queued video can then download at the same time
+        :param broker: if given, videos are queued into this broker and downloaded by worker processes, see Worker
+        :param outputMode: what every video is downloaded as, see Video.setOutputMode
+        :param audioFormat: format of audio mode
+        """
+        self._outputFolder: str = outputFolder
+        self._scheduler: Scheduler = scheduler if scheduler is not None else Scheduler()
+        self._maxPending: int = maxPending
+        self._streamingMux: bool = streamingMux
+        self._engine: AsyncEngine = engine
+        self._broker: Broker = broker
+        self._outputMode: str = outputMode
+        self._audioFormat: str = audioFormat
+        self._pollInterval: float = 0.5  # Seconds between reads of the broker
+
+    @staticmethod
+    def expandSources(sources: Iterable[str]) -> Iterator[str]:
+        """
+        Turns sources into video links. A source can be a video link, a playlist link,
+        a text file with one source per line or "-" to read sources from standard input
+        :param sources: the sources
+        :return: video links, read lazily
+        """
+        for source in sources:
+            source = source.strip()
+            if not source or source.startswith("#"):
+                continue
+
+            if source == "-":
+                yield from BatchDownloader.expandSources(sys.stdin)
+            elif os.path.isfile(source):
+                with open(source, "r") as file:
+                    yield from BatchDownloader.expandSources(file)
+            elif "list=" in source and "watch?" not in source:
+                yield from pytube.Playlist(source).video_urls  # Playlist pages are loaded while iterating
+            else:
+                yield source
+
+    def run(self, sources: Iterable[str], policy: Union[QualityPolicy, Callable[[str], QualityPolicy]] = None) -> Iterator[BatchResult]:
+        """
+        Downloads every video of the sources and yields the results in the order they finish.
+        If a source can't be read, for example a playlist which can't be loaded, the videos already queued
+        are finished and the error is raised
+        :param sources: video links, playlist links or files, see expandSources
+        :param policy: quality policy for every video or a function which returns the policy for a link
+        :return: results of the downloads
+        """
+        if policy is None:
+            policy = QualityPolicy()
+        if self._broker is not None:
+            yield from self._runBroker(sources, policy)
+            return
+
+        results: Queue = Queue()
+        slots: threading.BoundedSemaphore = threading.BoundedSemaphore(self._maxPending)
+        submitted: list = [0]  # Amount of submitted videos
+
+        def feed():
+            try:
+                for link in BatchDownloader.expandSources(sources):
+                    slots.acquire()  # Waits until there's room, so videos are created only when they can be queued
+                    jobPolicy: QualityPolicy = policy if isinstance(policy, QualityPolicy) else policy(link)
+                    self._submit(link, jobPolicy, lambda result: (slots.release(), results.put(result)))
+                    submitted[0] += 1
+            except Exception as e:
+                results.put(e)  # Raised by the reader, the feeder thread has no one to tell
+            finally:
+                results.put(None)  # Tells the reader that feeding has ended, after an error it put
+
+        threading.Thread(target=feed, name="batch-feeder", daemon=True).start()
+
+        fed: bool = False
+        error: Exception = None
+        received: int = 0
+        while not (fed and received == submitted[0]):
+            result: Union[BatchResult, Exception] = results.get()
+            if result is None:
+                fed = True
+            elif isinstance(result, Exception):
+                error = result
+            else:
+                received += 1
+                yield result
+        if error is not None:
+            raise error
+
+    def _runBroker(self, sources: Iterable[str], policy: Union[QualityPolicy, Callable[[str], QualityPolicy]]) -> Iterator[BatchResult]:
+        """
+        Queues the videos into the broker and yields their results as the workers finish them, see run
+        """
+        slots: threading.BoundedSemaphore = threading.BoundedSemaphore(self._maxPending)
+        lock: threading.Lock = threading.Lock()
+        pending: Dict[str, str] = {}  # Job id -> link
+        submitted: list = [0, False]  # Amount of submitted videos and whether every source has been read
+        errors: list = []  # Error which stopped the feeder
+
+        def feed():
+            try:
+                for link in BatchDownloader.expandSources(sources):
+                    slots.acquire()  # Keeps the broker from filling up with a long list
+                    jobPolicy: QualityPolicy = policy if isinstance(policy, QualityPolicy) else policy(link)
+                    jobId: str = uuid.uuid4().hex
+                    with lock:
+                        pending[jobId] = link
+                        submitted[0] += 1
+                    # Workers select the itags with the policy after fetching the options themselves
+                    try:
+                        self._broker.submit(jobId, {"link": link, "outputFolder": self._outputFolder, "title": link, "policy": jobPolicy.toDict(),
+                                                    "streamingMux": self._streamingMux, "outputMode": self._outputMode,
+                                                    "audioFormat": self._audioFormat}, Scheduler.PRIORITIES.LOW)
+                    except Exception:
+                        with lock:
+                            pending.pop(jobId, None)  # Never queued, so no result is waited for
+                            submitted[0] -= 1
+                        raise
+            except Exception as e:
+                errors.append(e)
+            finally:
+                submitted[1] = True
+
+        version: int = self._broker.getVersion()
+        threading.Thread(target=feed, name="batch-feeder", daemon=True).start()
+
+        received: int = 0
+        while not (submitted[1] and received == submitted[0]):
+            jobs, version = self._broker.getUpdates(version)
+            for job in jobs:
+                if job["state"] not in (Job.STATES.DONE, Job.STATES.FAILED, Job.STATES.CANCELLED):
+                    continue
+                with lock:
+                    link: str = pending.pop(job["jobId"], None)
+                if link is None:
+                    continue  # Job of another client of the broker
+                received += 1
+                slots.release()
+                result: dict = job["result"] or {}
+                yield BatchResult(link, job["state"], result.get("title", None), result.get("videoItag", None), result.get("audioItag", None))
+            time.sleep(self._pollInterval)
+        if errors:
+            raise errors[0]
+
+    def _submit(self, link: str, policy: QualityPolicy, onResult: Callable[[BatchResult], None]) -> Job:
+        """
+        Queues a single video
+        :param link: link to the video
+        :param policy: quality policy of the video
+        :param onResult: called with the result when the video is done, failed or cancelled
+        :return: the queued job
+        """
+        video: Video = Video(link)
+        video.setOutputFolderPath(self._outputFolder)
+        video.setStreamingMux(self._streamingMux)
+        video.setOutputMode(self._outputMode, self._audioFormat)
+        video.setOnVideoCombinedFunc(lambda jobId, success: None)
+        selected: list = [None, None]
+
+        def download() -> bool:
+            itags: Tuple[int, int] = policy.select(video)
+            if itags is None:
+                return False
+            selected[0], selected[1] = itags
+            return video.downloadStreams(selected[0], selected[1])
+
+        def finish(job: Job):
+            title: str = None
+            if video.getVideoOptions() is not None and len(video.getVideoOptions()) > 0:
+                title = video.getVideoOptions().first().title
+            onResult(BatchResult(link, job.getState(), title, selected[0], selected[1]))
+
+        if self._engine is not None:
+            return self._submitAsync(video, link, policy, onResult)
+
+        job: Job = Job([
+            (Scheduler.STAGES.METADATA, video.fetchOptions),
+            (Scheduler.STAGES.DOWNLOAD, download),
+            (Scheduler.STAGES.MUX, video.combineStreams, video.getMuxCores)
+        ], priority=Scheduler.PRIORITIES.LOW, jobId=video.getJobId())
+        job.setOnCancelFunc(video.cancel)
+        job.setOnCleanupFunc(video.discard)
+        job.setOnFinishFunc(finish)
+        return self._scheduler.submit(job)
+
+    def _submitAsync(self, video: Video, link: str, policy: QualityPolicy, onResult: Callable[[BatchResult], None]) -> Job:
+        """
+        Queues the options of a video into the scheduler, and downloads the video in the engine once they are fetched
+        """
+        def getTitle() -> str:
+            if video.getVideoOptions() is not None and len(video.getVideoOptions()) > 0:
+                return video.getVideoOptions().first().title
+            return None
+
+        def download(job: Job):
+            itags: Tuple[int, int] = policy.select(video) if job.getState() == Job.STATES.DONE else None
+            if itags is None:
+                state: str = job.getState() if job.getState() != Job.STATES.DONE else Job.STATES.FAILED
+                onResult(BatchResult(link, state, getTitle()))
+                return
+
+            def finish(future: Future):
+                try:
+                    state: str = Job.STATES.DONE if future.result() else Job.STATES.FAILED
+                except Exception as e:
+                    print(f"Download of {link} failed: {e}", file=sys.stderr)
+                    state = Job.STATES.FAILED
+                onResult(BatchResult(link, state, getTitle(), itags[0], itags[1]))
+
+            video.submitDownload(itags[0], itags[1]).add_done_callback(finish)
+
+        job: Job = Job([(Scheduler.STAGES.METADATA, video.fetchOptions)], priority=Scheduler.PRIORITIES.LOW, jobId=video.getJobId())
+        job.setOnCancelFunc(video.cancel)
+        job.setOnFinishFunc(download)
+        return self._scheduler.submit(job)
+
+
+def _parsePolicy(text: str) -> QualityPolicy:
+    try:
+        return QualityPolicy.parse(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))  # Shows which clause is wrong instead of a generic message
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Downloads many YouTube videos at once")
+    parser.add_argument("sources", nargs="*", default=["-"], help="video links, playlist links or files with one source per line. '-' reads standard input")
+    parser.add_argument("-o", "--output", default="downloads", help="folder for the downloaded videos")
+    parser.add_argument("--max-resolution", type=int, default=None, help="highest video height, for example 1080")
+    parser.add_argument("--max-abr", type=int, default=None, help="highest audio bitrate in kbps, for example 160")
+    parser.add_argument("--policy", type=_parsePolicy, default=None,
+                        help='quality policy such as "<=1080p, prefer avc1, max 500 MB, best abr <=160k". --max-resolution and --max-abr override it')
+    parser.add_argument("--metadata-workers", type=int, default=Scheduler.DEFAULT_LIMITS[Scheduler.STAGES.METADATA])
+    parser.add_argument("--download-workers", type=int, default=Scheduler.DEFAULT_LIMITS[Scheduler.STAGES.DOWNLOAD])
+    parser.add_argument("--mux-workers", type=int, default=Scheduler.DEFAULT_LIMITS[Scheduler.STAGES.MUX])
+    parser.add_argument("--streaming", action="store_true", help="combine while downloading, without temporary files")
+    parser.add_argument("--mode", choices=[Video.OUTPUT_MODES.COMBINED, Video.OUTPUT_MODES.PROGRESSIVE, Video.OUTPUT_MODES.AUDIO],
+                        default=Video.OUTPUT_MODES.COMBINED, help="progressive and audio download a single stream straight into the output folder")
+    parser.add_argument("--audio-format", choices=[Video.AUDIO_FORMATS.M4A, Video.AUDIO_FORMATS.OPUS, Video.AUDIO_FORMATS.MP3],
+                        default=Video.AUDIO_FORMATS.M4A, help="format of --mode audio")
+    parser.add_argument("--cores", type=int, default=None, help="cores all transcodes can use together, the amount of cores by default")
+    parser.add_argument("--transcode-threads", type=int, default=None, help="cores a single transcode can use, half of the cores by default")
+    parser.add_argument("--preset", default=TranscodeSettings.PRESETS.VERYFAST, help="x264 preset of transcoded video")
+    parser.add_argument("--hw-encoder", default=None, help="ffmpeg encoder for transcoded video, for example h264_nvenc")
+    parser.add_argument("--ffmpeg", default=None, help="path to ffmpeg, searched from PATH and the ffmpeg folder by default")
+    parser.add_argument("--mux-processes", type=int, default=4, help="how many ffmpeg processes can run at once")
+    parser.add_argument("--limit-rate", default=None, help="download rate of all videos together, for example 2M")
+    parser.add_argument("--limit-schedule", default=None, help="rates by the time of day, for example '08:00-18:00=1M,22:00-06:00=0'. 0 is unlimited")
+    parser.add_argument("--async", dest="async_engine", action="store_true",
+                        help="download and combine every queued video at once in an event loop instead of worker threads")
+    parser.add_argument("--workers", type=int, default=0, help="downloads in this many worker processes through the broker")
+    parser.add_argument("--broker", default=None, help="queues videos into this broker database. Without --workers, "
+                                                       "they are downloaded by workers started with Worker.py")
+    parser.add_argument("--write-buffer", default="1M", help="bytes collected before a download writes them, for example 4M")
+    parser.add_argument("--no-preallocate", action="store_true", help="don't reserve the blocks of a file before writing it")
+    parser.add_argument("--sync", choices=[SinkSettings.SYNC.NONE, SinkSettings.SYNC.CLOSE, SinkSettings.SYNC.JOURNAL], default=SinkSettings.SYNC.NONE,
+                        help="when written bytes are synced to the disk. close syncs every finished file, journal also every journaled part")
+    parser.add_argument("--direct-io", action="store_true", help="write downloads past the page cache where the platform supports it")
+    parser.add_argument("--pool-size", type=int, default=32, help="how many connections are kept open for reuse per host")
+    parser.add_argument("--no-store", action="store_true", help="download every video even if the same video has been downloaded before")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serves Prometheus metrics at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-file", default=None, help="appends timing of every stage of every video as json lines")
+    return parser.parse_args(arguments)
+
+
+def configureDownloads(arguments: argparse.Namespace) -> bool:
+    """
+    Applies the download settings of the command line to Video and the modules it uses. Worker processes call it too
+    :param arguments: parsed command line arguments
+    :return: whether ffmpeg was found
+    """
+    Video.setDownloadWorkers(2 * arguments.download_workers)  # Both streams of every running download get a thread
+    Video.setTranscodeSettings(TranscodeSettings(arguments.transcode_threads, arguments.preset, hardwareEncoder=arguments.hw_encoder))
+
+    muxer = Muxer(arguments.ffmpeg, maxProcesses=arguments.mux_processes)
+    if not muxer.isAvailable():
+        print("Couldn't find ffmpeg, install it or give its path with --ffmpeg", file=sys.stderr)
+        return False
+    Video.setMuxer(muxer)
+    if arguments.no_store:
+        Video.setArtifactStore(None)
+
+    Transfer.configureSession(poolSize=arguments.pool_size)
+    Sink.configure(SinkSettings(int(parseRate(arguments.write_buffer) or 0), not arguments.no_preallocate, arguments.sync, arguments.direct_io))
+
+    if arguments.limit_rate is not None:
+        Video.getBandwidthLimiter().setRate(parseRate(arguments.limit_rate))
+    if arguments.limit_schedule is not None:
+        rules = []
+        for rule in arguments.limit_schedule.split(","):
+            times, rate = rule.split("=")
+            start, end = times.split("-")
+            rules.append((start.strip(), end.strip(), parseRate(rate)))
+        Video.getBandwidthLimiter().setSchedule(rules)
+    return True
+
+
+def runBatch(arguments: argparse.Namespace) -> int:
+    """
+    Downloads the sources given on the command line and prints a json line per finished video
+    :param arguments: parsed command line arguments
+    :return: exit code, 1 if any download failed, 2 if ffmpeg is missing or a source couldn't be read
+    """
+    scheduler = Scheduler({
+        Scheduler.STAGES.METADATA: arguments.metadata_workers,
+        Scheduler.STAGES.DOWNLOAD: arguments.download_workers,
+        Scheduler.STAGES.MUX: arguments.mux_workers
+    }, coreBudget=arguments.cores)
+    if not configureDownloads(arguments):
+        return 2
+    muxer: Muxer = Video.getMuxer()
+    metrics.addCollector(scheduler.collectMetrics)
+    if arguments.metrics_port is not None:
+        metrics.serve(arguments.metrics_port)
+    if arguments.metrics_file is not None:
+        metrics.setJsonLinesPath(arguments.metrics_file)
+
+    engine: AsyncEngine = None
+    if arguments.async_engine:
+        # Every pending video can be transferring, so the pool fits both streams of the 64 pending videos
+        engine = AsyncEngine(maxConnectionsPerHost=max(arguments.pool_size, 2 * 64), maxProcesses=arguments.mux_processes, muxer=muxer).start()
+        Video.setAsyncEngine(engine)
+        metrics.addCollector(engine.collectMetrics)
+
+    broker: Broker = None
+    if arguments.workers > 0 or arguments.broker is not None:
+        brokerPath: str = arguments.broker if arguments.broker is not None else "broker.db"
+        broker = Broker(brokerPath)
+        metrics.addCollector(broker.collectMetrics)
+        if arguments.workers > 0:
+            startWorkers(arguments.workers, brokerPath, initializer=configureDownloads, initArgs=(arguments,))
+    else:
+        Video.sweepTempFiles()  # Workers may be using the temporary folder of a broker
+
+    downloader = BatchDownloader(arguments.output, scheduler, streamingMux=arguments.streaming, engine=engine, broker=broker,
+                                 outputMode=arguments.mode, audioFormat=arguments.audio_format)
+    policy: QualityPolicy = arguments.policy if arguments.policy is not None else QualityPolicy()
+    if arguments.max_resolution is not None:
+        policy.setMaxResolution(arguments.max_resolution)
+    if arguments.max_abr is not None:
+        policy.setMaxAudioBitrate(arguments.max_abr)
+
+    failed: int = 0
+    try:
+        for result in downloader.run(arguments.sources, policy):
+            if not result.isSuccessful():
+                failed += 1
+            print(json.dumps(result.toDict()), flush=True)
+    except Exception as e:
+        print(f"Couldn't read the sources: {e}", file=sys.stderr)
+        return 2
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(runBatch(parseArguments()))
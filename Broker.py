@@ -0,0 +1,221 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from Scheduler import Job
+
+
+class Broker:
+    # Every change of a job gets a higher version, so watchers find changes without trusting the clocks of other hosts.
+    # Writes hold the write lock, so two changes never get the same version
+    NEXT_VERSION: str = "(SELECT COALESCE(MAX(version), 0) + 1 FROM jobs)"
+
+    def __init__(self, path: str = "broker.db", heartbeatTimeout: float = 30, maxAttempts: int = 3, sharedFileSystem: bool = False):
+        """
+        Queue of download jobs kept in a SQLite database, which worker processes claim jobs from.
+        Workers send heartbeats while they work, and a job whose worker stops sending them is given to another worker
+        :param path: path to the database file. Workers of other hosts need it on a file system they all can lock
+        :param heartbeatTimeout: seconds without a heartbeat after which a running job is taken back from its worker.
+            Hosts sharing a broker need clocks which agree within a fraction of it
+        :param maxAttempts: how many times a job is tried before it fails for good
+        :param sharedFileSystem: whether the database is on a network file system. Write-ahead logging only works on a single host
+        """
+        self._path: str = path
+        self._heartbeatTimeout: float = heartbeatTimeout
+        self._maxAttempts: int = maxAttempts
+        self._sharedFileSystem: bool = sharedFileSystem
+        self._local: threading.local = threading.local()  # SQLite connections can't be shared by threads
+
+        with self._transaction() as connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                jobId TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                heartbeat REAL,
+                progress TEXT,
+                error TEXT,
+                result TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                version INTEGER NOT NULL)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobsByState ON jobs (state, priority, created)")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobsByVersion ON jobs (version)")
+
+    def _getConnection(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Waits for the lock of a writer of another process instead of failing right away
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=" + ("DELETE" if self._sharedFileSystem else "WAL"))
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Runs the statements of a with block in a write transaction, which is rolled back if the block fails
+        """
+        connection: sqlite3.Connection = self._getConnection()
+        connection.execute("BEGIN IMMEDIATE")  # Takes the write lock first, so two workers can't claim the same job
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def submit(self, jobId: str, data: Dict, priority: int = 5):
+        """
+        Queues a job. A job with the same id replaces the earlier one
+        :param jobId: id of the job
+        :param data: json serializable description of the job, see Worker
+        :param priority: smaller priorities are claimed first
+        """
+        now: float = time.time()
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO jobs (jobId, data, priority, state, attempts, created, updated, version) "
+                               f"VALUES (?, ?, ?, ?, 0, ?, ?, {Broker.NEXT_VERSION})",
+                               (jobId, json.dumps(data), priority, Job.STATES.QUEUED, now, now))
+
+    def claim(self, workerId: str) -> Tuple[str, Dict]:
+        """
+        Gives the next queued job to a worker. Jobs of workers which have stopped sending heartbeats are queued again first
+        :param workerId: id of the worker
+        :return: (job id, data) or None if no job is queued
+        """
+        self.reap()
+        now: float = time.time()
+        with self._transaction() as connection:
+            row = connection.execute("SELECT jobId, data FROM jobs WHERE state = ? ORDER BY priority, created LIMIT 1", (Job.STATES.QUEUED,)).fetchone()
+            if row is not None:
+                connection.execute(f"UPDATE jobs SET state = ?, worker = ?, attempts = attempts + 1, heartbeat = ?, updated = ?, "
+                                   f"version = {Broker.NEXT_VERSION} WHERE jobId = ?", (Job.STATES.RUNNING, workerId, now, now, row[0]))
+        return (row[0], json.loads(row[1])) if row is not None else None
+
+    def heartbeat(self, workerId: str, jobId: str, progress: Dict = None) -> bool:
+        """
+        Tells that a worker is still working on a job
+        :param workerId: id of the worker
+        :param jobId: id of the job
+        :param progress: json serializable progress of the job, shown by whoever submitted it
+        :return: whether the worker should continue. False if the job was cancelled or given to another worker
+        """
+        now: float = time.time()
+        with self._transaction() as connection:
+            updated: int = connection.execute("UPDATE jobs SET heartbeat = ?, progress = COALESCE(?, progress), updated = ?, "
+                                              f"version = {Broker.NEXT_VERSION} WHERE jobId = ? AND worker = ? AND state = ?",
+                                              (now, json.dumps(progress) if progress is not None else None, now, jobId, workerId, Job.STATES.RUNNING)).rowcount
+        return updated > 0
+
+    def finish(self, workerId: str, jobId: str, success: bool, error: str = None, result: Dict = None) -> str:
+        """
+        Records the result of a job. A failed job is queued again until it has been tried maxAttempts times
+        :param workerId: id of the worker
+        :param jobId: id of the job
+        :param success: whether the job succeeded
+        :param error: why the job failed
+        :param result: json serializable details of the result, for example the title of the video
+        :return: the new state of the job, None if the job doesn't belong to the worker anymore
+        """
+        now: float = time.time()
+        with self._transaction() as connection:
+            row = connection.execute("SELECT attempts FROM jobs WHERE jobId = ? AND worker = ? AND state = ?",
+                                     (jobId, workerId, Job.STATES.RUNNING)).fetchone()
+            state: str = None
+            if row is not None:
+                if success:
+                    state = Job.STATES.DONE
+                else:
+                    state = Job.STATES.QUEUED if row[0] < self._maxAttempts else Job.STATES.FAILED
+                connection.execute(f"UPDATE jobs SET state = ?, worker = NULL, error = ?, result = ?, updated = ?, version = {Broker.NEXT_VERSION} "
+                                   "WHERE jobId = ?", (state, error, json.dumps(result) if result is not None else None, now, jobId))
+        return state
+
+    def cancel(self, jobId: str) -> bool:
+        """
+        Cancels a queued or running job. A running job stops at its next heartbeat
+        :param jobId: id of the job
+        :return: whether the job was unfinished
+        """
+        now: float = time.time()
+        with self._transaction() as connection:
+            updated: int = connection.execute(f"UPDATE jobs SET state = ?, worker = NULL, updated = ?, version = {Broker.NEXT_VERSION} "
+                                              "WHERE jobId = ? AND state IN (?, ?)",
+                                              (Job.STATES.CANCELLED, now, jobId, Job.STATES.QUEUED, Job.STATES.RUNNING)).rowcount
+        return updated > 0
+
+    def reap(self) -> int:
+        """
+        Takes running jobs back from workers which haven't sent a heartbeat in time, for example because they crashed
+        :return: how many jobs were taken back
+        """
+        now: float = time.time()
+        with self._transaction() as connection:
+            # A job which keeps killing its workers fails for good like any other failing job
+            reaped: int = connection.execute("UPDATE jobs SET state = CASE WHEN attempts < ? THEN ? ELSE ? END, worker = NULL, "
+                                             f"error = 'Worker stopped sending heartbeats', updated = ?, version = {Broker.NEXT_VERSION} WHERE state = ? AND heartbeat < ?",
+                                             (self._maxAttempts, Job.STATES.QUEUED, Job.STATES.FAILED, now, Job.STATES.RUNNING,
+                                              now - self._heartbeatTimeout)).rowcount
+        return reaped
+
+    def getUpdates(self, sinceVersion: int = 0) -> Tuple[List[Dict], int]:
+        """
+        Returns the jobs which have changed since an earlier call
+        :param sinceVersion: version returned by the previous call, 0 for every job
+        :return: (list of jobs with jobId, data, state, attempts, progress, error and result, version to pass to the next call)
+        """
+        rows = self._getConnection().execute("SELECT jobId, data, state, attempts, progress, error, result, version FROM jobs "
+                                             "WHERE version > ? ORDER BY version", (sinceVersion,)).fetchall()
+        jobs: List[Dict] = [{"jobId": row[0], "data": json.loads(row[1]), "state": row[2], "attempts": row[3],
+                             "progress": json.loads(row[4]) if row[4] is not None else None, "error": row[5],
+                             "result": json.loads(row[6]) if row[6] is not None else None} for row in rows]
+        return jobs, rows[-1][7] if rows else sinceVersion
+
+    def getVersion(self) -> int:
+        """
+        Returns the version of the latest change, so a watcher can start from now with getUpdates
+        """
+        return self._getConnection().execute("SELECT COALESCE(MAX(version), 0) FROM jobs").fetchone()[0]
+
+    def getUnfinishedJobs(self) -> List[Dict]:
+        """
+        Returns queued and running jobs, for example to show them after a restart
+        :return: list of dictionaries with jobId and data
+        """
+        rows = self._getConnection().execute("SELECT jobId, data FROM jobs WHERE state IN (?, ?) ORDER BY priority, created",
+                                             (Job.STATES.QUEUED, Job.STATES.RUNNING)).fetchall()
+        return [{"jobId": row[0], "data": json.loads(row[1])} for row in rows]
+
+    def removeFinished(self, olderThan: float = 24 * 3600) -> int:
+        """
+        Removes done, failed and cancelled jobs so the database doesn't grow forever
+        :param olderThan: seconds since the job finished
+        :return: how many jobs were removed
+        """
+        with self._transaction() as connection:
+            removed: int = connection.execute("DELETE FROM jobs WHERE state NOT IN (?, ?) AND updated < ?",
+                                              (Job.STATES.QUEUED, Job.STATES.RUNNING, time.time() - olderThan)).rowcount
+        return removed
+
+    def getCounts(self) -> Dict[str, int]:
+        """
+        Returns how many jobs are in each state
+        """
+        rows = self._getConnection().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def collectMetrics(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """
+        Returns the amount of jobs per state in the form Metrics.addCollector expects
+        :return: list of (metric name, labels, value)
+        """
+        counts: Dict[str, int] = self.getCounts()
+        return [("broker_jobs", {"state": state}, counts.get(state, 0))
+                for state in (Job.STATES.QUEUED, Job.STATES.RUNNING, Job.STATES.DONE, Job.STATES.FAILED, Job.STATES.CANCELLED)]
@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+
+class MetadataCache:
+    def __init__(self, cacheFolder: str = None, ttl: float = 3600, maxEntries: int = 256, maxDiskEntries: int = 4096):
+        """
+        Caches video metadata in memory and optionally on disk. Least recently used entries are evicted first
+        :param cacheFolder: folder for the disk layer. If None, entries are only kept in memory
+        :param ttl: how many seconds an entry stays valid
+        :param maxEntries: how many entries are kept in memory
+        :param maxDiskEntries: how many entries are kept on disk
+        """
+        self._cacheFolder: str = cacheFolder
+        self._ttl: float = ttl
+        self._maxEntries: int = maxEntries
+        self._maxDiskEntries: int = maxDiskEntries
+
+        self._lock: threading.Lock = threading.Lock()
+        self._entries: OrderedDict[str, Tuple[float, Dict]] = OrderedDict()  # Key -> (expiry time, entry), oldest first
+        self._diskEntries: int = None  # Counted once when the disk layer is first used
+
+        self._memoryHits: int = 0
+        self._diskHits: int = 0
+        self._misses: int = 0
+
+    def _getDiskPath(self, key: str) -> str:
+        return os.path.join(self._cacheFolder, key + ".json")
+
+    def get(self, key: str) -> Dict:
+        """
+        Returns a cached entry
+        :param key: key of the entry, for example a video id
+        :return: the entry or None if it isn't cached or has expired
+        """
+        now: float = time.time()
+        with self._lock:
+            cached = self._entries.get(key, None)
+            if cached is not None:
+                if cached[0] > now:
+                    self._entries.move_to_end(key)
+                    self._memoryHits += 1
+                    return cached[1]
+                del self._entries[key]
+
+        cached = self._readDisk(key, now)
+        with self._lock:
+            if cached is None:
+                self._misses += 1
+                return None
+            self._diskHits += 1
+            self._remember(key, cached[0], cached[1])
+        return cached[1]
+
+    def put(self, key: str, entry: Dict, ttl: float = None):
+        """
+        Caches an entry
+        :param key: key of the entry, for example a video id
+        :param entry: json serializable entry
+        :param ttl: how many seconds this entry stays valid. If None, uses the default of the cache
+        """
+        expiresAt: float = time.time() + (self._ttl if ttl is None else min(ttl, self._ttl))
+        with self._lock:
+            self._remember(key, expiresAt, entry)
+        self._writeDisk(key, expiresAt, entry)
+
+    def invalidate(self, key: str = None):
+        """
+        Removes an entry from memory and disk
+        :param key: key of the entry. If None, removes every entry
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+        if self._cacheFolder is None or not os.path.exists(self._cacheFolder):
+            return
+
+        keys = [key] if key is not None else [os.path.splitext(file)[0] for file in os.listdir(self._cacheFolder)]
+        for k in keys:
+            self._removeDisk(k)
+
+    def getStats(self) -> Dict[str, int]:
+        """
+        Returns hit and miss counters of the cache
+        :return: dictionary of counters
+        """
+        with self._lock:
+            return {
+                "hits": self._memoryHits + self._diskHits,
+                "memoryHits": self._memoryHits,
+                "diskHits": self._diskHits,
+                "misses": self._misses,
+                "entries": len(self._entries)
+            }
+
+    def _remember(self, key: str, expiresAt: float, entry: Dict):
+        """
+        Adds an entry to the memory layer. Lock must be held
+        """
+        self._entries[key] = (expiresAt, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxEntries:
+            self._entries.popitem(last=False)
+
+    def _readDisk(self, key: str, now: float) -> Tuple[float, Dict]:
+        if self._cacheFolder is None:
+            return None
+
+        path: str = self._getDiskPath(key)
+        try:
+            with open(path, "r") as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if saved.get("expiresAt", 0) <= now:
+            self._removeDisk(key)
+            return None
+
+        os.utime(path)  # Modification time tells which disk entries were used least recently
+        return saved["expiresAt"], saved["entry"]
+
+    def _writeDisk(self, key: str, expiresAt: float, entry: Dict):
+        if self._cacheFolder is None:
+            return
+
+        os.makedirs(self._cacheFolder, exist_ok=True)
+        path: str = self._getDiskPath(key)
+        existed: bool = os.path.exists(path)
+
+        # Writes to a temporary file first so readers never see a half written entry
+        tempPath: str = f"{path}.{threading.get_ident()}.tmp"
+        with open(tempPath, "w") as file:
+            json.dump({"expiresAt": expiresAt, "entry": entry}, file)
+        os.replace(tempPath, path)
+
+        with self._lock:
+            if self._diskEntries is None:
+                self._diskEntries = len(os.listdir(self._cacheFolder))
+            elif not existed:
+                self._diskEntries += 1
+            evict: bool = self._diskEntries > self._maxDiskEntries
+
+        if evict:
+            self._evictDisk()
+
+    def _removeDisk(self, key: str):
+        try:
+            os.remove(self._getDiskPath(key))
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._diskEntries is not None:
+                self._diskEntries -= 1
+
+    def _evictDisk(self):
+        """
+        Removes the least recently used tenth of the disk entries, so eviction doesn't run on every write
+        """
+        files = []
+        for entry in os.scandir(self._cacheFolder):
+            if entry.name.endswith(".json"):
+                files.append((entry.stat().st_mtime, os.path.splitext(entry.name)[0]))
+        files.sort()
+
+        keepCount: int = self._maxDiskEntries - self._maxDiskEntries // 10
+        for _, key in files[:max(0, len(files) - keepCount)]:
+            self._removeDisk(key)
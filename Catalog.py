@@ -0,0 +1,343 @@
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import pytube
+
+from Transcode import Transcoder
+
+
+def _qualityNumber(quality: str) -> int:
+    """
+    Turns a quality such as "1080p" or "128kbps" into a number
+    :param quality: the quality
+    :return: the number or 0 if quality is empty
+    """
+    if not quality:
+        return 0
+    return int("".join(c for c in quality if c.isdigit()) or 0)
+
+
+def _codecFamily(codec: str) -> str:
+    """
+    Turns a codec such as "avc1.640028" or "mp4a.40.2" into its family, for example "avc1"
+    """
+    return codec.split(".")[0].lower() if codec else ""
+
+
+class StreamCatalog:
+    def __init__(self, videoOptions: Sequence[pytube.Stream], audioOptions: Sequence[pytube.Stream]):
+        """
+        Indexes the streams of a video once, so options can be listed and looked up without filtering the streams again.
+        Streams of every index are ordered from best to worst
+        :param videoOptions: video streams. Progressive streams, which have audio too, are indexed apart since they are never combined
+        :param audioOptions: audio streams
+        """
+        self._byItag: Dict[int, pytube.Stream] = {}
+        self._videoByResolution: Dict[int, List[pytube.Stream]] = {}
+        self._videoByFps: Dict[int, List[pytube.Stream]] = {}
+        self._videoByCodec: Dict[str, List[pytube.Stream]] = {}
+        self._audioByBitrate: Dict[int, List[pytube.Stream]] = {}
+        self._audioByCodec: Dict[str, List[pytube.Stream]] = {}
+        self._progressiveByResolution: Dict[int, List[pytube.Stream]] = {}
+
+        videoStreams: List[pytube.Stream] = sorted((stream for stream in videoOptions if not stream.is_progressive), key=StreamCatalog._videoRank)
+        audioStreams: List[pytube.Stream] = sorted(audioOptions, key=StreamCatalog._audioRank)
+        progressiveStreams: List[pytube.Stream] = sorted((stream for stream in videoOptions if stream.is_progressive), key=StreamCatalog._videoRank)
+        for stream in videoStreams:
+            self._byItag[stream.itag] = stream
+            self._videoByResolution.setdefault(_qualityNumber(stream.resolution), []).append(stream)
+            self._videoByFps.setdefault(getattr(stream, "fps", 0) or 0, []).append(stream)
+            self._videoByCodec.setdefault(_codecFamily(stream.video_codec), []).append(stream)
+        for stream in audioStreams:
+            self._byItag[stream.itag] = stream
+            self._audioByBitrate.setdefault(_qualityNumber(stream.abr), []).append(stream)
+            self._audioByCodec.setdefault(_codecFamily(stream.audio_codec), []).append(stream)
+        for stream in progressiveStreams:
+            self._byItag[stream.itag] = stream
+            self._progressiveByResolution.setdefault(_qualityNumber(stream.resolution), []).append(stream)
+
+        # Labels shown by the interface, from best to worst
+        self._resolutionKeys: List[int] = sorted(self._videoByResolution, reverse=True)
+        self._bitrateKeys: List[int] = sorted(self._audioByBitrate, reverse=True)
+        self._progressiveKeys: List[int] = sorted(self._progressiveByResolution, reverse=True)
+        self._resolutions: List[str] = [self._videoByResolution[key][0].resolution for key in self._resolutionKeys]
+        self._audioBitrates: List[str] = [self._audioByBitrate[key][0].abr for key in self._bitrateKeys]
+        self._progressiveResolutions: List[str] = [self._progressiveByResolution[key][0].resolution for key in self._progressiveKeys]
+
+    @staticmethod
+    def _videoRank(stream: pytube.Stream) -> Tuple[int, int, int]:
+        return -_qualityNumber(stream.resolution), -(getattr(stream, "fps", 0) or 0), -(stream.bitrate or 0)
+
+    @staticmethod
+    def _audioRank(stream: pytube.Stream) -> Tuple[int, int]:
+        return -_qualityNumber(stream.abr), -(stream.bitrate or 0)
+
+    @staticmethod
+    def estimateSize(stream: pytube.Stream) -> int:
+        """
+        Returns the size of a stream without making a request
+        :param stream: the stream
+        :return: the size in bytes, estimated from the bitrate and duration if the size isn't known. 0 if neither is known
+        """
+        if stream._filesize:  # The filesize property would make a request for streams without a known size
+            return stream._filesize
+        duration = stream._monostate.duration
+        return int(duration * stream.bitrate / 8) if duration and stream.bitrate else 0
+
+    def getResolutions(self) -> List[str]:
+        return self._resolutions
+
+    def getAudioBitrates(self) -> List[str]:
+        return self._audioBitrates
+
+    def getProgressiveResolutions(self) -> List[str]:
+        return self._progressiveResolutions
+
+    def getProgressiveKeys(self) -> List[int]:
+        """
+        Returns the heights of progressive streams from best to worst
+        """
+        return self._progressiveKeys
+
+    def getProgressiveStream(self, resolution: str) -> pytube.Stream:
+        """
+        Returns the best progressive stream of a resolution, for example "360p"
+        :return: the stream or None if there's none with the resolution
+        """
+        streams: List[pytube.Stream] = self._progressiveByResolution.get(_qualityNumber(resolution), None)
+        return streams[0] if streams else None
+
+    def getProgressiveStreams(self, resolution: str) -> List[pytube.Stream]:
+        return self._progressiveByResolution.get(_qualityNumber(resolution), [])
+
+    def getByItag(self, itag: int) -> pytube.Stream:
+        return self._byItag.get(int(itag), None)
+
+    def getVideoStreams(self, resolution: str = None, fps: int = None, codec: str = None) -> List[pytube.Stream]:
+        """
+        Returns the video streams with a resolution, fps and codec family, for example "1080p", 60 or "avc1"
+        :return: the streams from best to worst
+        """
+        if resolution is not None:
+            streams: List[pytube.Stream] = self._videoByResolution.get(_qualityNumber(resolution), [])
+        elif fps is not None:
+            streams = self._videoByFps.get(fps, [])
+        elif codec is not None:
+            streams = self._videoByCodec.get(codec.lower(), [])
+        else:
+            streams = [stream for key in self._resolutionKeys for stream in self._videoByResolution[key]]
+        # Only the streams of the looked up index are filtered further
+        return [stream for stream in streams if (fps is None or (getattr(stream, "fps", 0) or 0) == fps)
+                and (codec is None or _codecFamily(stream.video_codec) == codec.lower())]
+
+    def getAudioStreams(self, abr: str = None, codec: str = None) -> List[pytube.Stream]:
+        """
+        Returns the audio streams with a bitrate and codec family, for example "160kbps" or "opus"
+        :return: the streams from best to worst
+        """
+        if abr is not None:
+            streams: List[pytube.Stream] = self._audioByBitrate.get(_qualityNumber(abr), [])
+        elif codec is not None:
+            streams = self._audioByCodec.get(codec.lower(), [])
+        else:
+            streams = [stream for key in self._bitrateKeys for stream in self._audioByBitrate[key]]
+        return [stream for stream in streams if codec is None or _codecFamily(stream.audio_codec) == codec.lower()]
+
+    def getVideoStream(self, resolution: str) -> pytube.Stream:
+        """
+        Returns the best video stream of a resolution, for example "1080p"
+        :return: the stream or None if there's none with the resolution
+        """
+        streams: List[pytube.Stream] = self._videoByResolution.get(_qualityNumber(resolution), None)
+        return streams[0] if streams else None
+
+    def getAudioStream(self, abr: str) -> pytube.Stream:
+        """
+        Returns the best audio stream of a bitrate, for example "160kbps"
+        :return: the stream or None if there's none with the bitrate
+        """
+        streams: List[pytube.Stream] = self._audioByBitrate.get(_qualityNumber(abr), None)
+        return streams[0] if streams else None
+
+    def getResolutionKeys(self) -> List[int]:
+        """
+        Returns the video heights from best to worst, for example [1080, 720]
+        """
+        return self._resolutionKeys
+
+    def getBitrateKeys(self) -> List[int]:
+        """
+        Returns the audio bitrates in kbps from best to worst, for example [160, 128]
+        """
+        return self._bitrateKeys
+
+
+class QualityPolicy:
+    # Clauses of a policy text such as "<=1080p, prefer avc1, max 500 MB, best abr <=160k"
+    _RESOLUTION = re.compile(r"^(?:max\s*|<=\s*|≤\s*)(\d+)p$")
+    _FPS = re.compile(r"^(?:max\s*|<=\s*|≤\s*)(\d+)\s*fps$")
+    _SIZE = re.compile(r"^(?:max\s*|<=\s*|≤\s*)(\d+(?:\.\d+)?)\s*([kmg])i?b$")
+    _BITRATE = re.compile(r"^(?:best\s+)?(?:abr\s*)?(?:max\s*|<=\s*|≤\s*)(\d+)\s*k(?:bps)?$")
+    _PREFER = re.compile(r"^prefer\s+([\w.]+(?:\s*[/ ]\s*[\w.]+)*)$")
+
+    def __init__(self, maxResolution: int = None, maxAudioBitrate: int = None, preferredCodecs: Sequence[str] = (), maxSize: int = None,
+                 maxFps: int = None):
+        """
+        Picks the best video and audio options within limits
+        :param maxResolution: highest allowed video height, for example 1080. If None, there's no limit
+        :param maxAudioBitrate: highest allowed audio bitrate in kbps, for example 160. If None, there's no limit
+        :param preferredCodecs: codec families such as "avc1" or "opus", first is preferred the most.
+            They only choose between streams of the same resolution or bitrate
+        :param maxSize: highest estimated size of both streams together in bytes. If None, there's no limit
+        :param maxFps: highest allowed frame rate. If None, there's no limit
+        """
+        self._maxResolution: int = maxResolution
+        self._maxAudioBitrate: int = maxAudioBitrate
+        self._preferredCodecs: List[str] = [codec.lower() for codec in preferredCodecs]
+        self._maxSize: int = maxSize
+        self._maxFps: int = maxFps
+
+    def setMaxResolution(self, maxResolution: int):
+        self._maxResolution = maxResolution
+
+    def setMaxAudioBitrate(self, maxAudioBitrate: int):
+        self._maxAudioBitrate = maxAudioBitrate
+
+    @staticmethod
+    def parse(text: str) -> "QualityPolicy":
+        """
+        Creates a policy from comma separated clauses, for example "<=1080p, prefer avc1, max 500 MB, best abr <=160k".
+        Clauses are "<=1080p", "<=30fps", "prefer avc1" (several codecs separated by "/"), "max 500 MB" and "abr <=160k".
+        "max" can be used instead of "<="
+        :param text: the policy. An empty text has no limits
+        :return: the policy
+        :raise ValueError: if a clause isn't understood
+        """
+        policy: QualityPolicy = QualityPolicy()
+        for clause in text.split(","):
+            clause = " ".join(clause.strip().lower().split())
+            if not clause:
+                continue
+            resolution = QualityPolicy._RESOLUTION.match(clause)
+            fps = QualityPolicy._FPS.match(clause)
+            size = QualityPolicy._SIZE.match(clause.replace(" ", ""))
+            bitrate = QualityPolicy._BITRATE.match(clause)
+            prefer = QualityPolicy._PREFER.match(clause)
+            if resolution is not None:
+                policy._maxResolution = int(resolution.group(1))
+            elif fps is not None:
+                policy._maxFps = int(fps.group(1))
+            elif size is not None:
+                policy._maxSize = int(float(size.group(1)) * 1024 ** ("kmg".index(size.group(2)) + 1))
+            elif bitrate is not None:
+                policy._maxAudioBitrate = int(bitrate.group(1))
+            elif prefer is not None:
+                policy._preferredCodecs += re.split(r"\s*[/ ]\s*", prefer.group(1))
+            else:
+                raise ValueError(f"Unknown quality clause: {clause}")
+        return policy
+
+    def _codecRank(self, codec: str) -> int:
+        family: str = _codecFamily(codec)
+        return self._preferredCodecs.index(family) if family in self._preferredCodecs else len(self._preferredCodecs)
+
+    def _rankedVideoStreams(self, catalog: StreamCatalog, progressive: bool = False) -> List[pytube.Stream]:
+        streams: List[pytube.Stream] = []
+        for resolution in catalog.getProgressiveKeys() if progressive else catalog.getResolutionKeys():
+            if self._maxResolution is not None and resolution > self._maxResolution:
+                continue
+            # The catalog keeps streams of a resolution from best to worst, and sorting is stable
+            found: List[pytube.Stream] = [stream for stream in (catalog.getProgressiveStreams if progressive else catalog.getVideoStreams)(f"{resolution}p")
+                                          if self._maxFps is None or (getattr(stream, "fps", 0) or 0) <= self._maxFps]
+            streams += sorted(found, key=lambda stream: self._codecRank(stream.video_codec))
+        return streams
+
+    def _rankedAudioStreams(self, catalog: StreamCatalog, copyCodecs: Sequence[str] = ()) -> List[pytube.Stream]:
+        streams: List[pytube.Stream] = []
+        for bitrate in catalog.getBitrateKeys():
+            if self._maxAudioBitrate is not None and bitrate > self._maxAudioBitrate:
+                continue
+            streams += sorted(catalog.getAudioStreams(f"{bitrate}kbps"), key=lambda stream: self._codecRank(stream.audio_codec))
+        # Copying a lower bitrate keeps more quality than encoding a higher one again
+        copied: List[pytube.Stream] = [stream for stream in streams if _codecFamily(stream.audio_codec) in copyCodecs]
+        return copied if copied else streams
+
+    def _firstFitting(self, streams: List[pytube.Stream]) -> int:
+        """
+        Returns the itag of the best stream within the size limit or None
+        """
+        for stream in streams:
+            if self._maxSize is None or StreamCatalog.estimateSize(stream) <= self._maxSize:
+                return stream.itag
+        return None
+
+    def selectProgressiveFromCatalog(self, catalog: StreamCatalog) -> int:
+        """
+        Selects a progressive option, which has both video and audio, from a catalog
+        :return: the itag or None if no option fits the limits
+        """
+        return self._firstFitting(self._rankedVideoStreams(catalog, progressive=True))
+
+    def selectAudioFromCatalog(self, catalog: StreamCatalog, copyCodecs: Sequence[str] = ()) -> int:
+        """
+        Selects an audio option from a catalog for an audio-only download
+        :param catalog: the catalog of a video
+        :param copyCodecs: codec families the output format holds without encoding. They are selected over better options which would be encoded
+        :return: the itag or None if no option fits the limits
+        """
+        return self._firstFitting(self._rankedAudioStreams(catalog, copyCodecs))
+
+    def selectFromCatalog(self, catalog: StreamCatalog, copyCodecs: Sequence[str] = Transcoder.MP4_AUDIO_CODECS) -> Tuple[int, int]:
+        """
+        Selects the video and audio option from a catalog
+        :param catalog: the catalog of a video
+        :param copyCodecs: audio codec families the combined file holds without encoding. They are selected over better options
+            which would be encoded, such as opus, so the audio of a combined download is copied when it can be
+        :return: video and audio itag or None if no option fits the limits
+        """
+        videoStreams: List[pytube.Stream] = self._rankedVideoStreams(catalog)
+        audioStreams: List[pytube.Stream] = self._rankedAudioStreams(catalog, copyCodecs)
+        if len(videoStreams) == 0 or len(audioStreams) == 0:
+            return None
+        if self._maxSize is None:
+            return videoStreams[0].itag, audioStreams[0].itag
+
+        # The best video which fits with some audio wins, video matters more than audio
+        audioSizes: List[Tuple[pytube.Stream, int]] = [(stream, StreamCatalog.estimateSize(stream)) for stream in audioStreams]
+        for videoStream in videoStreams:
+            room: int = self._maxSize - StreamCatalog.estimateSize(videoStream)
+            for audioStream, audioSize in audioSizes:
+                if audioSize <= room:
+                    return videoStream.itag, audioStream.itag
+        return None
+
+    def select(self, video) -> Tuple[int, int]:
+        """
+        Selects the video and audio option of a video whose options are fetched, for the output mode of the video
+        :param video: the video, see Download.Video
+        :return: video and audio itag or None if no option fits the limits. The itag a progressive or audio-only download doesn't use is None
+        """
+        from Download import Video  # Download imports this module
+        catalog: StreamCatalog = video.getCatalog()
+        if catalog is None:
+            return None
+
+        if video.getOutputMode() == Video.OUTPUT_MODES.PROGRESSIVE:
+            itag: int = self.selectProgressiveFromCatalog(catalog)
+            return (itag, None) if itag is not None else None
+        if video.getOutputMode() == Video.OUTPUT_MODES.AUDIO:
+            itag = self.selectAudioFromCatalog(catalog, Transcoder.AUDIO_FORMAT_CODECS[video.getAudioFormat()])
+            return (None, itag) if itag is not None else None
+        return self.selectFromCatalog(catalog)
+
+    def toDict(self) -> dict:
+        return {"maxResolution": self._maxResolution, "maxAudioBitrate": self._maxAudioBitrate, "preferredCodecs": self._preferredCodecs,
+                "maxSize": self._maxSize, "maxFps": self._maxFps}
+
+    @staticmethod
+    def fromDict(saved: dict) -> "QualityPolicy":
+        """
+        Creates a policy from toDict, for example in a worker process
+        """
+        return QualityPolicy(saved.get("maxResolution", None), saved.get("maxAudioBitrate", None), saved.get("preferredCodecs", ()),
+                             saved.get("maxSize", None), saved.get("maxFps", None))
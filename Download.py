@@ -1,15 +1,39 @@
+import asyncio
+import errno
 import os
+import threading
 import time
-from typing import List
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import BinaryIO, Dict, Iterable, List, Tuple, Union
+from urllib import parse
 
 import pytube
-import requests
-from pytube import YouTube
+from pytube import YouTube, extract
+from pytube.monostate import Monostate
+
+import Sink
+import Transfer
+from AsyncEngine import AsyncEngine
+from Bandwidth import BandwidthLimiter
+from Cache import MetadataCache
+from Catalog import StreamCatalog
+from Metrics import Metrics, Span, metrics
+from Muxer import Muxer
+from NameIndex import NameIndex
+from Scheduler import Scheduler
+from Sink import FileSink
+from Store import ArtifactStore, linkFile
+from Transcode import Transcoder, TranscodePlan, TranscodeSettings
+from Workspace import WorkspaceAllocator
 
 import subprocess
 
 from pytube.exceptions import RegexMatchError
 
+# Metadata requests of pytube use the same pooled connections as the stream downloads
+Transfer.installPytubeAdapter()
+
 
 def cleanFilename(s: str):
     """
@@ -30,6 +54,170 @@ def cleanFilename(s: str):
 class Video:
     videos: List = []  # Unused for now
 
+    class STREAM_TYPES:
+        VIDEO = Metrics.STAGES.VIDEO
+        AUDIO = Metrics.STAGES.AUDIO
+
+    # What a download makes. Progressive and audio-only downloads have a single stream, which is written straight into the output folder
+    class OUTPUT_MODES:
+        COMBINED = "combined"
+        PROGRESSIVE = "progressive"
+        AUDIO = "audio"
+
+    AUDIO_FORMATS = Transcoder.AUDIO_FORMATS
+
+    # Shared pool that downloads the audio and video streams of every job at the same time. Every job of the download stage
+    # has two streams, so a stream never waits for the streams of other jobs
+    _downloadWorkers: int = 2 * Scheduler.DEFAULT_LIMITS[Scheduler.STAGES.DOWNLOAD]
+    _downloadPool: ThreadPoolExecutor = None
+    _downloadPoolLock: threading.Lock = threading.Lock()
+
+    # Caches the stream options of videos so loading the same video again doesn't fetch them from YouTube
+    _metadataCache: MetadataCache = MetadataCache(cacheFolder="metadatacache")
+
+    # Gives every download a private folder for its temporary files
+    _workspaces: WorkspaceAllocator = WorkspaceAllocator("tempvideos")
+
+    # How streams which can't be copied into an mp4 file are transcoded
+    _transcodeSettings: TranscodeSettings = TranscodeSettings()
+
+    # Finds ffmpeg and limits how many combinations run at once
+    _muxer: Muxer = Muxer()
+
+    # Shared by every transfer, unlimited until a rate is set
+    _bandwidth: BandwidthLimiter = BandwidthLimiter()
+
+    # Finished videos by the streams and settings they were made of, so duplicate downloads are linked instead of downloaded again
+    _store: ArtifactStore = ArtifactStore("store", maxBytes=20 * 1024 ** 3, maxAge=30 * 24 * 3600)
+    _storeWaitTimeout: float = 3600.0  # After this a download stops waiting for another one making the same video and makes its own
+
+    @staticmethod
+    def sweepTempFiles(keepJobIds: Iterable[str] = ()) -> int:
+        """
+        Removes temporary files left behind by downloads which won't continue. Should be called at startup
+        :param keepJobIds: ids of jobs which will be restored, their partial files are continued
+        :return: how many folders and files were removed
+        """
+        return Video._workspaces.sweepOrphans(keepJobIds)
+
+    @staticmethod
+    def setMetadataCache(cache: MetadataCache):
+        """
+        Sets the cache used for video options
+        :param cache: the cache or None to always fetch options from YouTube
+        """
+        Video._metadataCache = cache
+
+    @staticmethod
+    def getMetadataCache() -> MetadataCache:
+        return Video._metadataCache
+
+    @staticmethod
+    def setDownloadWorkers(count: int):
+        """
+        Sets how many streams can be downloaded at the same time across all videos. Should be at least twice the limit of the download stage
+        :param count: amount of worker threads
+        """
+        with Video._downloadPoolLock:
+            Video._downloadWorkers = max(1, count)
+            if Video._downloadPool is not None:
+                Video._downloadPool.shutdown(wait=False)  # Running downloads finish in the old pool
+                Video._downloadPool = None
+
+    # Large streams can be downloaded in segments over several connections, see Transfer.downloadSegmented
+    _segmentConnections: int = 1
+    _segmentSize: int = Transfer.DEFAULT_SEGMENT_SIZE
+
+    @staticmethod
+    def setSegmentedDownload(connections: int, segmentSize: int = Transfer.DEFAULT_SEGMENT_SIZE):
+        """
+        Sets how many connections a single stream is downloaded with. Streams smaller than one segment use one connection
+        :param connections: connections per stream, 1 disables segmented downloading
+        :param segmentSize: size of a segment in bytes
+        """
+        Video._segmentConnections = max(1, connections)
+        Video._segmentSize = max(1, segmentSize)
+
+    @staticmethod
+    def setTranscodeSettings(settings: TranscodeSettings):
+        """
+        Sets how streams which can't be copied into the output file are transcoded, for example the threads and preset
+        :param settings: the settings
+        """
+        Video._transcodeSettings = settings
+
+    @staticmethod
+    def getTranscodeSettings() -> TranscodeSettings:
+        return Video._transcodeSettings
+
+    @staticmethod
+    def setArtifactStore(store: ArtifactStore, waitTimeout: float = 3600.0):
+        """
+        Sets the store of finished videos
+        :param store: the store or None to download every video even if it has been downloaded before
+        :param waitTimeout: seconds a download waits for another download making the same video, before making it itself
+        """
+        Video._store = store
+        Video._storeWaitTimeout = waitTimeout
+
+    @staticmethod
+    def getArtifactStore() -> ArtifactStore:
+        return Video._store
+
+    @staticmethod
+    def getBandwidthLimiter() -> BandwidthLimiter:
+        """
+        Returns the limiter every download shares. Its rate, schedule and the shares of jobs can be changed at any time
+        :return: the limiter
+        """
+        return Video._bandwidth
+
+    def setBandwidthShare(self, weight: float = 1.0, cap: float = None):
+        """
+        Sets how this download shares the bandwidth with other downloads
+        :param weight: a download with weight 2 gets twice the rate of a download with weight 1
+        :param cap: the most bytes per second this download can use, None for no cap of its own
+        """
+        Video._bandwidth.setJob(self._jobId, weight, cap)
+
+    def _throttle(self, amount: int):
+        Video._bandwidth.consume(self._jobId, amount)
+
+    def _reserveBandwidth(self, amount: int) -> float:
+        return Video._bandwidth.reserve(self._jobId, amount)  # The engine waits without blocking the loop
+
+    @staticmethod
+    def setMuxer(muxer: Muxer):
+        Video._muxer = muxer
+
+    @staticmethod
+    def getMuxer() -> Muxer:
+        return Video._muxer
+
+    # If set, transfers and combinations run as coroutines of this engine instead of holding threads
+    _engine: AsyncEngine = None
+
+    @staticmethod
+    def setAsyncEngine(engine: AsyncEngine):
+        """
+        Sets the engine which runs the transfers and combinations of every download. The blocking methods
+        keep working and wait for the engine, the async methods let many downloads run without a thread each.
+        Combinations use the muxer of the engine. Streaming mode still uses threads
+        :param engine: the engine or None to use threads
+        """
+        Video._engine = engine
+
+    @staticmethod
+    def getAsyncEngine() -> AsyncEngine:
+        return Video._engine
+
+    @staticmethod
+    def _getDownloadPool() -> ThreadPoolExecutor:
+        with Video._downloadPoolLock:
+            if Video._downloadPool is None:
+                Video._downloadPool = ThreadPoolExecutor(max_workers=Video._downloadWorkers, thread_name_prefix="stream-download")
+            return Video._downloadPool
+
     def __init__(self, link: str):
         Video.videos.append(self)
 
@@ -39,48 +227,122 @@ class Video:
         # This program downloads one of those options by Itag
         self._videoOptions: pytube.query.StreamQuery = None
         self._audioOptions: pytube.query.StreamQuery = None
+        self._catalog: StreamCatalog = None
 
         # The streams from which the video is downloaded from
         self._videoStream: pytube.query.Stream = None
         self._audioStream: pytube.query.Stream = None
 
         # How the program views and saves ongoing downloads
-        # It saves temporary video with given name and a number so it can combine a video with correct sound
-        self._videoNameFormat: str = "tempvideo."
-        self._audioNameFormat: str = "tempaudio."
+        # Every download has its own temporary folder named by its job id, so the names of the files inside it never collide
+        self._jobId: str = uuid.uuid4().hex
+        self._videoFileName: str = "video.mp4"
+        self._audioFileName: str = "audio.mp4"
 
-        self._tempVideoFolder: str = "tempvideos"
+        self._tempVideoFolder: str = None  # Set when the download starts
         self._outputFolder: str = "downloads"
 
-        # Used for combining video and audio
-        self._ffmpegPath = os.getcwd() + "\\" + r"ffmpeg\bin\ffmpeg.exe"
-
         # Interface related
-        self._onVideoCombinedFunc = lambda index: print(index)  # Called when downloaded video is combined (aka. ready)
-        self._interfaceIndex: int = None  # Used to update its "done" portion on the interface when download is ready
+        # The interface finds the row of a download by its job id
+        self._onVideoCombinedFunc = lambda jobId, success: print(jobId, success)  # Called when downloaded video is combined (aka. ready) or combining failed
+        self._onProgressFunc = lambda jobId, streamType, downloaded, total: None  # Called whenever a chunk of a stream is downloaded
+
+        # State of an ongoing download
+        self._pendingFiles: Tuple[str, str, str] = None  # Temporary video, temporary audio and output name waiting to be combined
+        self._transcodePlan: TranscodePlan = None  # Decided when the streams are known
+        self._artifactKey: str = None  # Key of the stored video this download has claimed to make
+        self._cancelled: threading.Event = threading.Event()
+        self._keepPartialFiles: bool = False  # Whether the streams of a download failed by an error are kept for a retry
+
+        # Streaming mode pipes the downloaded bytes straight into the combiner instead of temporary files
+        self._streamingMux: bool = False
+        self._outputMode: str = Video.OUTPUT_MODES.COMBINED
+        self._audioFormat: str = Video.AUDIO_FORMATS.M4A
+        self._outputExtension: str = ".mp4"  # Extension of the reserved output file
+        self._combinedResult: bool = None  # Result of a download which was combined already in downloadStreams, by streaming or from the store
 
     def __deepcopy__(self):
         newVideo = Video(self._link)
         newVideo.setOnVideoCombinedFunc(self._onVideoCombinedFunc)
-        newVideo.setInterfaceIndex(self._interfaceIndex)
+        newVideo.setOnProgressFunc(self._onProgressFunc)
         newVideo.setOutputFolderPath(self._outputFolder)
+        newVideo.setStreamingMux(self._streamingMux)
+        newVideo.setOutputMode(self._outputMode, self._audioFormat)
+        newVideo.setKeepPartialFiles(self._keepPartialFiles)
         newVideo._videoOptions = self._videoOptions
         newVideo._audioOptions = self._audioOptions
+        newVideo._catalog = self._catalog
 
         return newVideo
 
-    def setInterfaceIndex(self, index: int):
-        self._interfaceIndex = index
+    def setJobId(self, jobId: str):
+        """
+        Sets the id of the download job. A job restored with the same id continues its partial files
+        :param jobId: the id
+        """
+        self._jobId = jobId
 
-    def getInterfaceIndex(self) -> int:
-        return self._interfaceIndex
+    def getJobId(self) -> str:
+        return self._jobId
 
     def setOnVideoCombinedFunc(self, func):
         self._onVideoCombinedFunc = func
 
+    def setOnProgressFunc(self, func):
+        """
+        Sets a function which is called with (job id, stream type, downloaded bytes, total bytes)
+        every time a chunk of the audio or video stream is downloaded
+        :param func: the function
+        """
+        self._onProgressFunc = func
+
     def setOutputFolderPath(self, folder: str):
         self._outputFolder = folder
 
+    def getOutputFolderPath(self) -> str:
+        return self._outputFolder
+
+    @staticmethod
+    def streamingMuxSupported() -> bool:
+        """
+        Returns whether this platform supports named pipes, which streaming mode needs
+        :return: whether streaming mode can be used
+        """
+        return hasattr(os, "mkfifo")
+
+    def setStreamingMux(self, enabled: bool):
+        """
+        Sets whether the streams are piped straight into the combiner while downloading.
+        The combiner then writes a fragmented mp4 and no full temporary files are written to disk.
+        Ignored if the platform doesn't support it
+        :param enabled: whether to use streaming mode
+        """
+        self._streamingMux = enabled and Video.streamingMuxSupported()
+
+    def setKeepPartialFiles(self, keep: bool):
+        """
+        Sets whether the partly downloaded streams of a download which fails with an error are kept, so a retry of the same job id
+        continues them. The reserved output name is freed either way. Kept files which are never continued are removed by sweepTempFiles
+        :param keep: whether to keep the streams
+        """
+        self._keepPartialFiles = keep
+
+    def setOutputMode(self, mode: str, audioFormat: str = Transcoder.AUDIO_FORMATS.M4A):
+        """
+        Sets what the download makes. In progressive mode the video itag has to be a progressive stream, which has both video and audio,
+        and the audio itag is ignored. In audio mode the video itag is ignored
+        :param mode: one of OUTPUT_MODES
+        :param audioFormat: one of AUDIO_FORMATS, the format of audio mode
+        """
+        self._outputMode = mode
+        self._audioFormat = audioFormat
+
+    def getOutputMode(self) -> str:
+        return self._outputMode
+
+    def getAudioFormat(self) -> str:
+        return self._audioFormat
+
     def setLink(self, link: str):
         """
         Sets link to a YouTube video
@@ -109,57 +371,25 @@ class Video:
         """
         return self._audioOptions
 
-    def _getNextVideoNums(self) -> List[int]:
+    def getCatalog(self) -> StreamCatalog:
         """
-        Returns the next valid number which the program can name temporary audio and video.
-        This is used to not overwrite ongoing downloads
-        :return: a valid audio and video number
+        Returns the options indexed by resolution, fps, codec and bitrate
+        :return: the catalog or None if the options haven't been fetched
         """
+        return self._catalog
 
-        nums: List[int] = [1, 1]  # Contains the valid video and audio number
-
-        # Makes sure the folder in which the temporary videos are stored exists
-        if not os.path.exists(self._tempVideoFolder):
-            os.mkdir(self._tempVideoFolder)
-            return nums
-
-        files = os.listdir(self._tempVideoFolder)  # List of ongoing downloads
-        for file in files:
-            filename: str = os.path.splitext(file)[0]  # Gets the filename of a download
-            if filename.count(".") > 0:  # Makes sure file is properly named
-                try:
-                    num: int = int(os.path.splitext(filename)[1][1:])  # Tries to get the integer from file
-                except ValueError:
-                    # Fails if file is not an ongoing video or if the file is incorrectly named
-                    continue
-
-                # Checks if file is a video or audio
-                if filename.find(self._videoNameFormat, 0):
-                    if nums[0] > num:
-                        continue
-                    nums[0] = num + 1
-                elif filename.find(self._audioNameFormat, 0):
-                    if nums[1] > num:
-                        continue
-                    nums[1] = num + 1
-
-        return nums
-
-    def _removeTempFile(self, fileName: str, wait: int = 1):
-        """
-        Removes a temporary file used in combining audio and video.
-        Loops until the file is not used by the combiner anymore.
-        :param fileName: Name of the video / audio file
-        :param wait: how long until it tries again if there's a permission error
-        """
-        filePath: str = os.path.join(self._tempVideoFolder, fileName)  # Creates the path to file using temporary folder path and filename
-        # Loops until it can properly delete the file
-        while os.path.exists(filePath):
-            try:
-                os.remove(filePath)
-            except PermissionError:
-                pass
-            time.sleep(wait)
+    def _removeTempFiles(self, keepFiles: bool = False):
+        """
+        Removes the temporary folder of this download with everything in it.
+        Should only be called after the combiner has exited, so nothing is using the files anymore.
+        :param keepFiles: if True, the folder is only given up and its files are left for a retry of the same job
+        """
+        Video._bandwidth.removeJob(self._jobId)  # Nothing is transferred anymore
+        if self._tempVideoFolder is None:
+            return
+        with metrics.span(self._jobId, Metrics.STAGES.CLEANUP):
+            Video._workspaces.release(self._jobId, keepFiles)
+        self._tempVideoFolder = None
 
     def getVideoTitle(self) -> str:
         """
@@ -168,25 +398,151 @@ class Video:
         """
         return self._videoOptions.get_highest_resolution().title
 
-    def _generateSafeFilename(self, outputName) -> str:
-        listOfDownloads: List[str] = os.listdir(self._outputFolder)
-        withoutExtensions: List[str] = []
-        for file in listOfDownloads:
-            withoutExtensions.append(os.path.splitext(file)[0])
+    @staticmethod
+    def _openPipe(pipePath: str, combiner: subprocess.Popen) -> BinaryIO:
+        """
+        Opens a named pipe for writing once the combiner starts reading it
+        :param pipePath: path to the named pipe
+        :param combiner: the combiner process reading the pipe
+        :return: the opened pipe or None if the combiner exited before opening it
+        """
+        while True:
+            try:
+                fd: int = os.open(pipePath, os.O_WRONLY | os.O_NONBLOCK)  # Fails instead of blocking if nobody reads the pipe yet
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+            if combiner.poll() is not None:
+                return None
+            time.sleep(0.05)
 
-        if outputName in withoutExtensions:
-            num = sum(outputName in s for s in withoutExtensions)
-            outputName = outputName + " (" + str(num) + ")"
+        os.set_blocking(fd, True)
+        return os.fdopen(fd, "wb")
 
-        return outputName
+    def _downloadStream(self, stream: pytube.Stream, fileName: str, streamType: str, combiner: subprocess.Popen = None):
+        """
+        Downloads a stream into the temporary folder and reports the progress of it
+        :param stream: the audio or video stream
+        :param fileName: name of the temporary file
+        :param streamType: one of STREAM_TYPES, tells the progress function which stream is progressing
+        :param combiner: if given, the file is a named pipe read by this combiner process
+        """
+        with metrics.span(self._jobId, streamType) as span:
+            self._transferStream(stream, fileName, streamType, combiner, span)
+            if self.isCancelled():
+                span.fail()
 
-    def downloadAndCombineVideo(self, videoItag: int, audioItag: int, outputName: str = None) -> bool:
+    def _reportProgress(self, span: Span, streamType: str, downloaded: int, total: int):
+        span.setBytes(downloaded)
+        self._onProgressFunc(self._jobId, streamType, downloaded, total)
+
+    def _transferStream(self, stream: pytube.Stream, fileName: str, streamType: str, combiner: subprocess.Popen, span: Span):
         """
-        Downloads a video and then combines the audio and video files into a single file
+        Writes the bytes of a stream into a temporary file or a named pipe, see _downloadStream
+        """
+        filePath: str = os.path.join(self._tempVideoFolder, fileName)
+        total: int = stream.filesize
+
+        if combiner is None and not stream.is_otf:
+            # Keeps a journal of the partial file, so an interrupted download continues from where it stopped
+            try:
+                videoId: str = extract.video_id(self._link)
+            except RegexMatchError:
+                videoId = None
+            Transfer.downloadToFile(stream.url, filePath, total, stream.itag, videoId,
+                                    onProgress=lambda done, size: self._reportProgress(span, streamType, done, size),
+                                    isCancelled=self.isCancelled, connections=Video._segmentConnections, segmentSize=Video._segmentSize,
+                                    throttle=self._throttle)
+            return
+
+        file: Union[FileSink, BinaryIO] = FileSink(filePath, 0, total) if combiner is None else Video._openPipe(filePath, combiner)
+        if file is None:
+            return
+
+        with file:
+            self._writeStream(stream, file, streamType, span)
+
+    def _writeStream(self, stream: pytube.Stream, file: Union[FileSink, BinaryIO], streamType: str, span: Span):
+        """
+        Writes the bytes of a stream into a sink or pipe until the stream ends or the download is cancelled
+        """
+        total: int = stream.filesize
+        downloaded: int = 0
+
+        # Pipes can't be continued after a restart, but dropped connections are still continued from the byte they reached
+        chunks = pytube.request.seq_stream(stream.url) if stream.is_otf else Transfer.streamRange(stream.url, 0, total, throttle=self._throttle)
+        for chunk in chunks:
+            if self.isCancelled():
+                return
+            file.write(chunk)
+            downloaded += len(chunk)
+            self._reportProgress(span, streamType, downloaded, total)
+            if stream.is_otf:
+                self._throttle(len(chunk))
+
+    def downloadStreams(self, videoItag: int, audioItag: int, outputName: str = None) -> bool:
+        """
+        Downloads the video and audio streams into temporary files. Use combineStreams to combine them afterwards.
+        In progressive and audio mode, see setOutputMode, the single stream is written into the output file right away
         :param videoItag: tag from video options. Determines which of those options will be downloaded
         :param audioItag: tag from audio options. Determines which if those options will be downloaded
         :param outputName: a custom name for the combined video. If empty, will just be the name of the downloaded video
-        :return: whether download and combination was successful
+        :return: whether download was successful
+        """
+        if self._outputMode != Video.OUTPUT_MODES.COMBINED:
+            # The single stream is the output, so there's nothing left to combine afterwards
+            self._combinedResult = self._downloadSingleStream(videoItag, audioItag, outputName)
+            return self._combinedResult
+
+        prepared: Tuple[pytube.Stream, pytube.Stream, bool] = self._prepareStreams(videoItag, audioItag, outputName, self._streamingMux)
+        if prepared is None:
+            return False
+        if self._combinedResult is not None:
+            return True  # Linked from the store
+        videoStream, audioStream, streaming = prepared
+
+        if streaming:
+            self._combinedResult = self._streamAndCombine(videoStream, audioStream)
+            return self._combinedResult
+
+        if Video._engine is not None:
+            # The transfers run in the event loop, this thread only waits for them
+            try:
+                Video._engine.run(self._downloadBothAsync(videoStream, audioStream))
+            except Exception:
+                self._discardPendingFiles(self._keepPartialFiles)
+                raise
+        else:
+            # Downloads audio and video at the same time so the job only waits for the slower one
+            pool: ThreadPoolExecutor = Video._getDownloadPool()
+            downloads = [
+                pool.submit(self._downloadStream, audioStream, self._audioFileName, Video.STREAM_TYPES.AUDIO),
+                pool.submit(self._downloadStream, videoStream, self._videoFileName, Video.STREAM_TYPES.VIDEO)
+            ]
+            wait(downloads)
+            try:
+                for download in downloads:
+                    download.result()  # Raises the error of a failed download
+            except Exception:
+                self._discardPendingFiles(self._keepPartialFiles)
+                raise
+
+        if self.isCancelled():
+            self._discardPendingFiles()
+            return False
+
+        return True
+
+    def _prepareStreams(self, videoItag: int, audioItag: int, outputName: str, allowStreaming: bool) -> Tuple[pytube.Stream, pytube.Stream, bool]:
+        """
+        Finds the streams, reserves the output name and the temporary folder. If the same video is stored,
+        links it to the output and sets the combined result instead
+        :param videoItag: tag from video options
+        :param audioItag: tag from audio options
+        :param outputName: a custom name for the combined video or None
+        :param allowStreaming: whether the streams may be piped into the combiner
+        :return: video stream, audio stream and whether they are streamed. None if the itags aren't valid
         """
 
         # Streams from which the videos are downloaded from
@@ -195,12 +551,12 @@ class Video:
             videoStream = self._videoOptions.get_by_itag(videoItag)
             audioStream = self._audioOptions.get_by_itag(audioItag)
         except ValueError:
-            return False
+            return None
         except AttributeError:
-            return False
+            return None
 
         if videoStream is None or audioStream is None:
-            return False
+            return None
 
         # Makes sure that output folder exists
         if not os.path.exists(self._outputFolder):
@@ -211,87 +567,615 @@ class Video:
             outputName = videoStream.title
         outputName = cleanFilename(outputName)  # Checks that the name is valid
 
-        outputName = self._generateSafeFilename(outputName)  # Generates a non-existing file name
-        # Creates a temporary file for the file so if user download's more videos with same name they won't overwrite
-        with open(os.path.join(self._outputFolder, outputName + ".mp4"), "w+") as file:
-            file.write("TEMP DOWNLOAD FILE")
-            file.close()
+        # Reserves a non-existing file name by creating an empty file, so if user download's more videos with same name they won't overwrite
+        outputName = NameIndex.forFolder(self._outputFolder).reserve(outputName, ".mp4")
 
-        # Generate names for temporary videos
-        videoNums: List[int] = self._getNextVideoNums()
+        # Codecs which an mp4 file can't hold are transcoded while combining
+        encoders = Video._muxer.getCapabilities().encoders if Video._transcodeSettings.hardwareEncoder is not None else None
+        self._transcodePlan = Transcoder.plan(videoStream, audioStream, Video._transcodeSettings, encoders)
 
-        videoName: str = self._videoNameFormat + str(videoNums[0]) + ".mp4"
-        audioName: str = self._audioNameFormat + str(videoNums[1]) + ".mp4"
+        # Transcoding is limited by the cpu rather than the download, so only copies are streamed
+        streaming: bool = allowStreaming and self._transcodePlan.isCopy()
 
-        # Downloads audio and video
-        audioStream.download(output_path=self._tempVideoFolder, filename=audioName)
-        videoStream.download(output_path=self._tempVideoFolder, filename=videoName)
+        if self._useStoredVideo(videoStream.itag, audioStream.itag, outputName, streaming):
+            return videoStream, audioStream, streaming
 
-        # Combines audio and video
-        self.combine(videoName, audioName, outputName, ".mp4")
+        # Temporary files go into the folder of this job. Partial files of an earlier run of the same job are continued
+        try:
+            self._tempVideoFolder = Video._workspaces.allocate(self._jobId)
+        except Exception:
+            self._finishStoredVideo(None)
+            raise
+        self._pendingFiles = (self._videoFileName, self._audioFileName, outputName)
+        return videoStream, audioStream, streaming
 
-        sleepTime: int = 1  # How often program checks if combination is done
+    def _downloadSingleStream(self, videoItag: int, audioItag: int, outputName: str) -> bool:
+        """
+        Downloads the only stream of progressive or audio mode straight into the output folder. Nothing is written into the
+        temporary folder. An audio stream which has to be converted is piped into ffmpeg while it downloads
+        :param videoItag: tag of a progressive stream, used in progressive mode
+        :param audioItag: tag of an audio stream, used in audio mode
+        :param outputName: a custom name for the output file or None
+        :return: whether the output file was made
+        """
+        audioOnly: bool = self._outputMode == Video.OUTPUT_MODES.AUDIO
+        try:
+            stream: pytube.Stream = self._audioOptions.get_by_itag(audioItag) if audioOnly else self._videoOptions.get_by_itag(videoItag)
+        except (ValueError, AttributeError):
+            return False
+        if stream is None or (not audioOnly and not stream.is_progressive):
+            return False  # An adaptive video stream has no audio
+
+        options: List[str] = Transcoder.planAudio(stream, self._audioFormat, Video._transcodeSettings) if audioOnly else None
+        self._outputExtension = "." + self._audioFormat if audioOnly else ".mp4"
+        outputName = cleanFilename(outputName if outputName is not None else stream.title)
+        outputName = NameIndex.forFolder(self._outputFolder).reserve(outputName, self._outputExtension)
+        self._pendingFiles = (None, None, outputName)  # Only the reserved output file is removed if the download fails
+        outputPath: str = os.path.join(self._outputFolder, outputName + self._outputExtension)
+
+        streamType: str = Video.STREAM_TYPES.AUDIO if audioOnly else Video.STREAM_TYPES.VIDEO
+        with metrics.span(self._jobId, streamType) as span:
+            try:
+                if options is None:
+                    # Written under a partial name and renamed when complete, so the output file is never seen half written
+                    sink: FileSink = FileSink(Sink.getPartialPath(outputPath), 0, stream.filesize, finalPath=outputPath)
+                    try:
+                        self._writeStream(stream, sink, streamType, span)
+                    except Exception:
+                        sink.discard()
+                        raise
+                    written: bool = not self.isCancelled()
+                    if written:
+                        sink.commit()
+                    else:
+                        sink.discard()
+                else:
+                    written = self._convertStream(stream, outputPath, options, streamType, span)
+            except Exception:
+                self._discardPendingFiles()
+                raise
+            if not written:
+                span.fail()
+
+        if written:
+            self._pendingFiles = None
+            self._removeTempFiles()  # Only frees the bandwidth share, there's no temporary folder
+        else:
+            self._discardPendingFiles()
+        self._onVideoCombinedFunc(self._jobId, written)
+        return written
+
+    def _convertStream(self, stream: pytube.Stream, outputPath: str, options: List[str], streamType: str, span: Span) -> bool:
+        """
+        Pipes a stream into ffmpeg, which writes the output file while the stream downloads
+        :return: whether ffmpeg made the output file
+        """
+        partialPath: str = Sink.getPartialPath(outputPath)
+        converter: subprocess.Popen = Video._muxer.start(["pipe:0"], partialPath, options, pipeInput=True)
+        if converter is None:
+            return False
 
-        # Wait for combination to finish
-        fullPath: str = os.path.join(self._outputFolder, outputName + ".mp4")
-        while not os.path.exists(fullPath):
-            time.sleep(sleepTime)
+        try:
+            self._writeStream(stream, converter.stdin, streamType, span)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early, wait tells why
+        except Exception:
+            converter.kill()
+            Video._muxer.wait(converter)
+            raise
+        if self.isCancelled():
+            converter.kill()
+        converted: bool = Video._muxer.wait(converter) and not self.isCancelled()  # Closes the standard input, which ends the output
+        return Video._commitOutput(partialPath, outputPath, converted)
 
-        # Remove the temp files
-        self._removeTempFile(videoName)
-        self._removeTempFile(audioName)
+    def _streamAndCombine(self, videoStream: pytube.Stream, audioStream: pytube.Stream) -> bool:
+        """
+        Downloads both streams into named pipes which the combiner reads at the same time
+        :param videoStream: the video stream
+        :param audioStream: the audio stream
+        :return: whether download and combination was successful
+        """
+        videoName, audioName, outputName = self._pendingFiles
+        videoPath: str = os.path.join(self._tempVideoFolder, videoName)
+        audioPath: str = os.path.join(self._tempVideoFolder, audioName)
+        os.mkfifo(videoPath)
+        os.mkfifo(audioPath)
 
-        self._onVideoCombinedFunc(self._interfaceIndex)
+        # Pipes aren't seekable, so the combiner writes a fragmented mp4 which doesn't need to be rewritten at the end
+        outputPath: str = os.path.join(self._outputFolder, outputName + ".mp4")
+        partialPath: str = Sink.getPartialPath(outputPath)
+        combiner: subprocess.Popen = self._startCombiner(videoPath, audioPath, partialPath, ["-movflags", "frag_keyframe+empty_moov+default_base_moof"])
+        if combiner is None:
+            self._discardPendingFiles()
+            self._onVideoCombinedFunc(self._jobId, False)
+            return False
 
+        errors: List[Exception] = []
+
+        def feed(stream: pytube.Stream, fileName: str, streamType: str):
+            try:
+                self._downloadStream(stream, fileName, streamType, combiner)
+            except Exception as e:
+                errors.append(e)
+                combiner.kill()  # The combiner would otherwise wait for the pipe forever
+
+        # Both pipes have to be fed at the same time, so they get their own threads instead of the shared pool
+        feeders = [
+            threading.Thread(target=feed, args=(audioStream, audioName, Video.STREAM_TYPES.AUDIO), daemon=True),
+            threading.Thread(target=feed, args=(videoStream, videoName, Video.STREAM_TYPES.VIDEO), daemon=True)
+        ]
+        for feeder in feeders:
+            feeder.start()
+
+        with metrics.span(self._jobId, Metrics.STAGES.MUX) as span:
+            exited: bool = Video._muxer.wait(combiner)
+            for feeder in feeders:
+                feeder.join()
+
+            combined: bool = Video._commitOutput(partialPath, outputPath, exited and not errors and not self.isCancelled())
+            self._measureOutput(span, outputName, combined)
+        if combined:
+            self._finishStoredVideo(outputPath)
+            self._removeTempFiles()
+            self._pendingFiles = None
+        else:
+            self._discardPendingFiles()
+
+        self._onVideoCombinedFunc(self._jobId, combined)
+        return combined
+
+    def combineStreams(self) -> bool:
+        """
+        Combines the streams downloaded by downloadStreams into the final video and removes the temporary files
+        :return: whether combination was successful
+        """
+        if self._combinedResult is not None:
+            # Streams were already combined while downloading, or the video was linked from the store
+            combined: bool = self._combinedResult
+            self._combinedResult = None
+            return combined
+
+        if self._pendingFiles is None or self.isCancelled():
+            self._discardPendingFiles()
+            return False
+
+        videoName, audioName, outputName = self._pendingFiles
+
+        # Combines audio and video. Returns when the combiner has exited
+        with metrics.span(self._jobId, Metrics.STAGES.MUX) as span:
+            combined: bool = self.combine(videoName, audioName, outputName, ".mp4")
+            self._measureOutput(span, outputName, combined)
+
+        return self._finishCombination(outputName, combined)
+
+    def _finishCombination(self, outputName: str, combined: bool) -> bool:
+        """
+        Stores a combined video and removes the temporary files, or removes everything of a failed combination
+        :param outputName: the reserved output name
+        :param combined: whether the combiner succeeded
+        :return: combined
+        """
+        if combined:
+            self._finishStoredVideo(os.path.join(self._outputFolder, outputName + ".mp4"))
+
+            # Remove the temp files
+            self._removeTempFiles()
+            self._pendingFiles = None
+        else:
+            self._discardPendingFiles()  # Removes the reserved output file too, so a broken video isn't left behind
+
+        self._onVideoCombinedFunc(self._jobId, combined)
+
+        return combined
+
+    def _measureOutput(self, span: Span, outputName: str, combined: bool):
+        """
+        Records the size of the combined video into a mux span
+        """
+        if not combined:
+            span.fail()
+            return
+        try:
+            span.setBytes(os.path.getsize(os.path.join(self._outputFolder, outputName + self._outputExtension)))
+        except OSError:
+            pass
+
+    def downloadAndCombineVideo(self, videoItag: int, audioItag: int, outputName: str = None) -> bool:
+        """
+        Downloads a video and then combines the audio and video files into a single file
+        :param videoItag: tag from video options. Determines which of those options will be downloaded
+        :param audioItag: tag from audio options. Determines which if those options will be downloaded
+        :param outputName: a custom name for the combined video. If empty, will just be the name of the downloaded video
+        :return: whether download and combination was successful
+        """
+        if not self.downloadStreams(videoItag, audioItag, outputName):
+            return False
+        return self.combineStreams()
+
+    def submitDownload(self, videoItag: int, audioItag: int, outputName: str = None) -> Future:
+        """
+        Starts downloadAndCombineAsync in the async engine, see setAsyncEngine. Returns right away
+        :return: future of whether download and combination was successful
+        """
+        return Video._engine.submit(self.downloadAndCombineAsync(videoItag, audioItag, outputName))
+
+    async def downloadAndCombineAsync(self, videoItag: int, audioItag: int, outputName: str = None) -> bool:
+        """
+        Does the same as downloadAndCombineVideo in the event loop of the async engine
+        :return: whether download and combination was successful
+        """
+        if not await self.downloadStreamsAsync(videoItag, audioItag, outputName):
+            return False
+        return await self.combineStreamsAsync()
+
+    async def downloadStreamsAsync(self, videoItag: int, audioItag: int, outputName: str = None) -> bool:
+        """
+        Does the same as downloadStreams in the event loop of the async engine. Streaming mode isn't used
+        :return: whether download was successful
+        """
+        if self._outputMode != Video.OUTPUT_MODES.COMBINED:
+            # A single stream is written or piped into ffmpeg by a blocking thread of the engine
+            return await asyncio.get_running_loop().run_in_executor(None, self.downloadStreams, videoItag, audioItag, outputName)
+
+        # Reserving names and folders touches the disk and can wait for another download in the store. That download needs the
+        # blocking threads of the engine to finish, so the wait gets a thread of its own
+        waiter: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-wait") if Video._store is not None else None
+        try:
+            prepared: Tuple[pytube.Stream, pytube.Stream, bool] = await asyncio.get_running_loop().run_in_executor(
+                waiter, self._prepareStreams, videoItag, audioItag, outputName, False)
+        finally:
+            if waiter is not None:
+                waiter.shutdown(wait=False)
+        if prepared is None:
+            return False
+        if self._combinedResult is not None:
+            return True  # Linked from the store
+        videoStream, audioStream, _ = prepared
+
+        try:
+            await self._downloadBothAsync(videoStream, audioStream)
+        except Exception:
+            self._discardPendingFiles(self._keepPartialFiles)
+            raise
+
+        if self.isCancelled():
+            self._discardPendingFiles()
+            return False
         return True
 
-    def combine(self, videoFile: str, audioFile: str, outputFile: str, extension: str):
+    async def _downloadBothAsync(self, videoStream: pytube.Stream, audioStream: pytube.Stream):
+        """
+        Downloads audio and video at the same time and raises the error of a failed download after both have stopped
+        """
+        results = await asyncio.gather(self._downloadStreamAsync(audioStream, self._audioFileName, Video.STREAM_TYPES.AUDIO),
+                                       self._downloadStreamAsync(videoStream, self._videoFileName, Video.STREAM_TYPES.VIDEO),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _downloadStreamAsync(self, stream: pytube.Stream, fileName: str, streamType: str):
+        """
+        Downloads a stream into the temporary folder like _downloadStream
+        """
+        with metrics.span(self._jobId, streamType) as span:
+            if stream.is_otf:
+                # pytube reads these with blocking requests, so they use a blocking thread of the engine
+                await asyncio.get_running_loop().run_in_executor(None, self._transferStream, stream, fileName, streamType, None, span)
+            else:
+                try:
+                    videoId: str = extract.video_id(self._link)
+                except RegexMatchError:
+                    videoId = None
+                await Video._engine.downloadToFile(stream.url, os.path.join(self._tempVideoFolder, fileName), stream.filesize, stream.itag, videoId,
+                                                   onProgress=lambda done, size: self._reportProgress(span, streamType, done, size),
+                                                   isCancelled=self.isCancelled, throttle=self._reserveBandwidth)
+            if self.isCancelled():
+                span.fail()
+
+    async def combineStreamsAsync(self) -> bool:
+        """
+        Does the same as combineStreams in the event loop of the async engine
+        :return: whether combination was successful
+        """
+        if self._combinedResult is not None:
+            combined: bool = self._combinedResult
+            self._combinedResult = None
+            return combined
+
+        if self._pendingFiles is None or self.isCancelled():
+            self._discardPendingFiles()
+            return False
+
+        videoName, audioName, outputName = self._pendingFiles
+        outputPath: str = os.path.join(self._outputFolder, outputName + ".mp4")
+        partialPath: str = Sink.getPartialPath(outputPath)
+        with metrics.span(self._jobId, Metrics.STAGES.MUX) as span:
+            combined: bool = await Video._engine.mux([os.path.join(self._tempVideoFolder, videoName), os.path.join(self._tempVideoFolder, audioName)],
+                                                     partialPath, self._getCombinerOptions())
+            combined = await asyncio.get_running_loop().run_in_executor(None, Video._commitOutput, partialPath, outputPath, combined)  # May sync
+            self._measureOutput(span, outputName, combined)
+
+        return self._finishCombination(outputName, combined)
+
+    def cancel(self):
+        """
+        Stops an ongoing download. Temporary files of the download are removed
+        """
+        self._cancelled.set()
+
+    def isCancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def discard(self):
+        """
+        Removes the temporary files, the reserved output file and the store claim of a download which won't be finished,
+        for example one cancelled while it waits for the mux stage
+        """
+        self._discardPendingFiles()
+
+    def getMuxCores(self) -> int:
+        """
+        Returns how many cores combining the downloaded streams uses. Transcoding uses many, copying none
+        :return: amount of cores
+        """
+        if self._transcodePlan is None:
+            return 0
+        return self._transcodePlan.getCores()
+
+    def _discardPendingFiles(self, keepStreams: bool = False):
+        """
+        Removes the temporary files and the reserved output file of a download which won't be combined
+        :param keepStreams: whether the temporary files are left for a retry of the same job, see setKeepPartialFiles
+        """
+        self._finishStoredVideo(None)
+        if self._pendingFiles is None:
+            return
+
+        outputName: str = self._pendingFiles[2]
+        self._pendingFiles = None
+        self._removeTempFiles(keepStreams)
+        outputPath: str = os.path.join(self._outputFolder, outputName + self._outputExtension)
+        for path in (outputPath, Sink.getPartialPath(outputPath)):
+            if os.path.exists(path):
+                os.remove(path)
+        NameIndex.forFolder(self._outputFolder).release(outputName)
+
+    @staticmethod
+    def _commitOutput(partialPath: str, outputPath: str, succeeded: bool) -> bool:
+        """
+        Renames an output file which ffmpeg or a sink wrote under its partial name to its reserved name, or removes it if it failed
+        :param partialPath: path ffmpeg or the sink wrote
+        :param outputPath: reserved path of the output file
+        :param succeeded: whether the output file is complete
+        :return: whether the output file is in its place
+        """
+        if succeeded:
+            try:
+                Sink.commitFile(partialPath, outputPath)
+                return True
+            except OSError as e:
+                print(f"Couldn't move the output file into place: {e}")
+        if os.path.exists(partialPath):
+            os.remove(partialPath)
+        return False
+
+    def _useStoredVideo(self, videoItag: int, audioItag: int, outputName: str, streaming: bool) -> bool:
+        """
+        Links the output file to a stored video made of the same streams with the same settings.
+        If another download is making the same video, waits for it instead of downloading the streams again
+        :param videoItag: itag of the video stream
+        :param audioItag: itag of the audio stream
+        :param outputName: the reserved output name
+        :param streaming: whether the video would be combined in streaming mode, which makes a different file
+        :return: whether the output was linked. If not, this download makes the video and stores it
         """
-        Combines a video and an audio file
+        store: ArtifactStore = Video._store
+        if store is None:
+            return False
+        try:
+            videoId: str = extract.video_id(self._link)
+        except RegexMatchError:
+            return False
+
+        settings: List[str] = self._transcodePlan.getOutputOptions() + (["streaming"] if streaming else [])
+        key: str = ArtifactStore.makeKey(videoId, videoItag, audioItag, settings)
+        deadline: float = time.monotonic() + Video._storeWaitTimeout
+        while True:
+            storedPath: str = store.lookup(key)
+            if storedPath is None:
+                if store.claim(key):
+                    self._artifactKey = key
+                    return False
+                # Another download is making the same video
+                storedPath = store.waitFor(key, max(0.0, deadline - time.monotonic()))
+                if storedPath is None:
+                    if time.monotonic() >= deadline:
+                        print(f"Waited too long for another download of {videoId}, downloading it again")
+                        return False  # Made without the store, the other download still stores its video
+                    continue  # It failed, so this download tries to make it
+
+            if linkFile(storedPath, os.path.join(self._outputFolder, outputName + ".mp4")) is None:
+                return False
+            self._combinedResult = True
+            self._onVideoCombinedFunc(self._jobId, True)
+            return True
+
+    def _finishStoredVideo(self, outputPath: str):
+        """
+        Stores the video this download has claimed and wakes downloads waiting for it
+        :param outputPath: path to the finished video or None if it failed
+        """
+        if self._artifactKey is None:
+            return
+        key: str = self._artifactKey
+        self._artifactKey = None
+        Video._store.finish(key, outputPath)
+
+    def combine(self, videoFile: str, audioFile: str, outputFile: str, extension: str) -> bool:
+        """
+        Combines a video and an audio file. Blocks until the combiner has exited
         :param extension: extension of the video file
         :param videoFile: name of the video file
         :param audioFile: name of the audio file
         :param outputFile: name of the output file
+        :return: whether the combiner exited successfully and the video was moved into place
         """
-        codec: str = "copy"
         # Create paths
         videoPath: str = os.path.join(self._tempVideoFolder, videoFile)
         audioPath: str = os.path.join(self._tempVideoFolder, audioFile)
         outputPath: str = os.path.join(self._outputFolder, outputFile + extension)
+        partialPath: str = Sink.getPartialPath(outputPath)  # Renamed when complete, so a half written video never has the final name
 
-        command: str = f"\"{self._ffmpegPath}\" -i \"{videoPath}\" -i \"{audioPath}\" -c {codec} \"{outputPath}\""
+        if Video._engine is not None:
+            combined: bool = Video._engine.run(Video._engine.mux([videoPath, audioPath], partialPath, self._getCombinerOptions()))
+            return Video._commitOutput(partialPath, outputPath, combined)
 
-        process: subprocess.DETACHED_PROCESS = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)  # Run the command and return the process
-        process.stdin.write(b"y\n")  # Tell the process to continue if an output file with same name already exists
-        process.communicate()  # Run 'y\n' to overwrite if a video with same name already exists
-        process.stdin.close()  # Close the process
+        process: subprocess.Popen = self._startCombiner(videoPath, audioPath, partialPath)
+        if process is None:
+            return False
 
-    def fetchOptions(self) -> bool:
+        return Video._commitOutput(partialPath, outputPath, Video._muxer.wait(process))
+
+    def _getCombinerOptions(self, outputOptions: List[str] = ()) -> List[str]:
         """
-        Gets the options from which the video can be downloaded from.
-        These options contain information about the video such as resolution.
-        :return: whether fetching was successful or not
+        Returns the codec options of the transcode plan followed by extra options
         """
+        plan: TranscodePlan = self._transcodePlan if self._transcodePlan is not None else TranscodePlan(True, True, Video._transcodeSettings)
+        return plan.getOutputOptions() + list(outputOptions)
+
+    def _startCombiner(self, videoPath: str, audioPath: str, outputPath: str, outputOptions: List[str] = ()) -> subprocess.Popen:
+        """
+        Starts the process which combines a video and an audio file
+        :param videoPath: path to the video file
+        :param audioPath: path to the audio file
+        :param outputPath: path to the output file
+        :param outputOptions: extra ffmpeg options for the output file
+        :return: the started process or None if it couldn't be started
+        """
+        return Video._muxer.start([videoPath, audioPath], outputPath, self._getCombinerOptions(outputOptions))
+
+    @staticmethod
+    def _describeStream(stream: pytube.Stream) -> Dict:
+        """
+        Turns a stream into a json serializable descriptor which can be cached
+        :param stream: the stream
+        :return: descriptor of the stream
+        """
+        return {
+            "itag": stream.itag,
+            "url": stream.url,
+            "mime": stream.mime_type,
+            "codecs": stream.codecs,
+            "resolution": stream.resolution,
+            "abr": stream.abr,
+            "fps": getattr(stream, "fps", None),
+            "bitrate": stream.bitrate,
+            "filesize": stream._filesize,  # The property would make a request for streams without a known size
+            "isOtf": stream.is_otf
+        }
+
+    @staticmethod
+    def _streamFromDescriptor(descriptor: Dict, monostate: Monostate) -> pytube.Stream:
+        """
+        Builds a stream from a cached descriptor
+        :param descriptor: descriptor created by _describeStream
+        :param monostate: information shared by all streams of the video, such as the title
+        :return: the stream
+        """
+        data = {
+            "url": descriptor["url"],
+            "itag": descriptor["itag"],
+            "mimeType": f'{descriptor["mime"]}; codecs="{", ".join(descriptor["codecs"])}"',
+            "is_otf": descriptor["isOtf"],
+            "bitrate": descriptor["bitrate"],
+            "contentLength": descriptor["filesize"]
+        }
+        if descriptor["fps"] is not None:
+            data["fps"] = descriptor["fps"]
+        return pytube.Stream(data, monostate)
+
+    @staticmethod
+    def _getUrlLifetime(streams: pytube.StreamQuery) -> float:
+        """
+        Returns how many seconds the download urls of streams stay valid
+        :param streams: the streams
+        :return: seconds or None if the urls don't tell it
+        """
+        expiries: List[float] = []
+        for stream in streams:
+            expire = parse.parse_qs(parse.urlsplit(stream.url).query).get("expire", None)
+            if expire is not None:
+                expiries.append(float(expire[0]))
+        if len(expiries) == 0:
+            return None
+        return min(expiries) - time.time() - 60  # A minute of margin so a download doesn't start with an expired url
+
+    def _loadStreams(self) -> pytube.StreamQuery:
+        """
+        Returns all streams of the video, from the metadata cache if possible
+        :return: the streams or None if the link isn't a valid video link
+        """
+        try:
+            videoId: str = extract.video_id(self._link)
+        except RegexMatchError:
+            return None
+
+        cache: MetadataCache = Video._metadataCache
+        entry: Dict = cache.get(videoId) if cache is not None else None
+        if entry is not None:
+            monostate: Monostate = Monostate(on_progress=None, on_complete=None, title=entry["title"], duration=entry["duration"])
+            return pytube.StreamQuery([Video._streamFromDescriptor(descriptor, monostate) for descriptor in entry["streams"]])
 
         # Tries to find the video and create a connection
         try:
             video: YouTube = YouTube(self._link)
         except RegexMatchError:
+            return None
+
+        streams: pytube.StreamQuery = video.streams
+        if cache is not None:
+            entry = {
+                "title": video.title,
+                "duration": video.length,
+                "streams": [Video._describeStream(stream) for stream in streams]
+            }
+            cache.put(videoId, entry, ttl=Video._getUrlLifetime(streams))
+
+        return streams
+
+    def fetchOptions(self) -> bool:
+        """
+        Gets the options from which the video can be downloaded from.
+        These options contain information about the video such as resolution.
+        :return: whether fetching was successful or not
+        """
+        with metrics.span(self._jobId, Metrics.STAGES.METADATA) as span:
+            fetched: bool = self._fetchOptions()
+            if not fetched:
+                span.fail()
+            return fetched
+
+    def _fetchOptions(self) -> bool:
+
+        streams: pytube.StreamQuery = self._loadStreams()
+        if streams is None:
             return False
 
         # Gets video and audio options. Filters them to be video and audio
-        self._videoOptions = video.streams.filter(mime_type="video/mp4")
-        self._audioOptions = video.streams.filter(only_audio=True)
+        self._videoOptions = streams.filter(mime_type="video/mp4")
+        self._audioOptions = streams.filter(only_audio=True)
 
         # If program didn't find any downloadable options, tries to find again but with less filtering
         if len(self._videoOptions) == 0:
-            self._videoOptions = video.streams.filter(file_extension="mp4")
+            self._videoOptions = streams.filter(file_extension="mp4")
 
         if len(self._audioOptions) == 0:
-            self._audioOptions = video.streams.filter(only_audio=True)
+            self._audioOptions = streams.filter(only_audio=True)
 
         # Makes sure it could find some options
         if len(self._videoOptions) > 0 and len(self._audioOptions) > 0:
+            self._catalog = StreamCatalog(self._videoOptions, self._audioOptions)
             return True
         else:
             return False
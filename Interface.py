@@ -1,12 +1,129 @@
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import ttk
-from typing import List
+from typing import Callable, Dict, Hashable, List, Tuple
 from tkinter import filedialog
+from collections import OrderedDict, deque
+import itertools
 import os
+import threading
+import time
 import pytube
 
 
+class UIDispatcher:
+    def __init__(self, schedule: Callable[[int, Callable], None], interval: int = 20, budget: float = 0.008):
+        """
+        Queue of interface updates which any thread can post to. The updates are run on the main loop,
+        because Tk widgets mustn't be touched from other threads.
+        An update posted with the same key as a waiting update replaces it, so a row or a combobox
+        changed many times between two drains is only redrawn once
+        :param schedule: runs a function on the main loop after a delay in milliseconds, for example Tk.after
+        :param interval: milliseconds between drains
+        :param budget: seconds a single drain can spend running updates. The rest wait for the next drain so the window stays responsive
+        """
+        self._schedule: Callable[[int, Callable], None] = schedule
+        self._interval: int = interval
+        self._budget: float = budget
+
+        self._lock: threading.Lock = threading.Lock()
+        self._pending: OrderedDict = OrderedDict()  # Key -> (function, arguments, time of the first post)
+        self._uniqueKeys = itertools.count()  # Keys of updates which are never coalesced
+        self._nextDrain: float = 0  # When the next drain should run, used to measure how late the main loop is
+
+        # Statistics: [posted, coalesced, run, total latency, longest latency, drains, total lag, longest lag]
+        self._stats: List[float] = [0, 0, 0, 0.0, 0.0, 0, 0.0, 0.0]
+
+    def start(self):
+        """
+        Starts draining the queue. Has to be called from the main loop thread
+        """
+        self._nextDrain = time.perf_counter() + self._interval / 1000
+        self._schedule(self._interval, self._drain)
+
+    def post(self, key: Hashable, func: Callable, *args):
+        """
+        Queues a function to be run on the main loop. Safe to call from any thread
+        :param key: updates with the same key replace each other, for example ("progress", row). None is never coalesced
+        :param func: the function
+        :param args: arguments of the function
+        """
+        if key is None:
+            key = ("unique", next(self._uniqueKeys))
+
+        with self._lock:
+            self._stats[0] += 1
+            waiting = self._pending.get(key, None)
+            if waiting is not None:
+                # Keeps the place and the latency of the first post, only the newest values are shown
+                self._stats[1] += 1
+                self._pending[key] = (func, args, waiting[2])
+            else:
+                self._pending[key] = (func, args, time.perf_counter())
+
+    def _drain(self):
+        start: float = time.perf_counter()
+        lag: float = max(0.0, start - self._nextDrain)
+
+        while True:
+            with self._lock:
+                if not self._pending:
+                    break
+                _, (func, args, postedAt) = self._pending.popitem(last=False)
+
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Interface update failed: {e}")
+
+            now: float = time.perf_counter()
+            with self._lock:
+                self._stats[2] += 1
+                self._stats[3] += now - postedAt
+                self._stats[4] = max(self._stats[4], now - postedAt)
+            if now - start > self._budget:
+                break
+
+        with self._lock:
+            self._stats[5] += 1
+            self._stats[6] += lag
+            self._stats[7] = max(self._stats[7], lag)
+
+        self._nextDrain = time.perf_counter() + self._interval / 1000
+        self._schedule(self._interval, self._drain)
+
+    def getPendingCount(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def getStats(self) -> Dict[str, float]:
+        """
+        Returns how many updates were posted, coalesced and run, how long updates waited (latency) and
+        how late drains started compared to their interval (lag). Lag is how long the main loop was busy
+        :return: dictionary of statistics, times in seconds
+        """
+        with self._lock:
+            posted, coalesced, run, totalLatency, longestLatency, drains, totalLag, longestLag = self._stats
+            return {
+                "posted": posted,
+                "coalesced": coalesced,
+                "run": run,
+                "pending": len(self._pending),
+                "averageLatency": totalLatency / run if run else 0.0,
+                "longestLatency": longestLatency,
+                "drains": drains,
+                "averageLag": totalLag / drains if drains else 0.0,
+                "longestLag": longestLag
+            }
+
+    def collectMetrics(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """
+        Returns the statistics of getStats in the form Metrics.addCollector expects
+        :return: list of (metric name, labels, value)
+        """
+        return [(f"ui_{name}", {}, value) for name, value in self.getStats().items()]
+
+
 class Themes:
     class THEME_PATHS:
         THEME_FOLDER = "./themes"
@@ -23,33 +140,143 @@ class Themes:
 
 
 class DownloadsWidget(ttk.Frame):
-    def __init__(self, master, **kwargs):
+    def __init__(self, master, pageSize: int = 200, maxHistory: int = 1000, **kwargs):
+        """
+        List of downloads. Rows are found by their id, and only one page of rows is kept in the Treeview,
+        so long sessions don't slow the list down. Completed rows are forgotten once there are too many rows
+        :param pageSize: how many rows are shown at once
+        :param maxHistory: how many rows are kept. Only completed rows are removed, oldest first
+        """
         super(DownloadsWidget, self).__init__(master, **kwargs)
 
-        # self._titles: List[str] = []  # Used to only change done row and not title
+        self._pageSize: int = pageSize
+        self._maxHistory: int = maxHistory
+
+        self._rows: OrderedDict = OrderedDict()  # Row id -> [title, done, progress, speed, eta], oldest first
+        self._completedRows: OrderedDict = OrderedDict()  # Ids of completed rows in the order they completed
+        self._shownRows: deque = deque()  # Ids of the rows in the Treeview, oldest first
+        self._newerRows: int = 0  # How many rows are newer than the shown page. 0 means new rows are shown as they come
+
+        self._pageFrame = ttk.Frame(self)
+        self._olderButton = ttk.Button(self._pageFrame, text="Older", width=8, command=lambda: self._movePage(self._pageSize))
+        self._pageLabel = ttk.Label(self._pageFrame, text="")
+        self._newerButton = ttk.Button(self._pageFrame, text="Newer", width=8, command=lambda: self._movePage(-self._pageSize))
+        self._pageFrame.pack(side=tk.BOTTOM, fill=tk.X, pady=(10, 0))
+        self._olderButton.pack(side=tk.LEFT)
+        self._newerButton.pack(side=tk.RIGHT)
+        self._pageLabel.pack(side=tk.TOP)
 
         self._downloadListScroll = ttk.Scrollbar(self, orient=tk.VERTICAL)
-        self._downloadList = ttk.Treeview(self, selectmode="browse", columns=0, height=10, yscrollcommand=self._downloadListScroll.set)
+        self._downloadList = ttk.Treeview(self, selectmode="browse", columns=(0, 1, 2, 3), height=10, yscrollcommand=self._downloadListScroll.set)
+        self._downloadListScroll["command"] = self._downloadList.yview
         self._downloadList.column("#0", anchor="w")
         self._downloadList.column(0, anchor="w", width=80)
+        self._downloadList.column(1, anchor="w", width=70)
+        self._downloadList.column(2, anchor="w", width=90)
+        self._downloadList.column(3, anchor="w", width=60)
         self._downloadList.heading("#0", text="Video title", anchor="center")
         self._downloadList.heading(0, text="Done", anchor="center")
+        self._downloadList.heading(1, text="Progress", anchor="center")
+        self._downloadList.heading(2, text="Speed", anchor="center")
+        self._downloadList.heading(3, text="ETA", anchor="center")
         self._downloadList.pack(pady=0, padx=0, side=tk.LEFT, fill=tk.Y, expand=True)
         self._downloadListScroll.pack(side=tk.RIGHT, fill=tk.Y, expand=True)
 
-    def addDownload(self, title: str, done: str) -> int:
+        self._updatePageLabel()
+
+    def addDownload(self, rowId: str, title: str, done: str):
+        """
+        Adds a row to the download list
+        :param rowId: id used to change the row later, usually the job id
+        :param title: First column
+        :param done: Second column
+        """
+        self._rows[rowId] = [title, done, "", "", ""]
+        if self._newerRows == 0:
+            self._showRow(rowId)
+            if len(self._shownRows) > self._pageSize:
+                self._downloadList.delete(self._shownRows.popleft())
+        else:
+            self._newerRows += 1  # Keeps the shown page on the same rows
+
+        self._evictCompleted()
+        self._updatePageLabel()
+
+    def _showRow(self, rowId: str):
+        row: List[str] = self._rows[rowId]
+        self._downloadList.insert("", tk.END, iid=rowId, text=row[0], values=tuple(row[1:]))
+        self._shownRows.append(rowId)
+
+    def _evictCompleted(self):
+        evicted: bool = False
+        while len(self._rows) > self._maxHistory and self._completedRows:
+            rowId, _ = self._completedRows.popitem(last=False)
+            self._rows.pop(rowId, None)
+            if self._downloadList.exists(rowId):
+                self._downloadList.delete(rowId)
+                self._shownRows.remove(rowId)
+            evicted = True
+
+        if evicted and self._newerRows > 0:
+            self._showPage()  # Evicted rows may have been newer than the page, so its position is found again
+
+    def _movePage(self, rows: int):
+        self._newerRows += rows
+        self._showPage()
+
+    def _showPage(self):
+        self._newerRows = max(0, min(self._newerRows, len(self._rows) - self._pageSize))
+        if self._shownRows:
+            self._downloadList.delete(*self._shownRows)
+            self._shownRows.clear()
+
+        page: List[str] = list(itertools.islice(reversed(self._rows), self._newerRows, self._newerRows + self._pageSize))
+        for rowId in reversed(page):
+            self._showRow(rowId)
+        self._updatePageLabel()
+
+    def _updatePageLabel(self):
+        last: int = len(self._rows) - self._newerRows
+        first: int = max(1, last - self._pageSize + 1) if last > 0 else 0
+        self._pageLabel["text"] = f"{first}-{last} of {len(self._rows)}"
+
+    def _setColumn(self, rowId: str, column: int, text: str):
+        row: List[str] = self._rows.get(rowId, None)
+        if row is None:
+            return  # Row has been forgotten
+        row[column + 1] = text
+        if self._downloadList.exists(rowId):
+            self._downloadList.set(rowId, column, text)
+
+    def setDoneText(self, rowId: str, text: str):
+        self._setColumn(rowId, 0, text)
+
+    def finishDownload(self, rowId: str, text: str):
         """
-        Adds a column to the download list
-        :param title: First row
-        :param done: Second row
-        :return:
+        Sets the done text of a download and allows the row to be forgotten
+        :param rowId: id of the row
+        :param text: text of the done column
         """
-        self._downloadList.insert("", tk.END, None, text=title, values=done)
-        return len(self._downloadList.get_children()) - 1
+        self.setDoneText(rowId, text)
+        if rowId in self._rows:
+            self._completedRows[rowId] = None
+            self._evictCompleted()
+            self._updatePageLabel()
 
-    def setDoneText(self, index: int, text: str):
-        item = self._downloadList.get_children()[index]
-        self._downloadList.item(item, values=text)
+    def setProgress(self, rowId: str, progress: str, speed: str, eta: str):
+        """
+        Changes the progress columns of a download
+        :param rowId: id of the row
+        :param progress: text of the progress column, for example "42%"
+        :param speed: text of the speed column
+        :param eta: text of the estimated time left column
+        """
+        row: List[str] = self._rows.get(rowId, None)
+        if row is None:
+            return
+        row[2:5] = [progress, speed, eta]
+        if self._downloadList.exists(rowId):
+            self._downloadList.item(rowId, values=tuple(row[1:]))
 
 
 class LabelEntry(ttk.Frame):
@@ -86,6 +313,9 @@ class LabelSelect(ttk.Frame):
     def setSelectedValue(self, index: int):
         self._select.current(index)
 
+    def clearSelection(self):
+        self._select.set("")
+
     def getSelectedOptions(self) -> str:
         return self._select.get()
 
@@ -195,10 +425,13 @@ class VideoOptionsFrame(ttk.LabelFrame):
 
         self._onVideoChangeFunc = lambda e: None
         self._onAudioChangeFunc = lambda e: None
+        self._onOutputChangeFunc = lambda e: None
 
+        self._outputWidget = LabelSelect(self._frame, text="Output")
         self._videoQualityWidget = LabelSelect(self._frame, text="Video Quality*")
         self._audioQualityWidget = LabelSelect(self._frame, text="Audio Quality*")
 
+        self._outputWidget.pack(pady=(0, 15))
         self._videoQualityWidget.pack()
         self._audioQualityWidget.pack(pady=15)
 
@@ -210,6 +443,17 @@ class VideoOptionsFrame(ttk.LabelFrame):
         self._onAudioChangeFunc = func
         self._audioQualityWidget.getCombobox().bind("<<ComboboxSelected>>", lambda e: func(self._audioQualityWidget.getSelectedOptions()))
 
+    def onOutputChange(self, func):
+        self._onOutputChangeFunc = func
+        self._outputWidget.getCombobox().bind("<<ComboboxSelected>>", lambda e: func(self._outputWidget.getSelectedOptions()))
+
+    def setOutputOptions(self, outputs: List[str]):
+        self._outputWidget.removeAllOptions()
+        for output in outputs:
+            self._outputWidget.addOption(output)
+        self._outputWidget.setSelectedValue(0)
+        self._onOutputChangeFunc(self._outputWidget.getSelectedOptions())
+
     def addVideoQuality(self, quality: str):
         self._videoQualityWidget.addOption(quality)
 
@@ -220,9 +464,13 @@ class VideoOptionsFrame(ttk.LabelFrame):
         self._videoQualityWidget.removeAllOptions()
         self._audioQualityWidget.removeAllOptions()
 
-    def selectFirstQuality(self):
-        self._videoQualityWidget.setSelectedValue(0)
-        self._audioQualityWidget.setSelectedValue(0)
+    def selectQuality(self, videoIndex: int, audioIndex: int):
+        # Progressive and audio-only outputs leave one of the lists empty
+        for widget, index in ((self._videoQualityWidget, videoIndex), (self._audioQualityWidget, audioIndex)):
+            if widget.valueCount() > 0:
+                widget.setSelectedValue(index)
+            else:
+                widget.clearSelection()
         self._onVideoChangeFunc(self._videoQualityWidget.getSelectedOptions())
         self._onAudioChangeFunc(self._audioQualityWidget.getSelectedOptions())
 
@@ -263,6 +511,10 @@ class Interface:
 
         # self._downloadList.insert(parent="", index="end", iid=None, text="text", values=("No"))
 
+        # Every change made from other threads goes through the dispatcher
+        self._dispatcher: UIDispatcher = UIDispatcher(self._tk.after)
+        self._dispatcher.start()
+
     @staticmethod
     def _setFrameWidth(frame: ttk.Frame, width: int):
         frame.update()
@@ -271,7 +523,30 @@ class Interface:
         frame["height"] = height
         frame["width"] = width
 
-    def addQualityOptions(self, video: List[str], audio: List[str]):
+    def getDispatcher(self) -> UIDispatcher:
+        return self._dispatcher
+
+    def post(self, key: Hashable, func: Callable, *args):
+        """
+        Runs a function on the main loop. Safe to call from any thread
+        :param key: a waiting function with the same key is replaced. None is never replaced
+        :param func: the function
+        :param args: arguments of the function
+        """
+        self._dispatcher.post(key, func, *args)
+
+    def addQualityOptions(self, video: List[str], audio: List[str], selectedVideo: str = None, selectedAudio: str = None):
+        """
+        Shows the options of a loaded video
+        :param video: resolutions from best to worst
+        :param audio: audio bitrates from best to worst
+        :param selectedVideo: resolution selected first. If None, the first one
+        :param selectedAudio: audio bitrate selected first. If None, the first one
+        """
+        # Only the newest options matter if a few videos are loaded quickly
+        self._dispatcher.post("qualities", self._setQualityOptions, video, audio, selectedVideo, selectedAudio)
+
+    def _setQualityOptions(self, video: List[str], audio: List[str], selectedVideo: str, selectedAudio: str):
         self._videoOptionsFrame.resetQualities()
 
         for option in video:
@@ -280,19 +555,46 @@ class Interface:
         for option in audio:
             self._videoOptionsFrame.addAudioQuality(option)
 
-        self._videoOptionsFrame.selectFirstQuality()
+        self._videoOptionsFrame.selectQuality(video.index(selectedVideo) if selectedVideo in video else 0,
+                                              audio.index(selectedAudio) if selectedAudio in audio else 0)
+
+    def setOutputOptions(self, outputs: List[str]):
+        """
+        Shows what a download can make, for example video with audio or audio only. The first one is selected
+        :param outputs: names of the outputs
+        """
+        self._dispatcher.post("outputs", self._videoOptionsFrame.setOutputOptions, outputs)
 
-    def addNewDownloadToList(self, title: str, done: str = "No") -> int:
+    def addNewDownloadToList(self, rowId: str, title: str, done: str = "No"):
         """
-        Adds a new column to the download list and returns it's index
-        :param title: Title of the column
+        Adds a new row to the download list
+        :param rowId: id which is used to modify the row, usually the job id of the download
+        :param title: Title of the row
         :param done: Basically a text (usually saying no or yes)
-        :return: index
         """
-        return self._downloadsWidget.addDownload(title, done)
+        self._dispatcher.post(None, self._downloadsWidget.addDownload, rowId, title, done)
+
+    def modifyDownloadText(self, rowId: str, done: str):
+        self._dispatcher.post(("done", rowId), self._downloadsWidget.setDoneText, rowId, done)
+
+    def finishDownload(self, rowId: str, done: str):
+        """
+        Shows a download as completed. Completed rows are forgotten when the list gets too long
+        :param rowId: id of the row
+        :param done: text of the done column
+        """
+        self._dispatcher.post(("done", rowId), self._downloadsWidget.finishDownload, rowId, done)
+
+    def modifyDownloadProgress(self, rowId: str, progress: str, speed: str, eta: str):
+        self._dispatcher.post(("progress", rowId), self._downloadsWidget.setProgress, rowId, progress, speed, eta)
 
-    def modifyDownloadText(self, index: int, done: str):
-        self._downloadsWidget.setDoneText(index, done)
+    def after(self, milliseconds: int, func):
+        """
+        Runs a function on the main loop after a delay
+        :param milliseconds: the delay
+        :param func: the function
+        """
+        self._tk.after(milliseconds, func)
 
     def setOnFolderChangeFunc(self, func):
         self._videoDownloadFrame.setOnFolderChange(func)
@@ -303,6 +605,9 @@ class Interface:
     def setOnAudioChange(self, func):
         self._videoOptionsFrame.onAudioChange(func)
 
+    def setOnOutputChange(self, func):
+        self._videoOptionsFrame.onOutputChange(func)
+
     def setDownloadFunc(self, func):
         self._videoDownloadFrame.setDownloadFunc(func)
 
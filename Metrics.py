@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, TextIO, Tuple
+
+
+class Span:
+    def __init__(self, metrics: "Metrics", jobId: str, stage: str):
+        """
+        Measures a single stage of a single job. Use as a context manager
+        :param metrics: where the span is recorded when it ends
+        :param jobId: id of the job
+        :param stage: name of the stage, for example "audio" or "mux"
+        """
+        self._metrics: Metrics = metrics
+        self.jobId: str = jobId
+        self.stage: str = stage
+        self.bytes: int = 0
+        self.ok: bool = True
+        self.startTime: float = 0  # Wall clock time, only used in exports
+        self.duration: float = 0
+        self._start: float = 0
+
+    def setBytes(self, amount: int):
+        self.bytes = amount
+
+    def fail(self):
+        self.ok = False
+
+    def __enter__(self) -> "Span":
+        self.startTime = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.duration = time.perf_counter() - self._start
+        if excType is not None:
+            self.ok = False
+        self._metrics.record(self)
+        return False
+
+    def toDict(self) -> Dict:
+        return {
+            "jobId": self.jobId,
+            "stage": self.stage,
+            "start": self.startTime,
+            "duration": self.duration,
+            "bytes": self.bytes,
+            "throughput": self.bytes / self.duration if self.duration > 0 else 0.0,
+            "ok": self.ok
+        }
+
+
+class Metrics:
+    PREFIX: str = "youtubedownloader"
+
+    class STAGES:
+        METADATA = "metadata"
+        AUDIO = "audio"
+        VIDEO = "video"
+        MUX = "mux"
+        CLEANUP = "cleanup"
+
+    def __init__(self):
+        """
+        Collects timing and throughput of pipeline stages. Totals are kept per stage,
+        and every span can also be written as a json line
+        """
+        self._lock: threading.Lock = threading.Lock()
+        self._stages: Dict[str, List[float]] = {}  # Stage -> [spans, failed spans, seconds, bytes, last duration]
+        self._jsonLines: TextIO = None
+        self._collectors: List[Callable[[], List[Tuple[str, Dict[str, str], float]]]] = []
+        self._server: ThreadingHTTPServer = None
+
+    def span(self, jobId: str, stage: str) -> Span:
+        """
+        Creates a span which is recorded when its with block ends
+        :param jobId: id of the job
+        :param stage: name of the stage
+        :return: the span
+        """
+        return Span(self, jobId, stage)
+
+    def record(self, span: Span):
+        with self._lock:
+            totals: List[float] = self._stages.setdefault(span.stage, [0, 0, 0.0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += 0 if span.ok else 1
+            totals[2] += span.duration
+            totals[3] += span.bytes
+            totals[4] = span.duration
+
+            if self._jsonLines is not None:
+                self._jsonLines.write(json.dumps(span.toDict()) + "\n")
+                self._jsonLines.flush()
+
+    def setJsonLinesPath(self, path: str):
+        """
+        Appends every following span into a file as a json line
+        :param path: path to the file or None to stop writing
+        """
+        with self._lock:
+            if self._jsonLines is not None:
+                self._jsonLines.close()
+            self._jsonLines = open(path, "a") if path is not None else None
+
+    def addCollector(self, collector: Callable[[], List[Tuple[str, Dict[str, str], float]]]):
+        """
+        Adds a function whose values are exported with the stage totals, for example scheduler queue depths
+        :param collector: returns a list of (metric name, labels, value)
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def getStageTotals(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns totals of every stage
+        :return: dictionary of spans, failed spans, seconds, bytes and the last duration per stage
+        """
+        with self._lock:
+            return {stage: {"spans": t[0], "failed": t[1], "seconds": t[2], "bytes": t[3], "lastDuration": t[4]}
+                    for stage, t in self._stages.items()}
+
+    def toPrometheus(self) -> str:
+        """
+        Returns the metrics in the Prometheus text format
+        :return: the metrics
+        """
+        totals = self.getStageTotals()
+        lines: List[str] = []
+
+        def addMetric(name: str, metricType: str, description: str, values: List[Tuple[Dict[str, str], float]]):
+            fullName: str = f"{Metrics.PREFIX}_{name}"
+            lines.append(f"# HELP {fullName} {description}")
+            lines.append(f"# TYPE {fullName} {metricType}")
+            for labels, value in values:
+                labelText: str = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f"{fullName}{{{labelText}}} {value}")
+
+        addMetric("stage_spans_total", "counter", "Finished stage runs", [({"stage": s}, t["spans"]) for s, t in totals.items()])
+        addMetric("stage_failures_total", "counter", "Failed stage runs", [({"stage": s}, t["failed"]) for s, t in totals.items()])
+        addMetric("stage_seconds_total", "counter", "Time spent in a stage", [({"stage": s}, t["seconds"]) for s, t in totals.items()])
+        addMetric("stage_bytes_total", "counter", "Bytes handled by a stage", [({"stage": s}, t["bytes"]) for s, t in totals.items()])
+        addMetric("stage_last_seconds", "gauge", "Duration of the latest stage run", [({"stage": s}, t["lastDuration"]) for s, t in totals.items()])
+
+        with self._lock:
+            collectors = list(self._collectors)
+        collected: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+        for collector in collectors:
+            for name, labels, value in collector():
+                collected.setdefault(name, []).append((labels, value))
+        for name, values in collected.items():
+            addMetric(name, "gauge", name.replace("_", " "), values)
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9464, host: str = "127.0.0.1") -> int:
+        """
+        Serves the Prometheus text at /metrics from a background thread
+        :param port: port to listen to, 0 picks a free port
+        :param host: address to listen to. Local only by default
+        :return: the port which is listened to
+        """
+        metrics: Metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body: bytes = metrics.toPrometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        return self._server.server_address[1]
+
+
+metrics: Metrics = Metrics()  # Shared by the whole program
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+from typing import Dict, List, Set
+
+
+class Capabilities:
+    def __init__(self, version: str, encoders: Set[str]):
+        """
+        What the found ffmpeg can do
+        :param version: version text, for example "6.1.1"
+        :param encoders: names of the encoders ffmpeg was built with, for example "libx264" or "h264_nvenc"
+        """
+        self.version: str = version
+        self.encoders: Set[str] = encoders
+
+    def hasEncoder(self, encoder: str) -> bool:
+        return encoder in self.encoders
+
+
+class Muxer:
+    LOCAL_FOLDER: str = os.path.join("ffmpeg", "bin")  # Where README tells to extract ffmpeg
+
+    def __init__(self, ffmpegPath: str = None, ffprobePath: str = None, maxProcesses: int = 4):
+        """
+        Runs ffmpeg processes which combine streams. ffmpeg can't take new inputs once it has started,
+        so every combination needs its own process, but the amount of processes running at once is limited
+        :param ffmpegPath: path to ffmpeg. If None, it's searched from PATH and then from the ffmpeg folder
+        :param ffprobePath: path to ffprobe, searched like ffmpeg if None
+        :param maxProcesses: how many processes can run at the same time
+        """
+        self._ffmpegPath: str = ffmpegPath if ffmpegPath is not None else Muxer.findBinary("ffmpeg")
+        self._ffprobePath: str = ffprobePath if ffprobePath is not None else Muxer.findBinary("ffprobe")
+        self._slots: threading.BoundedSemaphore = threading.BoundedSemaphore(maxProcesses)
+
+        self._capabilities: Capabilities = None  # Probed once on first use
+        self._capabilitiesLock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def findBinary(name: str) -> str:
+        """
+        Finds an executable from PATH or from the local ffmpeg folder
+        :param name: name of the executable without extension, for example "ffmpeg"
+        :return: path to the executable or None if it wasn't found
+        """
+        path: str = shutil.which(name)
+        if path is not None:
+            return path
+        return shutil.which(name, path=os.path.abspath(Muxer.LOCAL_FOLDER))
+
+    def getFFmpegPath(self) -> str:
+        return self._ffmpegPath
+
+    def getFFprobePath(self) -> str:
+        return self._ffprobePath
+
+    def isAvailable(self) -> bool:
+        return self._ffmpegPath is not None
+
+    def getCapabilities(self) -> Capabilities:
+        """
+        Returns the version and encoders of ffmpeg. ffmpeg is only asked the first time
+        :return: the capabilities, empty if ffmpeg couldn't be run
+        """
+        with self._capabilitiesLock:
+            if self._capabilities is None:
+                self._capabilities = self._probeCapabilities()
+            return self._capabilities
+
+    def _probeCapabilities(self) -> Capabilities:
+        if self._ffmpegPath is None:
+            return Capabilities(None, set())
+
+        try:
+            versionText: str = subprocess.run([self._ffmpegPath, "-hide_banner", "-version"], stdin=subprocess.DEVNULL,
+                                              capture_output=True, text=True, timeout=10).stdout
+            encoderText: str = subprocess.run([self._ffmpegPath, "-hide_banner", "-encoders"], stdin=subprocess.DEVNULL,
+                                              capture_output=True, text=True, timeout=10).stdout
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"Couldn't run ffmpeg: {e}")
+            return Capabilities(None, set())
+
+        # First line looks like "ffmpeg version 6.1.1 Copyright ..."
+        words: List[str] = versionText.split()
+        version: str = words[2] if len(words) > 2 and words[1] == "version" else None
+
+        # Encoder lines look like " V....D libx264              libx264 H.264 ...", after a legend which ends with "------"
+        encoders: Set[str] = set()
+        listing: bool = False
+        for line in encoderText.splitlines():
+            if line.strip().startswith("------"):
+                listing = True
+            elif listing and len(line.split()) >= 2:
+                encoders.add(line.split()[1])
+        return Capabilities(version, encoders)
+
+    def buildCommand(self, inputs: List[str], outputPath: str, options: List[str] = ()) -> List[str]:
+        """
+        Builds the argument list of a combination. The output file is overwritten, because downloads reserve their output name with an empty file
+        :param inputs: paths to the input files
+        :param outputPath: path to the output file
+        :param options: options of the output file, for example codecs
+        :return: the arguments
+        """
+        command: List[str] = [self._ffmpegPath, "-hide_banner", "-nostdin", "-loglevel", "error", "-y"]
+        for inputPath in inputs:
+            command += ["-i", inputPath]
+        if len(inputs) > 1:
+            # Takes the video of the first input and the audio of the second
+            command += ["-map", "0:v:0", "-map", "1:a:0"]
+        return command + list(options) + [outputPath]
+
+    def start(self, inputs: List[str], outputPath: str, options: List[str] = (), pipeInput: bool = False) -> subprocess.Popen:
+        """
+        Starts a combination, waiting first if too many are running. Every started process has to be passed to wait
+        :param inputs: paths to the input files. "pipe:0" reads the standard input
+        :param outputPath: path to the output file
+        :param options: options of the output file
+        :param pipeInput: whether the bytes of an input are written into the standard input of the process
+        :return: the process or None if it couldn't be started
+        """
+        if self._ffmpegPath is None:
+            print("Couldn't find ffmpeg from PATH or the ffmpeg folder")
+            return None
+
+        self._slots.acquire()
+        try:
+            return subprocess.Popen(self.buildCommand(inputs, outputPath, options), stdin=subprocess.PIPE if pipeInput else subprocess.DEVNULL,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except OSError as e:
+            self._slots.release()
+            print(f"Couldn't start the combiner: {e}")
+            return None
+
+    def wait(self, process: subprocess.Popen) -> bool:
+        """
+        Waits for a process started with start to exit and frees its place
+        :param process: the process
+        :return: whether it exited successfully
+        """
+        try:
+            _, output = process.communicate()
+        finally:
+            self._slots.release()
+
+        if process.returncode != 0 and output:
+            print(f"Combiner failed: {output.decode(errors='replace').strip()}")
+        return process.returncode == 0
+
+    def run(self, inputs: List[str], outputPath: str, options: List[str] = ()) -> bool:
+        """
+        Runs a combination and waits for it to finish
+        :return: whether it was successful
+        """
+        process: subprocess.Popen = self.start(inputs, outputPath, options)
+        if process is None:
+            return False
+        return self.wait(process)
+
+    def probe(self, path: str) -> Dict:
+        """
+        Reads the format and streams of a media file with ffprobe
+        :param path: path to the file
+        :return: ffprobe's json output as a dictionary or None if it couldn't be read
+        """
+        if self._ffprobePath is None:
+            return None
+        try:
+            result = subprocess.run([self._ffprobePath, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+                                    stdin=subprocess.DEVNULL, capture_output=True, timeout=30)
+            return json.loads(result.stdout) if result.returncode == 0 else None
+        except (OSError, subprocess.TimeoutExpired, ValueError):
+            return None
@@ -0,0 +1,83 @@
+import os
+import threading
+from typing import Dict, Set
+
+
+class NameIndex:
+    # One index per output folder, shared by every download writing into it
+    _indexes: Dict[str, "NameIndex"] = {}
+    _indexesLock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def forFolder(folder: str) -> "NameIndex":
+        """
+        Returns the name index of a folder. The folder is listed only the first time
+        :param folder: path to the folder
+        :return: the index
+        """
+        key: str = os.path.normcase(os.path.abspath(folder))
+        with NameIndex._indexesLock:
+            index: NameIndex = NameIndex._indexes.get(key, None)
+            if index is None:
+                index = NameIndex(folder)
+                NameIndex._indexes[key] = index
+            return index
+
+    def __init__(self, folder: str):
+        """
+        Keeps the names of the files of a folder in memory, so a free name can be found without listing the folder
+        :param folder: path to the folder
+        """
+        self._folder: str = folder
+        self._lock: threading.Lock = threading.Lock()
+        self._names: Set[str] = None  # Names without extensions, loaded on first use
+        self._nextSuffixes: Dict[str, int] = {}  # Name -> next number worth trying, so taken numbers aren't tried again
+
+    @staticmethod
+    def _toKey(name: str) -> str:
+        return os.path.normcase(name)  # Windows file names are case insensitive
+
+    def _load(self):
+        self._names = set()
+        if not os.path.exists(self._folder):
+            return
+        for entry in os.scandir(self._folder):
+            self._names.add(NameIndex._toKey(os.path.splitext(entry.name)[0]))
+
+    def reserve(self, name: str, extension: str) -> str:
+        """
+        Finds a free name and creates an empty file with it, so no other download can take the same name.
+        If the name is taken, a number is added to it, for example "name (1)"
+        :param name: wanted name without extension
+        :param extension: extension of the file, for example ".mp4"
+        :return: the reserved name without extension
+        """
+        os.makedirs(self._folder, exist_ok=True)
+        baseKey: str = NameIndex._toKey(name)
+        with self._lock:
+            if self._names is None:
+                self._load()
+
+            candidate: str = name
+            while True:
+                if NameIndex._toKey(candidate) not in self._names:
+                    try:
+                        # Fails if the file exists, even if it was created by something else than this index
+                        os.close(os.open(os.path.join(self._folder, candidate + extension), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                        self._names.add(NameIndex._toKey(candidate))
+                        return candidate
+                    except FileExistsError:
+                        self._names.add(NameIndex._toKey(candidate))
+
+                suffix: int = self._nextSuffixes.get(baseKey, 1)
+                self._nextSuffixes[baseKey] = suffix + 1
+                candidate = f"{name} ({suffix})"
+
+    def release(self, name: str):
+        """
+        Frees a name whose file has been removed
+        :param name: the name without extension
+        """
+        with self._lock:
+            if self._names is not None:
+                self._names.discard(NameIndex._toKey(name))
@@ -0,0 +1,402 @@
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from queue import PriorityQueue
+from typing import Callable, Dict, List, Tuple, Union
+
+
+class Job:
+    class STATES:
+        QUEUED = "queued"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+        CANCELLED = "cancelled"
+
+    def __init__(self, stages: List[Tuple], priority: int = 5, data: Dict = None, jobId: str = None):
+        """
+        A unit of work which goes through one or more scheduler stages in order
+        :param stages: list of (stage name, function) pairs. If a function returns False the job fails.
+            A third item can tell how many cores the stage uses, either as a number or a function which is called when the stage starts
+        :param priority: smaller priorities run first
+        :param data: json serializable description of the job. Jobs with data are saved into the persistent queue
+        :param jobId: identifier of the job, generated if not given
+        """
+        self._jobId: str = jobId if jobId is not None else uuid.uuid4().hex
+        self._stages: List[Tuple] = stages
+        self._stageIndex: int = 0
+        self._priority: int = priority
+        self._data: Dict = data
+        self._state: str = Job.STATES.QUEUED
+
+        self._cancelled: threading.Event = threading.Event()
+        self._onCancelFunc = lambda: None  # Called when job is cancelled, used to stop a running stage
+        self._onFinishFunc = lambda job: None  # Called when job is done, failed or cancelled
+        self._onCleanupFunc = lambda: None  # Called when job fails or is cancelled, removes what its finished stages left behind
+
+        self._queuedAt: float = 0  # When the job was put into the queue of its current stage
+
+    def getJobId(self) -> str:
+        return self._jobId
+
+    def getPriority(self) -> int:
+        return self._priority
+
+    def getData(self) -> Dict:
+        return self._data
+
+    def getState(self) -> str:
+        return self._state
+
+    def getStage(self) -> str:
+        """
+        Returns the name of the stage the job is currently in or waiting for
+        :return: stage name
+        """
+        return self._stages[min(self._stageIndex, len(self._stages) - 1)][0]
+
+    def getStageCores(self) -> int:
+        """
+        Returns how many cores the current stage uses
+        :return: amount of cores, 0 if the stage doesn't use a noticeable amount of cpu
+        """
+        stage: Tuple = self._stages[self._stageIndex]
+        if len(stage) < 3:
+            return 0
+        cores: Union[int, Callable[[], int]] = stage[2]
+        return max(0, (cores() if callable(cores) else cores) or 0)
+
+    def isCancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def setOnCancelFunc(self, func):
+        self._onCancelFunc = func
+
+    def setOnFinishFunc(self, func):
+        self._onFinishFunc = func
+
+    def setOnCleanupFunc(self, func):
+        """
+        Sets what is called when the job fails or is cancelled, also while it waits between stages and no stage of it runs
+        """
+        self._onCleanupFunc = func
+
+
+class Scheduler:
+    class STAGES:
+        METADATA = "metadata"
+        DOWNLOAD = "download"
+        MUX = "mux"
+
+    class PRIORITIES:
+        HIGH = 0
+        NORMAL = 5
+        LOW = 10
+
+    DEFAULT_LIMITS: Dict[str, int] = {STAGES.METADATA: 4, STAGES.DOWNLOAD: 3, STAGES.MUX: 2}
+
+    def __init__(self, limits: Dict[str, int] = None, persistPath: str = None, coreBudget: int = None):
+        """
+        Runs jobs with a limited amount of worker threads per stage
+        :param limits: how many jobs each stage can run at the same time
+        :param persistPath: json file which keeps unfinished jobs over restarts. If None, the queue isn't saved
+        :param coreBudget: how many cores the running stages can use together, see Job. If None, the amount of cores of the machine
+        """
+        self._limits: Dict[str, int] = dict(Scheduler.DEFAULT_LIMITS)
+        if limits is not None:
+            self._limits.update(limits)
+
+        self._persistPath: str = persistPath
+        self._persistLock: threading.Lock = threading.Lock()
+
+        self._lock: threading.Lock = threading.Lock()
+        self._sequence = itertools.count()  # Keeps jobs with same priority in submission order
+
+        # Stages which declare cores wait until enough of the budget is free
+        self._coreBudget: int = coreBudget if coreBudget is not None else (os.cpu_count() or 1)
+        self._coresInUse: int = 0
+        self._coresFree: threading.Condition = threading.Condition(self._lock)
+        self._jobs: Dict[str, Job] = {}  # Unfinished jobs
+
+        self._queues: Dict[str, PriorityQueue] = {}
+        self._workerCounts: Dict[str, int] = {}
+        self._stopping: Dict[str, int] = {}  # Stop signals posted to a stage which no worker has taken yet
+        self._queueDepths: Dict[str, int] = {}
+        self._running: Dict[str, int] = {}
+
+        # Wait time statistics per stage: [waited jobs, total wait, longest wait]
+        self._waitTimes: Dict[str, List[float]] = {}
+
+        for stage in self._limits:
+            self._addStage(stage)
+
+    def _addStage(self, stage: str):
+        self._queues[stage] = PriorityQueue()
+        self._workerCounts[stage] = 0
+        self._stopping[stage] = 0
+        self._queueDepths[stage] = 0
+        self._running[stage] = 0
+        self._waitTimes[stage] = [0, 0.0, 0.0]
+        self._limits.setdefault(stage, 1)
+        self._startWorkers(stage)
+
+    def _startWorkers(self, stage: str):
+        # Workers which will take a pending stop signal don't count, they are replaced
+        while self._workerCounts[stage] - self._stopping[stage] < self._limits[stage]:
+            self._workerCounts[stage] += 1
+            threading.Thread(target=self._workerLoop, args=(stage,), name=f"scheduler-{stage}", daemon=True).start()
+
+    def setLimit(self, stage: str, limit: int):
+        """
+        Changes how many jobs a stage can run at the same time
+        :param stage: name of the stage
+        :param limit: new limit
+        """
+        limit = max(1, limit)
+        with self._lock:
+            if stage not in self._queues:
+                self._limits[stage] = limit
+                self._addStage(stage)
+                return
+
+            extraWorkers: int = max(0, self._workerCounts[stage] - self._stopping[stage] - limit)
+            self._stopping[stage] += extraWorkers
+            self._limits[stage] = limit
+            self._startWorkers(stage)
+
+        # A None job stops one worker after it has finished its current job
+        for _ in range(extraWorkers):
+            self._queues[stage].put((float("-inf"), next(self._sequence), None))
+
+    def getLimit(self, stage: str) -> int:
+        return self._limits[stage]
+
+    def setCoreBudget(self, cores: int):
+        """
+        Changes how many cores the running stages can use together
+        :param cores: the new budget
+        """
+        with self._coresFree:
+            self._coreBudget = max(1, cores)
+            self._coresFree.notify_all()
+
+    def getCoreBudget(self) -> int:
+        return self._coreBudget
+
+    def getCoresInUse(self) -> int:
+        with self._lock:
+            return self._coresInUse
+
+    def _reserveCores(self, job: Job) -> int:
+        """
+        Waits until the cores of the current stage of a job are free and reserves them
+        :param job: the job
+        :return: the reserved cores or None if the job was cancelled while waiting
+        """
+        cores: int = job.getStageCores()
+        with self._coresFree:
+            while self._coresInUse + min(cores, self._coreBudget) > self._coreBudget and not job.isCancelled():
+                self._coresFree.wait()
+            if job.isCancelled():
+                return None
+            cores = min(cores, self._coreBudget)  # A stage wanting more than the whole budget runs alone
+            self._coresInUse += cores
+        return cores
+
+    def _releaseCores(self, cores: int):
+        with self._coresFree:
+            self._coresInUse -= cores
+            self._coresFree.notify_all()
+
+    def submit(self, job: Job) -> Job:
+        """
+        Puts a job into the queue of its first stage
+        :param job: the job
+        :return: the same job
+        """
+        with self._lock:
+            self._jobs[job.getJobId()] = job
+        self._persist()
+        self._enqueue(job)
+        return job
+
+    def _enqueue(self, job: Job):
+        stage: str = job.getStage()
+        with self._lock:
+            if stage not in self._queues:
+                self._addStage(stage)
+            self._queueDepths[stage] += 1
+        job._state = Job.STATES.QUEUED
+        job._queuedAt = time.monotonic()
+        self._queues[stage].put((job.getPriority(), next(self._sequence), job))
+
+    def cancel(self, jobId: str) -> bool:
+        """
+        Cancels a queued or running job
+        :param jobId: id of the job
+        :return: whether the job was found
+        """
+        with self._lock:
+            job: Job = self._jobs.get(jobId, None)
+        if job is None:
+            return False
+
+        job._cancelled.set()
+        with self._coresFree:
+            self._coresFree.notify_all()  # Wakes the job if it's waiting for cores
+            running: bool = job.getState() == Job.STATES.RUNNING  # Read under the lock the worker starts the stage with
+        if running:
+            job._onCancelFunc()  # Tells the running stage to stop, worker finishes the job when it returns
+        return True
+
+    def _workerLoop(self, stage: str):
+        queue: PriorityQueue = self._queues[stage]
+        while True:
+            _, _, job = queue.get()
+            if job is None:
+                with self._lock:
+                    self._workerCounts[stage] -= 1
+                    self._stopping[stage] -= 1
+                return
+
+            with self._lock:
+                self._queueDepths[stage] -= 1
+                waited: float = time.monotonic() - job._queuedAt
+                stats: List[float] = self._waitTimes[stage]
+                stats[0] += 1
+                stats[1] += waited
+                stats[2] = max(stats[2], waited)
+
+            if job.isCancelled():
+                self._finish(job, Job.STATES.CANCELLED)
+                continue
+
+            try:
+                cores: int = self._reserveCores(job)
+            except Exception as e:
+                print(f"Job {job.getJobId()} failed in stage {stage}: {e}")
+                self._finish(job, Job.STATES.FAILED)
+                continue
+            if cores is None:
+                self._finish(job, Job.STATES.CANCELLED)
+                continue
+
+            # A job cancelled from here on sees the running state, so its stage is told to stop
+            with self._lock:
+                cancelled: bool = job.isCancelled()
+                if not cancelled:
+                    self._running[stage] += 1
+                    job._state = Job.STATES.RUNNING
+            if cancelled:
+                self._releaseCores(cores)
+                self._finish(job, Job.STATES.CANCELLED)
+                continue
+            try:
+                result = job._stages[job._stageIndex][1]()
+            except Exception as e:
+                print(f"Job {job.getJobId()} failed in stage {stage}: {e}")
+                result = False
+            finally:
+                with self._lock:
+                    self._running[stage] -= 1
+                self._releaseCores(cores)
+
+            if job.isCancelled():
+                self._finish(job, Job.STATES.CANCELLED)
+            elif result is False:
+                self._finish(job, Job.STATES.FAILED)
+            elif job._stageIndex + 1 < len(job._stages):
+                job._stageIndex += 1
+                self._enqueue(job)
+            else:
+                self._finish(job, Job.STATES.DONE)
+
+    def _finish(self, job: Job, state: str):
+        job._state = state
+        if state in (Job.STATES.FAILED, Job.STATES.CANCELLED):
+            try:
+                job._onCleanupFunc()
+            except Exception as e:
+                print(f"Cleanup of job {job.getJobId()} failed: {e}")
+        with self._lock:
+            self._jobs.pop(job.getJobId(), None)
+        self._persist()
+        job._onFinishFunc(job)
+
+    def getQueueDepth(self, stage: str = None) -> int:
+        """
+        Returns how many jobs are waiting
+        :param stage: name of the stage. If None, returns the amount for all stages
+        :return: amount of waiting jobs
+        """
+        with self._lock:
+            if stage is None:
+                return sum(self._queueDepths.values())
+            return self._queueDepths.get(stage, 0)
+
+    def getMetrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns queue depth, running jobs, limit and wait times (in seconds) of every stage
+        :return: dictionary of metrics per stage
+        """
+        metrics: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for stage in self._queues:
+                waited, totalWait, longestWait = self._waitTimes[stage]
+                metrics[stage] = {
+                    "queued": self._queueDepths[stage],
+                    "running": self._running[stage],
+                    "limit": self._limits[stage],
+                    "waitedJobs": waited,
+                    "averageWait": totalWait / waited if waited else 0.0,
+                    "longestWait": longestWait
+                }
+        return metrics
+
+    def collectMetrics(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """
+        Returns the metrics of getMetrics in the form Metrics.addCollector expects
+        :return: list of (metric name, labels, value)
+        """
+        samples: List[Tuple[str, Dict[str, str], float]] = []
+        for stage, values in self.getMetrics().items():
+            for name in ("queued", "running", "limit", "averageWait", "longestWait"):
+                samples.append((f"scheduler_{name}", {"stage": stage}, values[name]))
+        samples.append(("scheduler_cores_in_use", {}, self.getCoresInUse()))
+        samples.append(("scheduler_core_budget", {}, self._coreBudget))
+        return samples
+
+    def _persist(self):
+        """
+        Saves the data of unfinished jobs so they can be submitted again after a restart
+        """
+        if self._persistPath is None:
+            return
+
+        with self._lock:
+            saved = [{"jobId": job.getJobId(), "priority": job.getPriority(), "data": job.getData()}
+                     for job in self._jobs.values() if job.getData() is not None]
+
+        with self._persistLock:
+            # Writes to a temporary file first so a crash can't leave a half written queue
+            tempPath: str = self._persistPath + ".tmp"
+            with open(tempPath, "w") as file:
+                json.dump(saved, file)
+            os.replace(tempPath, self._persistPath)
+
+    def loadPersistedJobs(self) -> List[Dict]:
+        """
+        Returns jobs which were unfinished when the queue was last saved
+        :return: list of dictionaries with jobId, priority and data
+        """
+        if self._persistPath is None or not os.path.exists(self._persistPath):
+            return []
+
+        try:
+            with open(self._persistPath, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return []
@@ -0,0 +1,316 @@
+import mmap
+import os
+
+
+class SinkSettings:
+    class SYNC:
+        NONE = "none"  # The operating system decides when written bytes reach the disk
+        CLOSE = "close"  # A complete file is synced before it's closed or renamed
+        JOURNAL = "journal"  # Bytes are synced before a journal claims them, so a power loss can't lose a journaled part
+
+    def __init__(self, bufferSize: int = 1048576, preallocate: bool = True, sync: str = SYNC.NONE, directIO: bool = False):
+        """
+        How downloads write their files
+        :param bufferSize: bytes collected before they are written with a single call. Larger writes fragment files less
+        :param preallocate: whether the blocks of a file with a known size are reserved before it's written
+        :param sync: one of SYNC
+        :param directIO: whether writes skip the page cache of the operating system. Ignored where it isn't supported
+        """
+        self.bufferSize: int = bufferSize
+        self.preallocate: bool = preallocate
+        self.sync: str = sync
+        self.directIO: bool = directIO
+
+
+# Direct I/O needs buffers, offsets and lengths aligned to the logical block size of the disk, which this covers on common disks
+ALIGNMENT: int = 4096
+
+# Output files are written under this prefix in the output folder and renamed when they are complete
+PARTIAL_PREFIX: str = ".part-"
+
+_settings: SinkSettings = SinkSettings()
+_directIOWarned: bool = False
+
+
+def configure(settings: SinkSettings):
+    """
+    Sets how every download writes its files from now on
+    """
+    global _settings
+    _settings = settings
+
+
+def getSettings() -> SinkSettings:
+    return _settings
+
+
+def directIOSupported() -> bool:
+    return hasattr(os, "O_DIRECT")
+
+
+def _syncData(fd: int):
+    getattr(os, "fdatasync", os.fsync)(fd)  # Metadata such as the modification time doesn't need to be synced
+
+
+def preallocate(fd: int, size: int) -> bool:
+    """
+    Reserves the blocks of a whole file at once, so the file system can place it in one piece
+    :param fd: descriptor of the file
+    :param size: size of the complete file
+    :return: whether the blocks were reserved. False where the platform or file system doesn't support it
+    """
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return False
+    try:
+        os.posix_fallocate(fd, 0, size)
+        return True
+    except OSError:
+        return False
+
+
+def allocateFile(path: str, size: int, settings: SinkSettings = None) -> bool:
+    """
+    Creates a file of a size into which parts are written by several sinks, for example the segments of a download.
+    Existing bytes are kept
+    :param path: path to the file
+    :param size: size of the complete file
+    :param settings: settings of the sinks. If None, the configured ones
+    :return: whether the blocks were reserved, see preallocate
+    """
+    settings = settings if settings is not None else _settings
+    fd: int = os.open(path, os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        allocated: bool = settings.preallocate and preallocate(fd, size)
+        if not allocated:
+            os.ftruncate(fd, size)  # Sparse, blocks are allocated as the parts arrive
+        return allocated
+    finally:
+        os.close(fd)
+
+
+def getPartialPath(finalPath: str) -> str:
+    """
+    Returns where a file is written before it's renamed to its final path. The extension is kept, so ffmpeg still knows the format
+    """
+    folder, name = os.path.split(finalPath)
+    return os.path.join(folder, PARTIAL_PREFIX + name)
+
+
+def commitFile(partialPath: str, finalPath: str, settings: SinkSettings = None):
+    """
+    Renames a complete file to its final path in the same folder. The file appears there complete or not at all
+    :param partialPath: path to the complete file
+    :param finalPath: final path, replaced if it exists
+    :param settings: sync policy. If None, the configured one
+    """
+    settings = settings if settings is not None else _settings
+    if settings.sync != SinkSettings.SYNC.NONE:
+        fd: int = os.open(partialPath, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    os.replace(partialPath, finalPath)
+    if settings.sync != SinkSettings.SYNC.NONE:
+        _syncFolder(os.path.dirname(finalPath) or ".")
+
+
+def _syncFolder(folder: str):
+    # Makes the rename survive a power loss. Folders can't be opened on Windows, where renames are journaled anyway
+    try:
+        fd: int = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class FileSink:
+    def __init__(self, path: str, offset: int = 0, size: int = 0, settings: SinkSettings = None, ownsFile: bool = True, finalPath: str = None):
+        """
+        Writes a file sequentially from an offset through a large buffer. Bytes before the offset are kept
+        :param path: path to the file, created if it doesn't exist
+        :param offset: where writing starts
+        :param size: size of the complete file, 0 if it isn't known
+        :param settings: how the file is written. If None, the configured settings
+        :param ownsFile: whether this sink writes the file up to its end. If not, it writes a part of a file made
+            with allocateFile, and neither allocates nor truncates it
+        :param finalPath: where commit renames the file
+        """
+        self._path: str = path
+        self._size: int = size
+        self._settings: SinkSettings = settings if settings is not None else _settings
+        self._ownsFile: bool = ownsFile
+        self._finalPath: str = finalPath
+        self._closed: bool = False
+
+        flags: int = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        self._direct: bool = self._settings.directIO and directIOSupported()
+        self._fd: int = None
+        if self._direct:
+            try:
+                self._fd = os.open(path, flags | os.O_DIRECT, 0o666)
+            except OSError as e:
+                FileSink._warnDirectIO(e)
+                self._direct = False
+        if self._fd is None:
+            self._fd = os.open(path, flags, 0o666)
+
+        self._allocated: bool = False
+        try:
+            if ownsFile:
+                self._allocated = self._settings.preallocate and preallocate(self._fd, size)
+                if not self._allocated:
+                    os.ftruncate(self._fd, offset)  # Bytes after the offset are written again
+        except OSError:
+            os.close(self._fd)
+            raise
+
+        # Direct writes need an aligned buffer. Anonymous memory maps start at a page boundary
+        bufferSize: int = max(self._settings.bufferSize, ALIGNMENT)
+        if self._direct:
+            bufferSize = -(-bufferSize // ALIGNMENT) * ALIGNMENT
+            self._buffer = mmap.mmap(-1, bufferSize)
+        else:
+            self._buffer = bytearray(bufferSize)
+        self._view: memoryview = memoryview(self._buffer)
+        self._used: int = 0
+
+        # Direct writes start at a block boundary, so the start of a partly written block is read back into the buffer
+        self._position: int = offset - offset % ALIGNMENT if self._direct else offset  # File offset of the start of the buffer
+        if self._position < offset:
+            head: bytes = self._readBack(self._position, offset - self._position)
+            self._view[:len(head)] = head
+            self._used = len(head)
+        os.lseek(self._fd, self._position, os.SEEK_SET)
+
+    @staticmethod
+    def _warnDirectIO(error: OSError):
+        global _directIOWarned
+        if not _directIOWarned:
+            _directIOWarned = True
+            print(f"Direct I/O isn't supported here, writing through the page cache: {error}")
+
+    def _readBack(self, start: int, length: int) -> bytes:
+        with open(self._path, "rb") as file:
+            file.seek(start)
+            data: bytes = file.read(length)
+        return data + bytes(length - len(data))
+
+    def getPath(self) -> str:
+        return self._path
+
+    def write(self, data: bytes) -> int:
+        """
+        Adds bytes to the buffer, writing it whenever it gets full
+        :param data: the bytes
+        :return: how many bytes were added
+        """
+        data = memoryview(data)
+        if not self._direct and self._used == 0 and len(data) >= len(self._buffer):
+            self._writeAll(data)  # Already large enough, copying it into the buffer would only cost time
+            self._position += len(data)
+            return len(data)
+
+        written: int = 0
+        while written < len(data):
+            amount: int = min(len(self._buffer) - self._used, len(data) - written)
+            self._view[self._used:self._used + amount] = data[written:written + amount]
+            self._used += amount
+            written += amount
+            if self._used == len(self._buffer):
+                self._writeBuffer(self._used)
+        return written
+
+    def _writeAll(self, data: memoryview):
+        while len(data) > 0:
+            data = data[os.write(self._fd, data):]
+
+    def _writeBuffer(self, amount: int):
+        """
+        Writes the first bytes of the buffer and moves the rest to its start
+        """
+        self._writeAll(self._view[:amount])
+        self._position += amount
+        remaining: int = self._used - amount
+        if remaining > 0:
+            self._view[:remaining] = self._view[amount:self._used]
+        self._used = remaining
+
+    def flush(self) -> int:
+        """
+        Writes the buffered bytes, and syncs them if the sync policy is journal. Direct I/O keeps the bytes of an unfinished block buffered
+        :return: offset up to which the file is written, which a journal can claim
+        """
+        self._writeBuffer(self._used - self._used % ALIGNMENT if self._direct else self._used)
+        if self._settings.sync == SinkSettings.SYNC.JOURNAL:
+            _syncData(self._fd)
+        return self._position
+
+    def close(self, complete: bool = True) -> int:
+        """
+        Writes the rest of the buffer and closes the file
+        :param complete: whether every byte of the file or part has been written. Only a complete file is synced and truncated
+        :return: offset up to which the file is written
+        """
+        if self._closed:
+            return self._position
+        self._closed = True
+        try:
+            self._writeBuffer(self._used - self._used % ALIGNMENT if self._direct else self._used)
+            if self._used > 0:
+                self._writeTail()
+            end: int = self._position
+            if complete and self._ownsFile and self._allocated and os.fstat(self._fd).st_size > end:
+                os.ftruncate(self._fd, end)  # The stream was shorter than its announced size
+            if complete and self._settings.sync != SinkSettings.SYNC.NONE:
+                _syncData(self._fd)
+            return end
+        finally:
+            os.close(self._fd)
+            self._view.release()
+            if self._direct:
+                self._buffer.close()
+
+    def _writeTail(self):
+        # The last bytes don't fill a block, so they are written through the page cache
+        fd: int = os.open(self._path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+        try:
+            os.lseek(fd, self._position, os.SEEK_SET)
+            data: memoryview = self._view[:self._used]
+            while len(data) > 0:
+                data = data[os.write(fd, data):]
+            if self._settings.sync != SinkSettings.SYNC.NONE:
+                _syncData(fd)
+        finally:
+            os.close(fd)
+        self._position += self._used
+        self._used = 0
+
+    def commit(self):
+        """
+        Closes the complete file and renames it to its final path
+        """
+        self.close(True)
+        if self._finalPath is not None:
+            commitFile(self._path, self._finalPath, self._settings)
+
+    def discard(self):
+        """
+        Closes and removes the file of a failed or cancelled download
+        """
+        self.close(False)
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "FileSink":
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close(excType is None)
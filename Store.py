@@ -0,0 +1,256 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FICLONE: int = 0x40049409  # Linux ioctl which makes a copy-on-write clone of a file (btrfs, xfs)
+
+
+def linkFile(source: str, destination: str, allowCopy: bool = True) -> str:
+    """
+    Makes a file appear at a second path without copying its bytes if possible. The destination is replaced atomically
+    :param source: existing file
+    :param destination: path of the new file
+    :param allowCopy: whether the bytes are copied if the file system can't share them
+    :return: "hardlink", "reflink" or "copy" depending on how it was done, None if it couldn't be done
+    """
+    tempPath: str = destination + ".link"
+    try:
+        os.remove(tempPath)
+    except FileNotFoundError:
+        pass
+
+    method: str = None
+    try:
+        os.link(source, tempPath)
+        method = "hardlink"
+    except OSError:
+        pass
+
+    if method is None and fcntl is not None:
+        try:
+            with open(source, "rb") as sourceFile, open(tempPath, "wb") as cloneFile:
+                fcntl.ioctl(cloneFile.fileno(), FICLONE, sourceFile.fileno())
+            method = "reflink"
+        except OSError:
+            pass
+
+    if method is None and allowCopy:
+        try:
+            shutil.copyfile(source, tempPath)
+            method = "copy"
+        except OSError:
+            pass
+
+    if method is None:
+        try:
+            os.remove(tempPath)
+        except FileNotFoundError:
+            pass
+        return None
+
+    os.replace(tempPath, destination)
+    return method
+
+
+class ArtifactStore:
+    EXTENSION: str = ".mp4"
+
+    def __init__(self, root: str = "store", maxBytes: int = None, maxEntries: int = None, maxAge: float = None):
+        """
+        Keeps finished videos by what they were made of, so the same video with the same streams and settings is
+        only downloaded and combined once. Stored files share their bytes with the downloaded files when the file
+        system allows it. Least recently used files are evicted first
+        :param root: folder of the stored files
+        :param maxBytes: how many bytes the stored files can take together. If None, not limited
+        :param maxEntries: how many files are kept. If None, not limited
+        :param maxAge: seconds since a file was last used before it's evicted. If None, files don't expire
+        """
+        self._root: str = root
+        self._maxBytes: int = maxBytes
+        self._maxEntries: int = maxEntries
+        self._maxAge: float = maxAge
+
+        self._lock: threading.Lock = threading.Lock()
+        self._entries: Dict[str, List[float]] = None  # Key -> [size, last used], loaded on first use
+        self._inFlight: Dict[str, Tuple[threading.Event, List[str]]] = {}  # Key -> (set when finished, [stored path])
+
+        self._hits: int = 0
+        self._misses: int = 0
+        self._coalesced: int = 0
+
+    @staticmethod
+    def makeKey(videoId: str, videoItag: int, audioItag: int, settings: List[str]) -> str:
+        """
+        Returns the key of a video made of two streams
+        :param videoId: id of the video
+        :param videoItag: itag of the video stream
+        :param audioItag: itag of the audio stream
+        :param settings: everything else that changes the output, for example ffmpeg options
+        :return: the key
+        """
+        description: str = json.dumps([videoId, videoItag, audioItag, list(settings)])
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    def _getPath(self, key: str) -> str:
+        return os.path.join(self._root, key[:2], key + ArtifactStore.EXTENSION)
+
+    def _load(self):
+        self._entries = {}
+        if not os.path.exists(self._root):
+            return
+        for folder in os.scandir(self._root):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(ArtifactStore.EXTENSION):
+                    stat = entry.stat()
+                    self._entries[entry.name[:-len(ArtifactStore.EXTENSION)]] = [stat.st_size, stat.st_mtime]
+
+    def lookup(self, key: str) -> str:
+        """
+        Returns the path of a stored file and marks it used
+        :param key: key of the file
+        :return: the path or None if it isn't stored
+        """
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entry: List[float] = self._entries.get(key, None)
+            if entry is None or not os.path.exists(self._getPath(key)):
+                self._entries.pop(key, None)
+                self._misses += 1
+                return None
+            self._hits += 1
+            entry[1] = time.time()
+
+        path: str = self._getPath(key)
+        try:
+            os.utime(path)  # Modification time keeps the use order over restarts
+        except OSError:
+            pass
+        return path
+
+    def claim(self, key: str) -> bool:
+        """
+        Tells the store that this caller is going to make a file. Callers which want the same file wait for it with waitFor
+        :param key: key of the file
+        :return: True if the caller should make the file, False if someone else is already making it
+        """
+        with self._lock:
+            if key in self._inFlight:
+                self._coalesced += 1
+                return False
+            self._inFlight[key] = (threading.Event(), [None])
+            return True
+
+    def waitFor(self, key: str, timeout: float = None) -> str:
+        """
+        Waits for the file another caller has claimed
+        :param key: key of the file
+        :param timeout: seconds to wait at most
+        :return: path of the stored file or None if it wasn't made
+        """
+        with self._lock:
+            flight = self._inFlight.get(key, None)
+        if flight is None:
+            return self.lookup(key)
+        flight[0].wait(timeout)
+        return flight[1][0]
+
+    def finish(self, key: str, filePath: str = None) -> str:
+        """
+        Stores a finished file and wakes the callers waiting for it. Has to be called after claim, also when making the file failed
+        :param key: key of the file
+        :param filePath: path to the finished file or None if it couldn't be made
+        :return: path of the stored file or None if it wasn't stored
+        """
+        storedPath: str = None
+        if filePath is not None:
+            storedPath = self._add(key, filePath)
+
+        with self._lock:
+            flight = self._inFlight.pop(key, None)
+        if flight is not None:
+            flight[1][0] = storedPath
+            flight[0].set()
+        return storedPath
+
+    def _add(self, key: str, filePath: str) -> str:
+        path: str = self._getPath(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Only shares bytes with the file. A copy would double the disk usage of every download
+        if linkFile(filePath, path, allowCopy=False) is None:
+            return None
+
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            self._entries[key] = [os.path.getsize(path), time.time()]
+        self.evict()
+        return path
+
+    def evict(self) -> int:
+        """
+        Removes expired files and least recently used files until the store fits its limits
+        :return: how many files were removed
+        """
+        with self._lock:
+            if self._entries is None:
+                self._load()
+
+            removed: List[str] = []
+            oldestAllowed: float = time.time() - self._maxAge if self._maxAge is not None else None
+            totalBytes: int = sum(entry[0] for entry in self._entries.values())
+            for key, (size, lastUsed) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+                if key in self._inFlight:
+                    continue
+                tooOld: bool = oldestAllowed is not None and lastUsed < oldestAllowed
+                tooBig: bool = self._maxBytes is not None and totalBytes > self._maxBytes
+                tooMany: bool = self._maxEntries is not None and len(self._entries) - len(removed) > self._maxEntries
+                if not (tooOld or tooBig or tooMany):
+                    continue
+                removed.append(key)
+                totalBytes -= size
+
+            for key in removed:
+                del self._entries[key]
+
+        for key in removed:
+            try:
+                os.remove(self._getPath(key))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    print(f"Couldn't remove a stored file: {e}")
+        return len(removed)
+
+    def invalidate(self, key: str):
+        """
+        Removes a stored file
+        :param key: key of the file
+        """
+        with self._lock:
+            if self._entries is not None:
+                self._entries.pop(key, None)
+        try:
+            os.remove(self._getPath(key))
+        except FileNotFoundError:
+            pass
+
+    def getStats(self) -> Dict[str, int]:
+        """
+        Returns hits, misses, coalesced jobs, amount of stored files and their total size
+        """
+        with self._lock:
+            entries: Dict[str, List[float]] = self._entries if self._entries is not None else {}
+            return {"hits": self._hits, "misses": self._misses, "coalesced": self._coalesced,
+                    "entries": len(entries), "bytes": sum(entry[0] for entry in entries.values())}
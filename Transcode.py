@@ -0,0 +1,138 @@
+import os
+from typing import List, Set
+
+import pytube
+
+
+class TranscodeSettings:
+    class PRESETS:
+        ULTRAFAST = "ultrafast"
+        VERYFAST = "veryfast"
+        MEDIUM = "medium"
+        SLOW = "slow"
+
+    def __init__(self, threads: int = None, preset: str = PRESETS.VERYFAST, crf: int = 23, audioBitrate: str = "160k",
+                 hardwareEncoder: str = None):
+        """
+        How streams which can't be copied into the output container are encoded
+        :param threads: cores a single transcoding job can use. If None, half of the cores of the machine
+        :param preset: x264 preset, faster presets use less cpu time for a bigger file
+        :param crf: x264 quality, smaller is better
+        :param audioBitrate: bitrate of transcoded audio
+        :param hardwareEncoder: ffmpeg encoder used for video instead of libx264, for example "h264_nvenc" or "h264_vaapi"
+        """
+        self.threads: int = threads if threads is not None else max(1, (os.cpu_count() or 2) // 2)
+        self.preset: str = preset
+        self.crf: int = crf
+        self.audioBitrate: str = audioBitrate
+        self.hardwareEncoder: str = hardwareEncoder
+
+
+class TranscodePlan:
+    def __init__(self, copyVideo: bool, copyAudio: bool, settings: TranscodeSettings, hardwareEncoder: str = None):
+        """
+        Decides the ffmpeg codec options of a single combination
+        :param copyVideo: whether the video stream can be copied as it is
+        :param copyAudio: whether the audio stream can be copied as it is
+        :param settings: how streams which can't be copied are encoded
+        :param hardwareEncoder: encoder used for video instead of libx264, None to encode on the cpu
+        """
+        self._copyVideo: bool = copyVideo
+        self._copyAudio: bool = copyAudio
+        self._settings: TranscodeSettings = settings
+        self._hardwareEncoder: str = hardwareEncoder
+
+    def isCopy(self) -> bool:
+        """
+        Returns whether both streams are copied, which only rewrites the container and takes almost no cpu
+        """
+        return self._copyVideo and self._copyAudio
+
+    def getCores(self) -> int:
+        """
+        Returns how many cores the combination uses, so the scheduler can keep transcodes from overloading the machine
+        :return: 0 for a copy
+        """
+        if not self._copyVideo and self._hardwareEncoder is None:
+            return self._settings.threads
+        return 0 if self.isCopy() else 1  # Audio and hardware encoding only need a core to feed them
+
+    def getOutputOptions(self) -> List[str]:
+        """
+        Returns the ffmpeg codec options of the output file
+        :return: list of arguments
+        """
+        options: List[str] = []
+        if self._copyVideo:
+            options += ["-c:v", "copy"]
+        elif self._hardwareEncoder is not None:
+            options += ["-c:v", self._hardwareEncoder]
+        else:
+            options += ["-c:v", "libx264", "-preset", self._settings.preset, "-crf", str(self._settings.crf),
+                        "-pix_fmt", "yuv420p", "-threads", str(self._settings.threads)]
+
+        if self._copyAudio:
+            options += ["-c:a", "copy"]
+        else:
+            options += ["-c:a", "aac", "-b:a", self._settings.audioBitrate]
+        return options
+
+
+class Transcoder:
+    class AUDIO_FORMATS:
+        M4A = "m4a"
+        OPUS = "opus"
+        MP3 = "mp3"
+
+    # Codecs which can be copied into an mp4 file and are played by common players. Other codecs, such as
+    # vp9 and opus from webm streams, are transcoded
+    MP4_VIDEO_CODECS = ("avc1", "hvc1", "hev1", "av01")
+    MP4_AUDIO_CODECS = ("mp4a",)
+
+    # Audio codecs each audio-only format holds without encoding, and the encoder used for other codecs
+    AUDIO_FORMAT_CODECS = {AUDIO_FORMATS.M4A: ("mp4a",), AUDIO_FORMATS.OPUS: ("opus",), AUDIO_FORMATS.MP3: ()}
+    AUDIO_FORMAT_ENCODERS = {AUDIO_FORMATS.M4A: "aac", AUDIO_FORMATS.OPUS: "libopus", AUDIO_FORMATS.MP3: "libmp3lame"}
+
+    @staticmethod
+    def canCopy(codec: str, allowed) -> bool:
+        """
+        Returns whether a codec can be copied into the container
+        :param codec: codec string of a stream, for example "avc1.640028"
+        :param allowed: allowed codec families
+        """
+        if codec is None:
+            return False
+        return codec.split(".")[0].lower() in allowed
+
+    @staticmethod
+    def plan(videoStream: pytube.Stream, audioStream: pytube.Stream, settings: TranscodeSettings, encoders: Set[str] = None) -> TranscodePlan:
+        """
+        Decides which streams have to be transcoded to be combined into an mp4 file
+        :param videoStream: the video stream
+        :param audioStream: the audio stream
+        :param settings: how streams which can't be copied are encoded
+        :param encoders: encoders ffmpeg has. A hardware encoder which isn't one of them is replaced by libx264. If None, isn't checked
+        :return: the plan
+        """
+        copyVideo: bool = Transcoder.canCopy(videoStream.video_codec, Transcoder.MP4_VIDEO_CODECS)
+        copyAudio: bool = Transcoder.canCopy(audioStream.audio_codec, Transcoder.MP4_AUDIO_CODECS)
+
+        hardwareEncoder: str = settings.hardwareEncoder
+        if hardwareEncoder is not None and encoders is not None and hardwareEncoder not in encoders:
+            hardwareEncoder = None
+        return TranscodePlan(copyVideo, copyAudio, settings, hardwareEncoder)
+
+    @staticmethod
+    def planAudio(audioStream: pytube.Stream, audioFormat: str, settings: TranscodeSettings) -> List[str]:
+        """
+        Decides how an audio stream becomes an audio-only file
+        :param audioStream: the audio stream
+        :param audioFormat: one of AUDIO_FORMATS
+        :param settings: how a stream which can't be copied is encoded
+        :return: ffmpeg options of the output file, or None if the stream is already a file of that format and is written as it is
+        """
+        if not Transcoder.canCopy(audioStream.audio_codec, Transcoder.AUDIO_FORMAT_CODECS[audioFormat]):
+            return ["-vn", "-c:a", Transcoder.AUDIO_FORMAT_ENCODERS[audioFormat], "-b:a", settings.audioBitrate]
+        if audioFormat == Transcoder.AUDIO_FORMATS.M4A:
+            return None  # Audio mp4 streams are m4a files already
+        return ["-vn", "-c:a", "copy"]  # Opus of a webm stream only moves into an ogg container
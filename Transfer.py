@@ -0,0 +1,381 @@
+import io
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Set, Tuple
+from urllib.error import HTTPError, URLError
+
+import pytube.request
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import Sink
+from Sink import FileSink, SinkSettings
+
+DEFAULT_RANGE_SIZE: int = 9437184  # 9MB, same range size pytube requests
+DEFAULT_CHUNK_SIZE: int = 65536
+DEFAULT_SEGMENT_SIZE: int = 8388608  # 8MB
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+
+# Errors after which the transfer continues from the byte it had reached
+RETRIED_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+# One session for every request of the program, so connections to the same host are kept open and reused
+_session: requests.Session = None
+_sessionLock: threading.Lock = threading.Lock()
+_timeout: Tuple[float, float] = (10, 30)  # Seconds to wait for a connection and for data
+
+
+def _createSession(poolSize: int = 32, retries: int = 3, backoff: float = 0.5) -> requests.Session:
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=retry)
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configureSession(poolSize: int = 32, retries: int = 3, backoff: float = 0.5, connectTimeout: float = 10, readTimeout: float = 30):
+    """
+    Replaces the shared session with one using the given settings
+    :param poolSize: how many connections are kept open per host. Should be at least the amount of transfers running at once
+    :param retries: how many times a failed connection or an overloaded server (429, 5xx) is retried before giving up
+    :param backoff: seconds to wait before the first retry, doubled for every following retry
+    :param connectTimeout: seconds to wait for a connection
+    :param readTimeout: seconds to wait for data
+    """
+    global _session, _timeout
+    session: requests.Session = _createSession(poolSize, retries, backoff)
+    with _sessionLock:
+        previous, _session, _timeout = _session, session, (connectTimeout, readTimeout)
+    if previous is not None:
+        previous.close()
+
+
+def getSession() -> requests.Session:
+    """
+    Returns the shared session, created with the default settings of configureSession on first use
+    :return: the session
+    """
+    global _session
+    with _sessionLock:
+        if _session is None:
+            _session = _createSession()
+        return _session
+
+
+class _PytubeResponse:
+    def __init__(self, response: requests.Response):
+        """
+        Makes a response of requests look like the urllib response pytube expects
+        :param response: the response
+        """
+        self._response: requests.Response = response
+        self._body: io.BytesIO = io.BytesIO(response.content)  # Reading the body returns the connection to the pool
+
+    def read(self, amount: int = -1) -> bytes:
+        return self._body.read(amount)
+
+    def info(self):
+        return self._response.headers  # Case insensitive like the headers of urllib
+
+    def getcode(self) -> int:
+        return self._response.status_code
+
+
+def _executePytubeRequest(url, method=None, headers=None, data=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+    """
+    Replacement of pytube.request._execute_request which sends the request with the shared session
+    """
+    if not url.lower().startswith("http"):
+        raise ValueError("Invalid URL")
+    if data and not isinstance(data, bytes):
+        data = bytes(json.dumps(data), encoding="utf-8")
+    if not isinstance(timeout, (int, float)):
+        timeout = _timeout
+
+    try:
+        response = getSession().request(method or ("POST" if data else "GET"), url, headers=headers, data=data, timeout=timeout)
+    except requests.Timeout as e:
+        raise URLError(socket.timeout(str(e)))  # pytube retries timeouts
+    except requests.RequestException as e:
+        raise URLError(e)
+
+    if response.status_code >= 400:
+        raise HTTPError(url, response.status_code, response.reason, response.headers, None)
+    return _PytubeResponse(response)
+
+
+def installPytubeAdapter():
+    """
+    Sends the requests of pytube, such as metadata fetches, through the shared session
+    """
+    pytube.request._execute_request = _executePytubeRequest
+
+
+class Journal:
+    EXTENSION: str = ".journal"
+
+    def __init__(self, dataPath: str, url: str, itag: int, expectedSize: int, offset: int = 0, videoId: str = None,
+                 segmentSize: int = None, segments: List[int] = None):
+        """
+        Records how far the download of a partial file has gotten, so it can be continued after a restart
+        :param dataPath: path to the partial file
+        :param url: url the file is downloaded from
+        :param itag: itag of the downloaded stream
+        :param expectedSize: size of the complete file in bytes
+        :param offset: how many bytes from the start of the file are on disk
+        :param videoId: id of the video the stream belongs to
+        :param segmentSize: size of the segments of a segmented download
+        :param segments: indexes of the finished segments of a segmented download
+        """
+        self.dataPath: str = dataPath
+        self.url: str = url
+        self.itag: int = itag
+        self.expectedSize: int = expectedSize
+        self.offset: int = offset
+        self.videoId: str = videoId
+        self.segmentSize: int = segmentSize
+        self.segments: List[int] = segments if segments is not None else []
+
+    @staticmethod
+    def getJournalPath(dataPath: str) -> str:
+        return dataPath + Journal.EXTENSION
+
+    @staticmethod
+    def load(dataPath: str) -> "Journal":
+        """
+        Loads the journal of a partial file
+        :param dataPath: path to the partial file
+        :return: the journal or None if the file doesn't have a valid one
+        """
+        try:
+            with open(Journal.getJournalPath(dataPath), "r") as file:
+                saved = json.load(file)
+            return Journal(dataPath, saved["url"], saved["itag"], saved["expectedSize"], saved["offset"], saved.get("videoId", None),
+                           saved.get("segmentSize", None), saved.get("segments", None))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self):
+        # Writes to a temporary file first so a crash can't leave a half written journal
+        journalPath: str = Journal.getJournalPath(self.dataPath)
+        with open(journalPath + ".tmp", "w") as file:
+            json.dump({"url": self.url, "itag": self.itag, "expectedSize": self.expectedSize, "offset": self.offset, "videoId": self.videoId,
+                       "segmentSize": self.segmentSize, "segments": self.segments}, file)
+        os.replace(journalPath + ".tmp", journalPath)
+
+    def remove(self):
+        Journal.discard(self.dataPath)
+
+    @staticmethod
+    def discard(dataPath: str):
+        """
+        Removes the journal of a file if it has one
+        :param dataPath: path to the file
+        """
+        try:
+            os.remove(Journal.getJournalPath(dataPath))
+        except FileNotFoundError:
+            pass
+
+
+def streamRange(url: str, start: int, size: int, maxRetries: int = 5, timeout: float = None,
+                rangeSize: int = DEFAULT_RANGE_SIZE, chunkSize: int = DEFAULT_CHUNK_SIZE, session: requests.Session = None,
+                throttle: Callable[[int], None] = None) -> Iterator[bytes]:
+    """
+    Reads a file with Range requests. A dropped connection is continued from the byte it had reached
+    :param url: url of the file
+    :param start: first byte to read
+    :param size: size of the whole file, or the byte after the last byte to read
+    :param maxRetries: how many times in a row a failed request is retried
+    :param timeout: seconds to wait for the server. If None, the timeouts of the shared session
+    :param rangeSize: how many bytes are asked with a single request
+    :param chunkSize: size of the yielded chunks
+    :param session: session whose connections are reused. If None, the shared session
+    :param throttle: called with the size of every received chunk, can wait to limit the rate
+    :return: chunks of the file
+    """
+    session = session if session is not None else getSession()
+    timeout = timeout if timeout is not None else _timeout
+    offset: int = start
+    retries: int = 0
+    while offset < size:
+        end: int = min(offset + rangeSize, size) - 1
+        try:
+            headers = dict(DEFAULT_HEADERS, Range=f"bytes={offset}-{end}")
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                skip: int = offset if response.status_code != 206 else 0  # Server ignored the range and sent the whole file
+                for chunk in response.iter_content(chunkSize):
+                    if skip > 0:
+                        chunk, skip = chunk[skip:], max(0, skip - len(chunk))
+                        if not chunk:
+                            continue
+                    chunk = chunk[:size - offset]
+                    offset += len(chunk)
+                    retries = 0
+                    if throttle is not None:
+                        throttle(len(chunk))  # Not reading makes the server slow down too, once the socket buffers are full
+                    yield chunk
+                    if offset >= size:
+                        return
+            if offset <= end:
+                # Closed early without an error. Retried like a dropped connection, so a server sending nothing can't loop forever
+                raise requests.exceptions.ChunkedEncodingError(f"Response ended at byte {offset} before the end of its range at {end + 1}")
+        except RETRIED_ERRORS:
+            retries += 1
+            if retries > maxRetries:
+                raise
+            time.sleep(min(0.25 * 2 ** retries, 10))  # Backs off so a struggling server isn't hammered
+
+
+def downloadToFile(url: str, dataPath: str, expectedSize: int, itag: int = None, videoId: str = None,
+                   onProgress: Callable[[int, int], None] = None, isCancelled: Callable[[], bool] = None,
+                   journalInterval: int = 1048576, connections: int = 1, segmentSize: int = DEFAULT_SEGMENT_SIZE,
+                   throttle: Callable[[int], None] = None) -> bool:
+    """
+    Downloads a file and keeps a journal next to it, so an interrupted download continues where it stopped.
+    The file is written through a sink with the settings of Sink.configure
+    :param url: url of the file
+    :param dataPath: where the file is written
+    :param expectedSize: size of the complete file
+    :param itag: itag of the stream, used to match the journal
+    :param videoId: id of the video, used to find the file after a restart
+    :param onProgress: called with downloaded and total bytes after every chunk
+    :param isCancelled: returns whether the download should stop
+    :param journalInterval: how many bytes are written between journal updates
+    :param connections: how many connections download the file. More than one downloads it in segments
+    :param segmentSize: size of a segment when downloading with several connections
+    :param throttle: called with the size of every received chunk, can wait to limit the rate
+    :return: whether the file was completed. False if it was cancelled
+    """
+    if connections > 1 and expectedSize > segmentSize:
+        return downloadSegmented(url, dataPath, expectedSize, itag, videoId, onProgress, isCancelled, connections, segmentSize, throttle)
+
+    offset: int = 0
+    journal: Journal = Journal.load(dataPath)
+    if journal is not None and journal.itag == itag and journal.expectedSize == expectedSize and os.path.exists(dataPath):
+        offset = min(journal.offset, os.path.getsize(dataPath))  # Bytes after the journal offset may not have been flushed
+
+    journal = Journal(dataPath, url, itag, expectedSize, offset, videoId)
+    journal.save()
+
+    sink: FileSink = FileSink(dataPath, offset, expectedSize)
+    complete: bool = False
+    unsaved: int = 0
+    try:
+        for chunk in streamRange(url, offset, expectedSize, throttle=throttle):
+            if isCancelled is not None and isCancelled():
+                return False
+            sink.write(chunk)
+            offset += len(chunk)
+            unsaved += len(chunk)
+            if onProgress is not None:
+                onProgress(offset, expectedSize)
+
+            if unsaved >= journalInterval:
+                journal.offset = sink.flush()  # Journal mustn't claim bytes which aren't in the file yet
+                journal.save()
+                unsaved = 0
+        complete = True
+    finally:
+        journal.offset = sink.close(complete)
+        journal.save()
+
+    journal.remove()
+    return True
+
+
+def downloadSegmented(url: str, dataPath: str, expectedSize: int, itag: int = None, videoId: str = None,
+                      onProgress: Callable[[int, int], None] = None, isCancelled: Callable[[], bool] = None,
+                      connections: int = 4, segmentSize: int = DEFAULT_SEGMENT_SIZE, throttle: Callable[[int], None] = None) -> bool:
+    """
+    Downloads a file in byte ranges over several connections at once. Each range is written into its
+    place in a file which is allocated to its full size first. Finished segments are kept in a journal
+    :param url: url of the file
+    :param dataPath: where the file is written
+    :param expectedSize: size of the complete file
+    :param itag: itag of the stream, used to match the journal
+    :param videoId: id of the video, used to find the file after a restart
+    :param onProgress: called with downloaded and total bytes after every chunk
+    :param isCancelled: returns whether the download should stop
+    :param connections: how many segments are downloaded at the same time
+    :param segmentSize: size of a segment in bytes
+    :param throttle: called with the size of every received chunk, can wait to limit the rate
+    :return: whether the file was completed. False if it was cancelled
+    """
+    segmentCount: int = (expectedSize + segmentSize - 1) // segmentSize
+    finished: Set[int] = set()
+
+    journal: Journal = Journal.load(dataPath)
+    if journal is not None and journal.itag == itag and journal.expectedSize == expectedSize and os.path.exists(dataPath):
+        if journal.segmentSize == segmentSize:
+            finished.update(journal.segments)
+        finished.update(range(min(journal.offset, os.path.getsize(dataPath)) // segmentSize))  # Segments a sequential download had finished
+
+    def getSegmentEnd(index: int) -> int:
+        return min((index + 1) * segmentSize, expectedSize)
+
+    def getFinishedPrefix() -> int:
+        index: int = 0
+        while index in finished:
+            index += 1
+        return getSegmentEnd(index - 1) if index > 0 else 0
+
+    journal = Journal(dataPath, url, itag, expectedSize, getFinishedPrefix(), videoId, segmentSize, sorted(finished))
+    journal.save()
+
+    Sink.allocateFile(dataPath, expectedSize)  # Every segment can be written into its place
+    sinkSettings: SinkSettings = Sink.getSettings()
+    if sinkSettings.directIO and segmentSize % Sink.ALIGNMENT != 0:
+        # A segment would read back the block it shares with the previous one while that one is still being written
+        sinkSettings = SinkSettings(sinkSettings.bufferSize, sinkSettings.preallocate, sinkSettings.sync, False)
+
+    lock: threading.Lock = threading.Lock()
+    downloaded: List[int] = [sum(getSegmentEnd(index) - index * segmentSize for index in finished)]
+    failed: threading.Event = threading.Event()  # Stops the other connections when one of them fails
+
+    def fetch(index: int) -> bool:
+        try:
+            return fetchSegment(index)
+        except Exception:
+            failed.set()
+            raise
+
+    def fetchSegment(index: int) -> bool:
+        start: int = index * segmentSize
+        segmentSink: FileSink = FileSink(dataPath, start, expectedSize, sinkSettings, ownsFile=False)
+        complete: bool = False
+        try:
+            for chunk in streamRange(url, start, getSegmentEnd(index), throttle=throttle):
+                if failed.is_set() or (isCancelled is not None and isCancelled()):
+                    return False
+                segmentSink.write(chunk)
+                with lock:
+                    downloaded[0] += len(chunk)
+                    if onProgress is not None:
+                        onProgress(downloaded[0], expectedSize)
+            complete = True
+        finally:
+            segmentSink.close(complete)  # The segment is only journaled after its bytes are in the file
+
+        with lock:
+            finished.add(index)
+            journal.segments = sorted(finished)
+            journal.offset = getFinishedPrefix()
+            journal.save()
+        return True
+
+    # Connections are reused from the shared session, so the pool of configureSession should fit them
+    with ThreadPoolExecutor(max_workers=connections, thread_name_prefix="segment-download") as pool:
+        completed: bool = all(list(pool.map(fetch, [index for index in range(segmentCount) if index not in finished])))
+
+    if completed:
+        journal.remove()
+    return completed
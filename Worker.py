@@ -0,0 +1,181 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from Broker import Broker
+from Catalog import QualityPolicy
+from Download import Video
+
+
+class Worker:
+    def __init__(self, brokerPath: str = "broker.db", workerId: str = None, heartbeatInterval: float = 1.0, idleWait: float = 1.0,
+                 sharedFileSystem: bool = False):
+        """
+        Process which downloads jobs claimed from a broker, one at a time. Several workers on one host use
+        several cores, since fetching options and combining don't share a GIL between processes
+        :param brokerPath: path to the database of the broker
+        :param workerId: id of the worker, unique among all hosts. If None, made of the host name and process id
+        :param heartbeatInterval: seconds between heartbeats. Progress is reported with every heartbeat
+        :param idleWait: seconds to wait before asking for a job again when none was queued
+        :param sharedFileSystem: whether the broker database is on a network file system
+        """
+        self._broker: Broker = Broker(brokerPath, sharedFileSystem=sharedFileSystem)
+        self._workerId: str = workerId if workerId is not None else f"{socket.gethostname()}-{os.getpid()}"
+        self._heartbeatInterval: float = heartbeatInterval
+        self._idleWait: float = idleWait
+        self._stopped: threading.Event = threading.Event()
+
+        self._progressLock: threading.Lock = threading.Lock()
+        self._progress: Dict[str, Tuple[int, int]] = {}  # Stream type -> (downloaded, total) of the current job
+
+    def getWorkerId(self) -> str:
+        return self._workerId
+
+    def stop(self):
+        """
+        Stops the worker after its current job
+        """
+        self._stopped.set()
+
+    def run(self):
+        """
+        Claims and downloads jobs until stop is called
+        """
+        while not self._stopped.is_set():
+            claimed: Tuple[str, Dict] = self._broker.claim(self._workerId)
+            if claimed is None:
+                self._stopped.wait(self._idleWait)
+                continue
+            self._runJob(*claimed)
+
+    def _onProgress(self, jobId: str, streamType: str, downloaded: int, total: int):
+        with self._progressLock:
+            self._progress[streamType] = (downloaded, total)
+
+    def _runJob(self, jobId: str, data: Dict):
+        """
+        Downloads a single job and sends heartbeats while it runs
+        :param jobId: id of the job
+        :param data: description of the job, see Main._submitDownload and BatchDownloader
+        """
+        video: Video = Video(data["link"])
+        video.setJobId(jobId)
+        video.setKeepPartialFiles(True)  # A failed attempt is queued again, and a retry on this host continues its streams
+        video.setOutputFolderPath(data["outputFolder"])
+        video.setOnProgressFunc(self._onProgress)
+        video.setOnVideoCombinedFunc(lambda combinedJobId, success: None)
+        video.setStreamingMux(data.get("streamingMux", False))
+        video.setOutputMode(data.get("outputMode", Video.OUTPUT_MODES.COMBINED), data.get("audioFormat", Video.AUDIO_FORMATS.M4A))
+        with self._progressLock:
+            self._progress = {}
+
+        finished: threading.Event = threading.Event()
+        heartbeats = threading.Thread(target=self._sendHeartbeats, args=(jobId, video, finished), name="worker-heartbeat", daemon=True)
+        heartbeats.start()
+
+        error: str = None
+        result: Dict = {}
+        try:
+            success: bool = self._download(video, data, result)
+            if not success:
+                error = "Download failed"
+        except Exception as e:
+            print(f"Job {jobId} failed: {e}")
+            success, error = False, str(e)
+        finally:
+            finished.set()
+            heartbeats.join()
+
+        if not video.isCancelled():
+            self._broker.finish(self._workerId, jobId, success, error, result)
+
+    @staticmethod
+    def _download(video: Video, data: Dict, result: Dict) -> bool:
+        """
+        Fetches the options of a video and downloads it
+        :param video: the video
+        :param data: description of the job. Without itags, they are selected by the quality policy in the data
+        :param result: filled with the title and the downloaded itags
+        :return: whether the video was downloaded
+        """
+        if not video.fetchOptions():
+            return False
+        result["title"] = video.getVideoTitle()
+
+        videoItag, audioItag = data.get("videoItag", None), data.get("audioItag", None)
+        if videoItag is None and audioItag is None:
+            itags: Tuple[int, int] = QualityPolicy.fromDict(data.get("policy", {})).select(video)
+            if itags is None:
+                return False
+            videoItag, audioItag = itags
+        result["videoItag"], result["audioItag"] = videoItag, audioItag
+        return video.downloadAndCombineVideo(videoItag, audioItag, data.get("outputName", None))
+
+    def _sendHeartbeats(self, jobId: str, video: Video, finished: threading.Event):
+        """
+        Reports progress until the job has finished. Stops the download if the broker has cancelled the job or given it to another worker
+        """
+        while not finished.wait(self._heartbeatInterval):
+            with self._progressLock:
+                progress: Dict[str, List[int]] = {streamType: list(values) for streamType, values in self._progress.items()}
+            try:
+                if not self._broker.heartbeat(self._workerId, jobId, progress):
+                    video.cancel()
+                    return
+            except Exception as e:
+                print(f"Couldn't send a heartbeat: {e}")  # A busy database is retried at the next heartbeat
+
+
+def runWorker(brokerPath: str, sharedFileSystem: bool = False, initializer: Callable = None, initArgs: Tuple = ()):
+    """
+    Entry point of a worker process
+    """
+    if initializer is not None:
+        initializer(*initArgs)
+    Worker(brokerPath, sharedFileSystem=sharedFileSystem).run()
+
+
+def startWorkers(count: int, brokerPath: str = "broker.db", sharedFileSystem: bool = False, initializer: Callable = None,
+                 initArgs: Tuple = ()) -> List[multiprocessing.Process]:
+    """
+    Starts worker processes on this host. They stop when the process which started them exits.
+    The workers start from a fresh interpreter, so settings of this process, such as the muxer of Video, aren't inherited
+    :param count: how many workers are started
+    :param brokerPath: path to the database of the broker
+    :param sharedFileSystem: whether the broker database is on a network file system
+    :param initializer: module level function which every worker calls before claiming jobs, for example to apply settings
+    :param initArgs: arguments of the initializer, they have to be picklable
+    :return: the processes
+    """
+    # A forked child would inherit the locks of threads of this process, such as those of Tk and the scheduler, in whatever state they were
+    context = multiprocessing.get_context("spawn")
+    processes: List[multiprocessing.Process] = []
+    for index in range(count):
+        process = context.Process(target=runWorker, args=(brokerPath, sharedFileSystem, initializer, initArgs), name=f"download-worker-{index}", daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Downloads jobs of a broker queued by the interface or by Batch.py --broker")
+    parser.add_argument("--broker", default="broker.db", help="path to the broker database")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="how many worker processes are started")
+    parser.add_argument("--shared", action="store_true", help="the broker database is on a network file system shared with other hosts")
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    workers = startWorkers(parsedArguments.workers, parsedArguments.broker, parsedArguments.shared)
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
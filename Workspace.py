@@ -0,0 +1,152 @@
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Iterable, Set
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows, where open files can't be removed by another process anyway
+
+
+class WorkspaceAllocator:
+    PREFIX: str = "job-"
+    LOCK_NAME: str = ".lock"  # Locked by the process using the folder for as long as it uses it
+
+    def __init__(self, root: str = "tempvideos"):
+        """
+        Gives every download job a private folder for its temporary files
+        :param root: folder in which the job folders are created
+        """
+        self._root: str = root
+        self._lock: threading.Lock = threading.Lock()
+        self._active: Set[str] = set()  # Ids of jobs whose folders are in use by this process
+        self._locks: Dict[str, int] = {}  # Job id -> descriptor of the locked lock file of its folder
+
+    def getRoot(self) -> str:
+        return self._root
+
+    def getPath(self, jobId: str) -> str:
+        return os.path.join(self._root, WorkspaceAllocator.PREFIX + jobId)
+
+    def allocate(self, jobId: str) -> str:
+        """
+        Creates the folder of a job. If the folder was left behind by an earlier run of the same job,
+        for example one restored from the persistent queue, it is reused so partial files can be continued
+        :param jobId: id of the job
+        :return: path to the folder
+        """
+        path: str = self.getPath(jobId)
+        with self._lock:
+            if jobId in self._active:
+                raise FileExistsError(f"Workspace of job {jobId} is already in use")
+            self._active.add(jobId)
+
+        try:
+            lock: int = self._lockFolder(path)
+        except BaseException:
+            with self._lock:
+                self._active.discard(jobId)
+            raise
+        if lock is not None:
+            with self._lock:
+                self._locks[jobId] = lock
+        return path
+
+    def _lockFolder(self, path: str, wait: float = 1.0) -> int:
+        """
+        Creates a folder if it doesn't exist and locks it, so other processes know it's in use
+        :param path: path to the folder
+        :param wait: seconds to wait for a lock held by another process, which may be a sweeper removing the folder
+        :return: descriptor of the lock file or None if locks aren't supported
+        """
+        deadline: float = time.monotonic() + wait
+        while True:
+            os.makedirs(self._root, exist_ok=True)
+            try:
+                os.mkdir(path)  # Atomic, so two jobs can never end up with the same folder
+            except FileExistsError:
+                pass
+            if fcntl is None:
+                return None
+
+            lockPath: str = os.path.join(path, WorkspaceAllocator.LOCK_NAME)
+            try:
+                fd: int = os.open(lockPath, os.O_RDWR | os.O_CREAT, 0o666)
+            except FileNotFoundError:
+                continue  # Swept right after it was created
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                if time.monotonic() > deadline:
+                    raise FileExistsError(f"Workspace {path} is in use by another process")
+                time.sleep(0.05)
+                continue
+            try:
+                # A sweeper removes folders while holding their lock, so a lock taken after that belongs to a removed file
+                if os.fstat(fd).st_ino == os.stat(lockPath).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def release(self, jobId: str, keepFiles: bool = False):
+        """
+        Removes the folder of a job and everything in it
+        :param jobId: id of the job
+        :param keepFiles: if True, the folder is only unlocked. A later allocate of the same job continues its files,
+            otherwise sweepOrphans removes it
+        """
+        if not keepFiles:
+            shutil.rmtree(self.getPath(jobId), ignore_errors=True)
+        with self._lock:
+            self._active.discard(jobId)
+            lock: int = self._locks.pop(jobId, None)
+        if lock is not None:
+            os.close(lock)  # Only after the folder is gone, so no other process can take it over half removed
+
+    def sweepOrphans(self, keep: Iterable[str] = (), minAge: float = 600) -> int:
+        """
+        Removes folders and loose files left behind by jobs which will never finish, for example after a crash.
+        Folders locked by running processes are kept however long they have been untouched, for example during a long combination
+        :param keep: ids of jobs whose folders are kept, such as jobs which will be restored
+        :param minAge: seconds since a loose file, or a folder where locks aren't supported, was last modified before it can be removed
+        :return: how many folders and files were removed
+        """
+        if not os.path.exists(self._root):
+            return 0
+
+        keep = set(keep)
+        oldest: float = time.time() - minAge
+        removed: int = 0
+        for entry in os.scandir(self._root):
+            if entry.is_dir() and entry.name.startswith(WorkspaceAllocator.PREFIX):
+                jobId: str = entry.name[len(WorkspaceAllocator.PREFIX):]
+                with self._lock:
+                    if jobId in keep or jobId in self._active:
+                        continue
+                if fcntl is None:
+                    if entry.stat().st_mtime <= oldest:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        removed += 1
+                    continue
+
+                try:
+                    lock: int = os.open(os.path.join(entry.path, WorkspaceAllocator.LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o666)
+                except FileNotFoundError:
+                    continue  # Removed meanwhile
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(lock)
+                    continue  # In use by another process
+                shutil.rmtree(entry.path, ignore_errors=True)
+                os.close(lock)  # Removed while locked, so a process allocating it meanwhile notices and creates it again
+                removed += 1
+            elif entry.is_file() and entry.stat().st_mtime <= oldest:
+                # Temporary files of versions before job folders
+                os.remove(entry.path)
+                removed += 1
+        return removed
@@ -0,0 +1,95 @@
+import argparse
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import Transfer
+from Bandwidth import BandwidthLimiter
+from tests.support import LocalServer
+
+# Job -> (weight, cap in bytes per second or None)
+JOBS: Dict[str, Tuple[float, float]] = {"heavy": (3.0, None), "light": (1.0, None), "capped": (1.0, 512 * 1024)}
+
+
+def _expectedRates(rate: float) -> Dict[str, float]:
+    """
+    Rates the limiter should give the jobs: the rate is divided by weight, and a job capped below its share gives the rest to the others
+    """
+    expected: Dict[str, float] = {}
+    remaining: float = rate
+    totalWeight: float = sum(weight for weight, _ in JOBS.values())
+    for jobId, (weight, cap) in sorted(JOBS.items(), key=lambda item: item[1][1] / item[1][0] if item[1][1] is not None else float("inf")):
+        expected[jobId] = min(remaining * weight / totalWeight, cap if cap is not None else float("inf"))
+        remaining -= expected[jobId]
+        totalWeight -= weight
+    return expected
+
+
+def runBenchmark(rates: List[float], seconds: float) -> List[Tuple[float, Dict[str, float], Dict[str, float]]]:
+    """
+    Downloads from a local server with several jobs sharing a limiter and measures the rate every job receives.
+    The rate is changed while the jobs run, the last rate is set by a schedule covering the current hour
+    :param rates: total rates in bytes per second, measured one after another
+    :param seconds: how long every rate is measured
+    :return: list of (total rate, expected rates of the jobs, measured rates of the jobs)
+    """
+    # Big enough that no job finishes during the benchmark, even one getting the whole rate. Every job downloads the same bytes
+    size: int = int(max(rates) * (seconds + 1) * len(rates)) + 1
+    content: bytes = bytes(size)
+    server: LocalServer = LocalServer({f"/{jobId}": content for jobId in JOBS})
+    limiter: BandwidthLimiter = BandwidthLimiter(rates[0])
+    for jobId, (weight, cap) in JOBS.items():
+        limiter.setJob(jobId, weight=weight, cap=cap)
+
+    received: Dict[str, int] = {jobId: 0 for jobId in JOBS}
+    lock: threading.Lock = threading.Lock()
+    stop: threading.Event = threading.Event()
+
+    def runJob(jobId: str):
+        for chunk in Transfer.streamRange(server.getUrl(f"/{jobId}"), 0, size, throttle=lambda amount: limiter.consume(jobId, amount)):
+            with lock:
+                received[jobId] += len(chunk)
+            if stop.is_set():
+                return
+
+    results: List[Tuple[float, Dict[str, float], Dict[str, float]]] = []
+    threads: List[threading.Thread] = [threading.Thread(target=runJob, args=(jobId,), daemon=True) for jobId in JOBS]
+    try:
+        for thread in threads:
+            thread.start()
+        for index, rate in enumerate(rates):
+            if index == len(rates) - 1 and index > 0:
+                hour: int = time.localtime().tm_hour
+                limiter.setSchedule([(f"{hour:02d}:00", f"{(hour + 1) % 24:02d}:00", rate)])
+            else:
+                limiter.setRate(rate)
+            time.sleep(1.0)  # Lets the buckets settle to the new rate
+            with lock:
+                before: Dict[str, int] = dict(received)
+            time.sleep(seconds)
+            with lock:
+                measured: Dict[str, float] = {jobId: (received[jobId] - before[jobId]) / seconds for jobId in JOBS}
+            results.append((rate, _expectedRates(rate), measured))
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        server.close()
+    return results
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures the rates jobs sharing the bandwidth limiter receive from a local server")
+    parser.add_argument("--rates", type=float, nargs="+", default=[4, 8, 2],
+                        help="total rates in MB per second, changed while the jobs run. The last one is set by a schedule")
+    parser.add_argument("--seconds", type=float, default=3, help="how long every rate is measured")
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    for totalRate, expected, received in runBenchmark([rate * 1048576 for rate in parsedArguments.rates], parsedArguments.seconds):
+        print(f"limit {totalRate / 1048576:5.2f} MB/s  received {sum(received.values()) / 1048576:5.2f} MB/s  " + "  ".join(
+            f"{jobId} {received[jobId] / 1048576:5.2f} (expected {expected[jobId] / 1048576:5.2f})" for jobId in JOBS))
+    sys.exit(0)
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import Sink
+import Transfer
+from AsyncEngine import AsyncEngine
+from tests.support import LocalServer
+
+
+def _serve(size: int, rate: float, urls: multiprocessing.Queue, stop: multiprocessing.Event):
+    # Runs in a process of its own, so the threads of the server aren't counted with the threads of the downloads
+    server: LocalServer = LocalServer({"/stream": os.urandom(size)}, rate=rate)
+    urls.put(server.getUrl("/stream"))
+    stop.wait()
+    server.close()
+
+
+def _runJobs(mode: str, jobs: int, url: str, size: int, sinkBuffer: int, results: multiprocessing.Queue):
+    """
+    Downloads the two streams of every job, with a thread per job and stream like downloadStreams, or as coroutines of the engine
+    """
+    Sink.configure(Sink.SinkSettings(bufferSize=sinkBuffer))
+    folder: str = tempfile.mkdtemp(prefix="concurrency-benchmark-")
+    stop: threading.Event = threading.Event()
+    peakThreads: List[int] = [0]
+
+    def sample():
+        while not stop.is_set():
+            peakThreads[0] = max(peakThreads[0], threading.active_count())
+            time.sleep(0.01)
+
+    threading.Thread(target=sample, daemon=True).start()
+    start: float = time.perf_counter()
+    try:
+        if mode == "threads":
+            Transfer.configureSession(poolSize=2 * jobs)
+            with ThreadPoolExecutor(2 * jobs) as streams, ThreadPoolExecutor(jobs) as scheduler:
+                def runJob(index: int) -> bool:
+                    downloads = [streams.submit(Transfer.downloadToFile, url, os.path.join(folder, f"{index}-{stream}"), size) for stream in range(2)]
+                    return all(download.result() for download in downloads)
+                succeeded: int = sum(scheduler.map(runJob, range(jobs)))
+        else:
+            engine: AsyncEngine = AsyncEngine(maxConnectionsPerHost=2 * jobs).start()
+
+            async def runJob(index: int) -> bool:
+                return all(await asyncio.gather(*[engine.downloadToFile(url, os.path.join(folder, f"{index}-{stream}"), size) for stream in range(2)]))
+            succeeded = sum(future.result() for future in [engine.submit(runJob(index)) for index in range(jobs)])
+            engine.stop()
+    finally:
+        stop.set()
+        shutil.rmtree(folder, ignore_errors=True)
+    results.put((mode, succeeded, time.perf_counter() - start, peakThreads[0], resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def runBenchmark(jobCounts: List[int], size: int, rate: float, sinkBuffer: int) -> List[Tuple[str, int, int, float, int, float]]:
+    """
+    Runs many jobs at once with threads and with the async engine, every case in a process of its own
+    :param jobCounts: amounts of jobs to measure
+    :param size: bytes of a stream
+    :param rate: bytes per second the server sends over a single connection, so every job stays running for a while
+    :param sinkBuffer: bytes every stream collects before writing them. Most of the memory of both modes is these buffers
+    :return: list of (mode, jobs, succeeded jobs, seconds, most threads at once, peak memory in MB)
+    """
+    context = multiprocessing.get_context("spawn")
+    urls: multiprocessing.Queue = context.Queue()
+    stopServer = context.Event()
+    server = context.Process(target=_serve, args=(size, rate, urls, stopServer), daemon=True)
+    server.start()
+    url: str = urls.get(timeout=30)
+
+    measured: List[Tuple[str, int, int, float, int, float]] = []
+    results: multiprocessing.Queue = context.Queue()
+    try:
+        for jobs in jobCounts:
+            for mode in ("threads", "async"):
+                client = context.Process(target=_runJobs, args=(mode, jobs, url, size, sinkBuffer, results))
+                client.start()
+                mode, succeeded, seconds, threads, memory = results.get()
+                client.join()
+                measured.append((mode, jobs, succeeded, seconds, threads, memory))
+    finally:
+        stopServer.set()
+        server.join()
+    return measured
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compares the threads and memory of many concurrent jobs with threads and with the async engine")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[50, 300])
+    parser.add_argument("--size", type=float, default=1, help="MB of each of the two streams of a job")
+    parser.add_argument("--rate", type=float, default=0.5, help="MB per second the server sends over a single connection")
+    parser.add_argument("--sink-buffer", type=int, default=1024, help="KB every stream collects before writing them")
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    for modeName, jobCount, succeededJobs, elapsed, mostThreads, peakMemory in runBenchmark(
+            parsedArguments.jobs, int(parsedArguments.size * 1048576), parsedArguments.rate * 1048576, parsedArguments.sink_buffer * 1024):
+        print(f"{modeName:7} {jobCount:4} jobs {succeededJobs:4} ok {elapsed:6.2f} s  {mostThreads:4} threads  {peakMemory:7.1f} MB peak memory")
+    sys.exit(0)
@@ -0,0 +1,63 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+from NameIndex import NameIndex
+
+
+def _reserveByListing(folder: str, name: str, extension: str) -> str:
+    """
+    Reserves a name the way downloads did before the index: the whole folder is listed on every download
+    """
+    withoutExtensions: List[str] = [os.path.splitext(file)[0] for file in os.listdir(folder)]
+    if name in withoutExtensions:
+        name = name + " (" + str(sum(name in s for s in withoutExtensions)) + ")"
+    with open(os.path.join(folder, name + extension), "w+") as file:
+        file.write("TEMP DOWNLOAD FILE")
+    return name
+
+
+def runBenchmark(fileCount: int, downloads: int) -> List[Tuple[str, float, int]]:
+    """
+    Reserves the names of downloads in a folder which holds many files already, by listing the folder and through the name index
+    :param fileCount: how many files are in the folder before the downloads
+    :param downloads: how many names are reserved
+    :return: list of (method, seconds, distinct names reserved)
+    """
+    results: List[Tuple[str, float, int]] = []
+    for method in ("listing", "index"):
+        folder: str = tempfile.mkdtemp(prefix="names-benchmark-")
+        try:
+            for number in range(fileCount):
+                open(os.path.join(folder, f"video {number}.mp4"), "wb").close()
+            index: NameIndex = NameIndex(folder)
+            names: List[str] = []
+            start: float = time.perf_counter()
+            for download in range(downloads):
+                # Half of the downloads want a name which is taken already
+                name: str = f"video {download}" if download % 2 == 0 else f"new video {download}"
+                names.append(_reserveByListing(folder, name, ".mp4") if method == "listing" else index.reserve(name, ".mp4"))
+            # The index lists the folder once, in its first reservation, so that is measured too
+            results.append((method, time.perf_counter() - start, len(set(names))))
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures how long reserving output names takes in a folder with many files")
+    parser.add_argument("--files", type=int, default=100000, help="files in the output folder before the downloads")
+    parser.add_argument("--downloads", type=int, default=200, help="names reserved")
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    for methodName, seconds, distinct in runBenchmark(parsedArguments.files, parsedArguments.downloads):
+        print(f"{methodName:8} {seconds:8.3f} s {seconds / parsedArguments.downloads * 1000:9.3f} ms per download  "
+              f"{distinct}/{parsedArguments.downloads} distinct names")
+    sys.exit(0)
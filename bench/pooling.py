@@ -0,0 +1,87 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+import requests
+
+import Transfer
+from tests.support import LocalServer
+
+
+def _makeCertificate(folder: str) -> Tuple[str, str]:
+    """
+    Makes a self-signed certificate for 127.0.0.1 with openssl, so the cost of TLS handshakes can be measured
+    :return: paths to the certificate and its key, or None if openssl couldn't make them
+    """
+    certificate, key = os.path.join(folder, "certificate.pem"), os.path.join(folder, "key.pem")
+    try:
+        result = subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                                 "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key, "-out", certificate],
+                                stdin=subprocess.DEVNULL, capture_output=True)
+    except OSError:
+        return None
+    return (certificate, key) if result.returncode == 0 else None
+
+
+def runBenchmark(jobs: int, size: int, certificate: Tuple[str, str] = None) -> List[Tuple[str, float, int]]:
+    """
+    Runs many small transfers like the metadata requests and short streams of many jobs, first with a new session
+    and connection for every job like before the shared session, then through the shared session
+    :param jobs: how many transfers
+    :param size: bytes of every transfer
+    :param certificate: certificate and key to serve https with, None for http
+    :return: list of (case, seconds, connections the server accepted)
+    """
+    server: LocalServer = LocalServer({f"/{index}": os.urandom(size) for index in range(jobs)},
+                                      certificate=certificate[0] if certificate else None, key=certificate[1] if certificate else None)
+    verify = certificate[0] if certificate else True  # The self-signed certificate is its own authority
+    results: List[Tuple[str, float, int]] = []
+    try:
+        start: float = time.perf_counter()
+        for index in range(jobs):
+            with requests.Session() as session:
+                session.verify, session.trust_env = verify, False  # REQUESTS_CA_BUNDLE would replace verify
+                b"".join(Transfer.streamRange(server.getUrl(f"/{index}"), 0, size, session=session))
+        results.append(("new session per job", time.perf_counter() - start, server.connections))
+
+        Transfer.configureSession()
+        Transfer.getSession().verify, Transfer.getSession().trust_env = verify, False
+        connectionsBefore: int = server.connections
+        start = time.perf_counter()
+        for index in range(jobs):
+            b"".join(Transfer.streamRange(server.getUrl(f"/{index}"), 0, size))
+        results.append(("shared session", time.perf_counter() - start, server.connections - connectionsBefore))
+    finally:
+        Transfer.configureSession()
+        server.close()
+    return results
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures what reusing connections saves for many small transfers, over http and https")
+    parser.add_argument("--jobs", type=int, default=300)
+    parser.add_argument("--size", type=int, default=4096, help="bytes of a transfer")
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    certificateFolder: str = tempfile.mkdtemp(prefix="pooling-benchmark-")
+    try:
+        schemes: List[Tuple[str, Tuple[str, str]]] = [("http", None)]
+        madeCertificate: Tuple[str, str] = _makeCertificate(certificateFolder)
+        if madeCertificate is not None:
+            schemes.append(("https", madeCertificate))
+        else:
+            print("openssl couldn't make a certificate, https isn't measured")
+        for scheme, schemeCertificate in schemes:
+            for caseName, seconds, connections in runBenchmark(parsedArguments.jobs, parsedArguments.size, schemeCertificate):
+                print(f"{scheme:5} {caseName:20} {seconds:6.2f} s {seconds / parsedArguments.jobs * 1000:6.2f} ms per job  {connections:4} connections")
+    finally:
+        shutil.rmtree(certificateFolder, ignore_errors=True)
+    sys.exit(0)
@@ -0,0 +1,55 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+import Transfer
+from tests.support import LocalServer
+
+
+def runBenchmark(size: int, rate: float, segmentSize: int, connectionCounts: List[int]) -> List[Tuple[int, float, bool]]:
+    """
+    Downloads a file from a local server which throttles every connection, with different amounts of connections
+    :param size: size of the file in bytes
+    :param rate: bytes per second the server sends over a single connection
+    :param segmentSize: size of a segment in bytes
+    :param connectionCounts: amounts of connections to measure
+    :return: list of (connections, seconds, whether the file matched)
+    """
+    content: bytes = os.urandom(size)
+    server: LocalServer = LocalServer({"/stream": content}, rate=rate)
+    folder: str = tempfile.mkdtemp(prefix="segmented-benchmark-")
+    results: List[Tuple[int, float, bool]] = []
+    try:
+        Transfer.configureSession(poolSize=max(connectionCounts))
+        for connections in connectionCounts:
+            path: str = os.path.join(folder, f"stream-{connections}")
+            start: float = time.perf_counter()
+            Transfer.downloadToFile(server.getUrl("/stream"), path, size, connections=connections, segmentSize=segmentSize)
+            elapsed: float = time.perf_counter() - start
+            with open(path, "rb") as file:
+                results.append((connections, elapsed, file.read() == content))
+    finally:
+        server.close()
+        shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures how segmented downloads scale with the amount of connections when the server throttles each one")
+    parser.add_argument("--size", type=int, default=32, help="size of the downloaded file in MB")
+    parser.add_argument("--rate", type=float, default=8, help="MB per second the server sends over a single connection")
+    parser.add_argument("--segment-size", type=int, default=2, help="size of a segment in MB")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4, 8])
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    for connectionCount, seconds, matched in runBenchmark(parsedArguments.size * 1048576, parsedArguments.rate * 1048576,
+                                                          parsedArguments.segment_size * 1048576, parsedArguments.connections):
+        print(f"{connectionCount:2} connections {seconds:6.2f} s {parsedArguments.size / seconds:7.1f} MB/s  {'ok' if matched else 'CORRUPT'}")
+    sys.exit(0)
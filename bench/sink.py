@@ -0,0 +1,82 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+from Sink import FileSink, SinkSettings
+
+
+def _benchmarkOnce(folder: str, size: int, chunkSize: int, settings: SinkSettings) -> Tuple[float, int]:
+    """
+    Writes a file like a download does
+    :return: seconds it took and how many extents the file ended up in, -1 if they couldn't be counted
+    """
+    path: str = os.path.join(folder, "benchmark.bin")
+    chunk: bytes = os.urandom(chunkSize)
+    start: float = time.perf_counter()
+    if settings is None:
+        # How downloads wrote before sinks
+        with open(path, "wb") as file:
+            for _ in range(size // chunkSize):
+                file.write(chunk)
+    else:
+        sink: FileSink = FileSink(path, 0, size, settings)
+        for _ in range(size // chunkSize):
+            sink.write(chunk)
+        sink.close()
+    elapsed: float = time.perf_counter() - start
+
+    extents: int = -1
+    try:
+        output: str = subprocess.run(["filefrag", path], capture_output=True, text=True, timeout=10).stdout
+        extents = int(output.rsplit(":", 1)[1].split()[0])
+    except (OSError, ValueError, IndexError, subprocess.SubprocessError):
+        pass
+    os.remove(path)
+    return elapsed, extents
+
+
+def runBenchmark(folder: str, size: int, chunkSize: int, rounds: int) -> List[Tuple[str, float, int]]:
+    """
+    Compares writing a file with plain writes and with sinks of different settings
+    :param folder: where the file is written, for example a folder on network storage
+    :param size: size of the file in bytes
+    :param chunkSize: size of a single write, the chunk size of downloads
+    :param rounds: how many times each case is measured. The fastest round counts
+    :return: list of (case, seconds, extents)
+    """
+    cases: List[Tuple[str, SinkSettings]] = [
+        ("plain writes", None),
+        ("64K buffer", SinkSettings(65536, preallocate=False)),
+        ("1M buffer", SinkSettings(1048576, preallocate=False)),
+        ("1M buffer, preallocated", SinkSettings(1048576)),
+        ("4M buffer, preallocated", SinkSettings(4194304)),
+        ("1M buffer, preallocated, sync on close", SinkSettings(1048576, sync=SinkSettings.SYNC.CLOSE)),
+        ("1M buffer, preallocated, direct I/O", SinkSettings(1048576, directIO=True)),
+        ("1M buffer, preallocated, direct I/O, sync on close", SinkSettings(1048576, sync=SinkSettings.SYNC.CLOSE, directIO=True))
+    ]
+    results: List[Tuple[str, float, int]] = []
+    for name, settings in cases:
+        measured: List[Tuple[float, int]] = [_benchmarkOnce(folder, size, chunkSize, settings) for _ in range(rounds)]
+        results.append((name, min(seconds for seconds, _ in measured), max(extents for _, extents in measured)))
+    return results
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures how fast downloads can write files with different sink settings")
+    parser.add_argument("--folder", default=tempfile.gettempdir(), help="folder to write into, for example the output folder")
+    parser.add_argument("--size", type=int, default=256, help="size of the written file in MB")
+    parser.add_argument("--chunk-size", type=int, default=65536, help="size of a single write in bytes")
+    parser.add_argument("--rounds", type=int, default=3)
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    for case, seconds, extentCount in runBenchmark(parsedArguments.folder, parsedArguments.size * 1048576, parsedArguments.chunk_size,
+                                                   parsedArguments.rounds):
+        print(f"{case:55} {parsedArguments.size / seconds:8.0f} MB/s  {extentCount if extentCount >= 0 else '?':>5} extents")
+    sys.exit(0)
@@ -0,0 +1,81 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import List, Tuple
+
+REPOSITORY: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_FFMPEG: str = os.path.join(REPOSITORY, "tests", "stubs", "ffmpeg")
+
+# Each case runs in a new interpreter and prints how long it took until it was ready to download, and whether tkinter got loaded
+CASES: List[Tuple[str, str]] = [
+    ("headless, ready to download", f"""
+import main
+open("empty.txt", "w").close()
+exitCode = main.runHeadless(["empty.txt", "-o", "downloads", "--ffmpeg", {STUB_FFMPEG!r}, "--no-store"])
+assert exitCode == 0, exitCode
+"""),
+    ("interface, modules imported", """
+import main
+import Interface
+"""),
+    ("interface, first frame drawn", """
+import main
+window = main.Main()
+window._interface._tk.update()
+""")
+]
+
+
+def _measureOnce(code: str) -> Tuple[float, bool]:
+    """
+    Runs a case in a new interpreter in an empty folder
+    :return: seconds until the case was done and whether tkinter was loaded, None if the case couldn't run, for example without a display
+    """
+    folder: str = tempfile.mkdtemp(prefix="startup-benchmark-")
+    script: str = ("import sys, time\nstart = time.perf_counter()\n" + code +
+                   "\nprint(time.perf_counter() - start, 'tkinter' in sys.modules)\nsys.stdout.flush()\nimport os\nos._exit(0)\n")
+    try:
+        result = subprocess.run([sys.executable, "-c", script], cwd=folder, capture_output=True, text=True, timeout=120,
+                                env=dict(os.environ, PYTHONPATH=REPOSITORY))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    if result.returncode != 0:
+        return None
+    seconds, tkinterLoaded = result.stdout.strip().splitlines()[-1].split()
+    return float(seconds), tkinterLoaded == "True"
+
+
+def runBenchmark(rounds: int) -> List[Tuple[str, float, bool]]:
+    """
+    Compares how long the headless mode and the interface take to start
+    :param rounds: how many times each case is started. The median counts
+    :return: list of (case, seconds or None if it couldn't run, whether tkinter was loaded)
+    """
+    results: List[Tuple[str, float, bool]] = []
+    for name, code in CASES:
+        measured: List[Tuple[float, bool]] = [_measureOnce(code) for _ in range(rounds)]
+        if any(result is None for result in measured):
+            results.append((name, None, False))
+        else:
+            results.append((name, statistics.median(seconds for seconds, _ in measured), measured[0][1]))
+    return results
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures how long headless mode and the interface take to start")
+    parser.add_argument("--rounds", type=int, default=5)
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    for case, seconds, loadedTkinter in runBenchmark(parsedArguments.rounds):
+        if seconds is None:
+            print(f"{case:32} couldn't run, the interface needs a display")
+        else:
+            print(f"{case:32} {seconds * 1000:7.0f} ms  tkinter {'loaded' if loadedTkinter else 'not loaded'}")
+    sys.exit(0)
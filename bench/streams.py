@@ -0,0 +1,83 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+import Transfer
+from Cache import MetadataCache
+from Download import Video
+from tests.support import VIDEO_LINK, LocalServer, addFakeVideo
+
+
+def runBenchmark(videoSize: int, audioSize: int, rate: float, rounds: int) -> List[Tuple[str, float, bool]]:
+    """
+    Downloads the video and audio stream of a video from a local server, one stream after the other and both at the same time
+    :param videoSize: bytes of the video stream
+    :param audioSize: bytes of the audio stream
+    :param rate: bytes per second the server sends over a single connection
+    :param rounds: downloads of every case, the fastest one is reported
+    :return: list of (case, seconds, whether the files matched)
+    """
+    videoBytes, audioBytes = os.urandom(videoSize), os.urandom(audioSize)
+    server: LocalServer = LocalServer({}, rate=rate)
+    cache: MetadataCache = MetadataCache()
+    addFakeVideo(cache, server, videoBytes=videoBytes, audioBytes=audioBytes)
+
+    previousFolder: str = os.getcwd()
+    folder: str = tempfile.mkdtemp(prefix="streams-benchmark-")
+    os.chdir(folder)  # Temporary folders of downloads are relative to the working folder
+    previousCache, previousStore, previousWorkers = Video.getMetadataCache(), Video.getArtifactStore(), Video._downloadWorkers
+    Video.setMetadataCache(cache)
+    Video.setArtifactStore(None)
+    Transfer.configureSession()
+
+    results: List[Tuple[str, float, bool]] = []
+    try:
+        # A single worker downloads the streams one after the other, like before both were downloaded at once
+        for name, workers in (("sequential", 1), ("concurrent", 2)):
+            Video.setDownloadWorkers(workers)
+            best: float = float("inf")
+            matched: bool = True
+            for _ in range(rounds):
+                video: Video = Video(VIDEO_LINK)
+                video.setOutputFolderPath(os.path.join(folder, "downloads"))
+                video.fetchOptions()
+                start: float = time.perf_counter()
+                video.downloadStreams(137, 140, "clip")
+                best = min(best, time.perf_counter() - start)
+
+                videoName, audioName, _ = video._pendingFiles
+                with open(os.path.join(video._tempVideoFolder, videoName), "rb") as videoFile, \
+                        open(os.path.join(video._tempVideoFolder, audioName), "rb") as audioFile:
+                    matched = matched and videoFile.read() == videoBytes and audioFile.read() == audioBytes
+                video.discard()
+            results.append((name, best, matched))
+    finally:
+        Video.setMetadataCache(previousCache)
+        Video.setArtifactStore(previousStore)
+        Video.setDownloadWorkers(previousWorkers)
+        server.close()
+        os.chdir(previousFolder)
+        shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures downloading the streams of a video one after the other and at the same time")
+    parser.add_argument("--video-size", type=float, default=16, help="MB of the video stream")
+    parser.add_argument("--audio-size", type=float, default=4, help="MB of the audio stream")
+    parser.add_argument("--rate", type=float, default=8, help="MB per second the server sends over a single connection")
+    parser.add_argument("--rounds", type=int, default=3)
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    for caseName, seconds, matched in runBenchmark(int(parsedArguments.video_size * 1048576), int(parsedArguments.audio_size * 1048576),
+                                                   parsedArguments.rate * 1048576, parsedArguments.rounds):
+        print(f"{caseName:10} {seconds:6.2f} s {(parsedArguments.video_size + parsedArguments.audio_size) / seconds:6.1f} MB/s  "
+              f"{'ok' if matched else 'CORRUPT'}")
+    sys.exit(0)
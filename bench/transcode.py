@@ -0,0 +1,101 @@
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import List, Tuple
+
+from Muxer import Muxer
+from Transcode import TranscodePlan, TranscodeSettings, Transcoder
+
+
+def _makeFootage(ffmpegPath: str, folder: str, seconds: float) -> Tuple[str, str]:
+    """
+    Generates a test video and a tone, shaped like the separate video and audio streams YouTube serves
+    :return: paths to the video and the audio file, or None if ffmpeg couldn't make them
+    """
+    videoPath: str = os.path.join(folder, "video.mp4")
+    audioPath: str = os.path.join(folder, "audio.m4a")
+    commands: List[List[str]] = [
+        [ffmpegPath, "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=30", "-t", str(seconds),
+         "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", videoPath],
+        [ffmpegPath, "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000", "-t", str(seconds),
+         "-c:a", "aac", audioPath]
+    ]
+    for command in commands:
+        try:
+            if subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True).returncode != 0:
+                return None
+        except OSError:
+            return None
+    if os.path.getsize(videoPath) == 0 or os.path.getsize(audioPath) == 0:
+        return None  # An ffmpeg without the lavfi device
+    return videoPath, audioPath
+
+
+def runBenchmark(muxer: Muxer, seconds: float, settings: TranscodeSettings) -> List[Tuple[str, float, float]]:
+    """
+    Combines the same footage by copying the streams and by transcoding them, like streams whose codecs can't be copied into mp4
+    :param muxer: runs ffmpeg
+    :param seconds: length of the footage
+    :param settings: how the transcoded streams are encoded
+    :return: list of (case, wall seconds per minute of footage, cpu seconds per minute of footage), empty if the footage couldn't be made
+    """
+    folder: str = tempfile.mkdtemp(prefix="transcode-benchmark-")
+    results: List[Tuple[str, float, float]] = []
+    try:
+        footage: Tuple[str, str] = _makeFootage(muxer.getFFmpegPath(), folder, seconds)
+        if footage is None:
+            return results
+
+        # The plans only look at the codecs of the streams, so the same files are transcoded when the codecs are of webm streams
+        cases: List[Tuple[str, TranscodePlan]] = [
+            ("copy", Transcoder.plan(SimpleNamespace(video_codec="avc1.640028"), SimpleNamespace(audio_codec="mp4a.40.2"), settings)),
+            ("audio", Transcoder.plan(SimpleNamespace(video_codec="avc1.640028"), SimpleNamespace(audio_codec="opus"), settings)),
+            ("transcode", Transcoder.plan(SimpleNamespace(video_codec="vp9"), SimpleNamespace(audio_codec="opus"), settings,
+                                          muxer.getCapabilities().encoders))
+        ]
+        for name, plan in cases:
+            outputPath: str = os.path.join(folder, f"{name}.mp4")
+            cpuBefore = resource.getrusage(resource.RUSAGE_CHILDREN)
+            start: float = time.perf_counter()
+            if not muxer.run(list(footage), outputPath, plan.getOutputOptions()):
+                print(f"Combining with the {name} plan failed")
+                continue
+            elapsed: float = time.perf_counter() - start
+            cpuAfter = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu: float = cpuAfter.ru_utime + cpuAfter.ru_stime - cpuBefore.ru_utime - cpuBefore.ru_stime
+            results.append((name, elapsed * 60 / seconds, cpu * 60 / seconds))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures what copying and transcoding cost per minute of footage")
+    parser.add_argument("--ffmpeg", default=None, help="path to ffmpeg, searched like the downloads do if not given")
+    parser.add_argument("--seconds", type=float, default=20, help="length of the generated footage")
+    parser.add_argument("--threads", type=int, default=None, help="cores of a transcode, half of the machine if not given")
+    parser.add_argument("--preset", default=TranscodeSettings.PRESETS.VERYFAST)
+    parser.add_argument("--hardware-encoder", default=None, help="for example h264_nvenc, used if ffmpeg has it")
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    benchmarkMuxer: Muxer = Muxer(parsedArguments.ffmpeg)
+    if not benchmarkMuxer.isAvailable() or benchmarkMuxer.getCapabilities().version is None:
+        print("ffmpeg is unavailable, the benchmark needs a real ffmpeg")
+        sys.exit(1)
+    measured = runBenchmark(benchmarkMuxer, parsedArguments.seconds,
+                            TranscodeSettings(parsedArguments.threads, parsedArguments.preset, hardwareEncoder=parsedArguments.hardware_encoder))
+    if not measured:
+        print("ffmpeg couldn't generate the footage, it needs the lavfi device, libx264 and aac")
+        sys.exit(1)
+    for caseName, wallSeconds, cpuSeconds in measured:
+        print(f"{caseName:10} {wallSeconds:7.2f} s wall {cpuSeconds:7.2f} s cpu per minute of footage")
+    sys.exit(0)
@@ -0,0 +1,92 @@
+import argparse
+import heapq
+import itertools
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from Interface import UIDispatcher
+
+
+class _MainLoop:
+    def __init__(self):
+        """
+        Runs functions scheduled with after on the calling thread like the Tk main loop, so the benchmark needs no display
+        """
+        self._timers: List[Tuple[float, int, Callable]] = []
+        self._order = itertools.count()
+
+    def after(self, milliseconds: int, func: Callable):
+        heapq.heappush(self._timers, (time.perf_counter() + milliseconds / 1000, next(self._order), func))
+
+    def runOnce(self):
+        when, _, func = heapq.heappop(self._timers)
+        time.sleep(max(0.0, when - time.perf_counter()))
+        func()
+
+
+def runBenchmark(jobs: int, seconds: float, postInterval: float, widgetCost: float, coalesce: bool) -> Dict[str, float]:
+    """
+    Simulates jobs which post progress to the interface from their own threads while the main loop drains the updates
+    :param jobs: how many jobs post at the same time
+    :param seconds: how long the jobs post for
+    :param postInterval: seconds between two progress updates of a job
+    :param widgetCost: seconds a single widget update takes on the main loop
+    :param coalesce: whether updates of the same row replace each other. If not, every update is run
+    :return: statistics of the dispatcher with the amount of widget updates. Updates still pending at the end are in "pending"
+    """
+    mainLoop: _MainLoop = _MainLoop()
+    dispatcher: UIDispatcher = UIDispatcher(mainLoop.after)
+    dispatcher.start()
+    widgetCalls: List[int] = [0]
+
+    def updateRow(row: int, text: str):
+        widgetCalls[0] += 1
+        start: float = time.perf_counter()
+        while time.perf_counter() - start < widgetCost:
+            pass  # Busy like a Treeview redraw, which holds the main loop
+
+    stop: threading.Event = threading.Event()
+
+    def runJob(row: int):
+        while not stop.is_set():
+            dispatcher.post(("progress", row) if coalesce else None, updateRow, row, "50%")
+            time.sleep(postInterval)
+        dispatcher.post(("progress", row) if coalesce else None, updateRow, row, "Yes")
+
+    threads: List[threading.Thread] = [threading.Thread(target=runJob, args=(row,), daemon=True) for row in range(jobs)]
+    for thread in threads:
+        thread.start()
+    end: float = time.perf_counter() + seconds
+    # The last updates get as long to be drained as the jobs ran, what is left by then is counted as pending
+    while (not stop.is_set() or dispatcher.getPendingCount()) and time.perf_counter() < end + seconds:
+        mainLoop.runOnce()
+        if time.perf_counter() >= end and not stop.is_set():
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    stats: Dict[str, float] = dispatcher.getStats()
+    stats["widgetCalls"] = widgetCalls[0]
+    return stats
+
+
+def parseArguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures how late interface updates are while many jobs report progress")
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--post-interval", type=float, default=2, help="milliseconds between two progress updates of a job")
+    parser.add_argument("--widget-cost", type=float, default=0.2, help="milliseconds a widget update takes")
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    parsedArguments = parseArguments()
+    for coalesced in (False, True):
+        result: Dict[str, float] = runBenchmark(parsedArguments.jobs, parsedArguments.seconds, parsedArguments.post_interval / 1000,
+                                                parsedArguments.widget_cost / 1000, coalesced)
+        print(f"{'coalesced' if coalesced else 'every update':12} posted {result['posted']:7} widget updates {result['widgetCalls']:7} pending {result['pending']:7}  "
+              f"latency avg {result['averageLatency'] * 1000:8.1f} ms max {result['longestLatency'] * 1000:8.1f} ms  "
+              f"frame lag avg {result['averageLag'] * 1000:5.1f} ms max {result['longestLag'] * 1000:5.1f} ms")
+    sys.exit(0)
@@ -1,29 +1,80 @@
+from Broker import Broker
+from Catalog import QualityPolicy, StreamCatalog
 from Download import Video
-from Interface import Interface
-from typing import List
-import pytube
-from threading import Thread
+from Metrics import metrics
+from Scheduler import Scheduler, Job
+from Transcode import Transcoder
+from Worker import startWorkers
+from typing import Dict, List, Set, Tuple
+import sys
+import threading
+import time
 
 
 class Main:
-    def __init__(self):
+    # Outputs the interface offers, by the names shown to the user
+    OUTPUTS: Dict[str, Tuple[str, str]] = {
+        "Video and audio": (Video.OUTPUT_MODES.COMBINED, Video.AUDIO_FORMATS.M4A),
+        "Progressive video": (Video.OUTPUT_MODES.PROGRESSIVE, Video.AUDIO_FORMATS.M4A),
+        "Audio (m4a)": (Video.OUTPUT_MODES.AUDIO, Video.AUDIO_FORMATS.M4A),
+        "Audio (opus)": (Video.OUTPUT_MODES.AUDIO, Video.AUDIO_FORMATS.OPUS),
+        "Audio (mp3)": (Video.OUTPUT_MODES.AUDIO, Video.AUDIO_FORMATS.MP3)
+    }
+
+    def __init__(self, workers: int = 0, brokerPath: str = "broker.db", qualityPolicy: QualityPolicy = None):
+        """
+        :param workers: if more than 0, downloads are queued into a broker and this many worker processes download them.
+            Otherwise they are downloaded by threads of this process
+        :param brokerPath: path to the database of the broker
+        :param qualityPolicy: selects the options shown first when a video is loaded. If None, the best ones
+        """
+        from Interface import Interface  # Imported here so headless mode never loads tkinter or the theme
         self._interface: Interface = Interface()
 
+        # Runs metadata fetches, downloads and combining with limited concurrency
+        self._scheduler: Scheduler = Scheduler(persistPath="queue.json")
+        metrics.addCollector(self._scheduler.collectMetrics)
+        metrics.addCollector(self._interface.getDispatcher().collectMetrics)
+
+        # Downloads can be handed to worker processes, which also run on other hosts sharing the broker
+        self._broker: Broker = None
+        if workers > 0:
+            self._broker = Broker(brokerPath)
+            metrics.addCollector(self._broker.collectMetrics)
+            startWorkers(workers, brokerPath)
+
         # Download related
         self._downloadedLatest: bool = False  # Used to determine if link was changed so it downloads two separate files
 
+        # Progress of downloads. Worker threads only store the latest bytes, the interface reads them a few times a second
+        self._progressInterval: int = 250  # Milliseconds between interface updates
+        self._progressLock: threading.Lock = threading.Lock()
+        self._streamProgress: Dict[str, Dict[str, Tuple[int, int]]] = {}  # Job id -> stream type -> (downloaded, total)
+        self._changedProgress: Set[str] = set()  # Job ids whose progress changed since the last update
+        self._speeds: Dict[str, Tuple[int, float, float]] = {}  # Job id -> (downloaded, time, bytes per second) at last update
+
         # Download options
         self._videos: List[Video] = []
         self._videoItag: str = ""
         self._audioItag: str = ""
+        self._qualityPolicy: QualityPolicy = qualityPolicy if qualityPolicy is not None else QualityPolicy()
+        self._outputMode: str = Video.OUTPUT_MODES.COMBINED
+        self._audioFormat: str = Video.AUDIO_FORMATS.M4A
 
         # Interface setup
         self._interface.setLoadVideoInfoFunc(self._loadURL)
         self._interface.setDownloadFunc(self._download)
         self._interface.setOnVideoChange(self._onVideoResolutionChange)
         self._interface.setOnAudioChange(self._onAudioQualityChange)
+        self._interface.setOnOutputChange(self._onOutputChange)
+        self._interface.setOutputOptions(list(Main.OUTPUTS))
         self._interface.setOnFolderChangeFunc(self._onFolderChange)
 
+        self._restoreQueue()
+        self._interface.after(self._progressInterval, self._updateProgress)
+        if self._broker is not None:
+            threading.Thread(target=self._watchBroker, args=(self._broker.getVersion(),), name="broker-watcher", daemon=True).start()
+
     def _getLatestVideo(self):
         """
         When user starts downloading video, the previous videos in this list should NEVER be modified afterwards, but they have to be saved
@@ -32,8 +83,69 @@ class Main:
         """
         return self._videos[len(self._videos) - 1]
 
-    def _onVideoCombined(self, index):
-        self._interface.modifyDownloadText(index, "Yes")
+    def _onVideoCombined(self, jobId: str, success: bool):
+        # Called from a scheduler thread, the rest is done on the main loop
+        self._interface.post(("combined", jobId), self._finishDownload, jobId, success)
+
+    def _onJobFinished(self, job: Job):
+        # Failures before the mux stage, such as an exception or a stream which doesn't exist, don't reach the combined callback
+        if job.getState() != Job.STATES.DONE:
+            self._onVideoCombined(job.getJobId(), False)
+
+    def _finishDownload(self, jobId: str, success: bool):
+        with self._progressLock:
+            self._streamProgress.pop(jobId, None)
+            self._changedProgress.discard(jobId)
+        self._speeds.pop(jobId, None)
+        self._interface.finishDownload(jobId, "Yes" if success else "Failed")
+
+    def _onProgress(self, jobId: str, streamType: str, downloaded: int, total: int):
+        """
+        Called from download threads for every downloaded chunk, so it only stores the numbers
+        """
+        with self._progressLock:
+            self._streamProgress.setdefault(jobId, {})[streamType] = (downloaded, total)
+            self._changedProgress.add(jobId)
+
+    def _updateProgress(self):
+        """
+        Shows the latest progress of changed downloads on the interface. Runs on the main loop
+        """
+        now: float = time.monotonic()
+        with self._progressLock:
+            changed: Dict[str, List[Tuple[int, int]]] = {jobId: list(self._streamProgress[jobId].values()) for jobId in self._changedProgress}
+            self._changedProgress.clear()
+
+        for jobId, streams in changed.items():
+            downloaded: int = sum(stream[0] for stream in streams)
+            total: int = sum(stream[1] for stream in streams)
+
+            lastDownloaded, lastTime, speed = self._speeds.get(jobId, (0, now, 0.0))
+            if now > lastTime:
+                currentSpeed: float = (downloaded - lastDownloaded) / (now - lastTime)
+                speed = 0.7 * speed + 0.3 * currentSpeed if speed else currentSpeed  # Smoothed so it doesn't jump around between updates
+            self._speeds[jobId] = (downloaded, now, speed)
+
+            progress: str = f"{downloaded * 100 // total}%" if total else ""
+            eta: str = Main._formatDuration((total - downloaded) / speed) if speed > 0 and total else ""
+            self._interface.modifyDownloadProgress(jobId, progress, Main._formatSpeed(speed), eta)
+
+        self._interface.after(self._progressInterval, self._updateProgress)
+
+    @staticmethod
+    def _formatSpeed(bytesPerSecond: float) -> str:
+        for unit in ("B/s", "KB/s", "MB/s"):
+            if bytesPerSecond < 1024:
+                return f"{bytesPerSecond:.0f} {unit}"
+            bytesPerSecond /= 1024
+        return f"{bytesPerSecond:.1f} GB/s"
+
+    @staticmethod
+    def _formatDuration(seconds: float) -> str:
+        seconds = int(seconds)
+        if seconds >= 3600:
+            return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+        return f"{seconds // 60}:{seconds % 60:02d}"
 
     def _onFolderChange(self, folder: str):
         video = self._getLatestVideo()
@@ -41,27 +153,121 @@ class Main:
 
     def _onVideoResolutionChange(self, res: str):
         video = self._getLatestVideo()
-        self._videoItag = video.getVideoOptions().filter(resolution=res)[0].itag
+        catalog: StreamCatalog = video.getCatalog()
+        stream = catalog.getProgressiveStream(res) if self._outputMode == Video.OUTPUT_MODES.PROGRESSIVE else catalog.getVideoStream(res)
+        self._videoItag = stream.itag if stream is not None else ""
 
     def _onAudioQualityChange(self, quality: str):
         video = self._getLatestVideo()
-        self._audioItag = video.getAudioOptions().filter(abr=quality)[0].itag
+        streams = video.getCatalog().getAudioStreams(quality)
+        if self._outputMode == Video.OUTPUT_MODES.AUDIO:
+            # An option the audio format holds as it is doesn't have to be encoded
+            copyCodecs = Transcoder.AUDIO_FORMAT_CODECS[self._audioFormat]
+            streams = sorted(streams, key=lambda stream: not Transcoder.canCopy(stream.audio_codec, copyCodecs))
+        self._audioItag = streams[0].itag if streams else ""
+
+    def _onOutputChange(self, output: str):
+        self._outputMode, self._audioFormat = Main.OUTPUTS[output]
+        if len(self._videos) == 0 or self._getLatestVideo().getCatalog() is None:
+            return
+        # Progressive and audio-only outputs choose from other options
+        video = self._getLatestVideo()
+        video.setOutputMode(self._outputMode, self._audioFormat)
+        self._showQualityOptions(video)
 
     def _download(self):
 
         if self._downloadedLatest:
             video = self._getLatestVideo()
         else:
-            video = self._getLatestVideo().__deepcopy__()
-            video.setInterfaceIndex(video.getInterfaceIndex() + 1)
+            video = self._getLatestVideo().__deepcopy__()  # Gets a job id of its own, so it has its own row
 
-        index = self._interface.addNewDownloadToList(video.getVideoTitle())
-        video.setInterfaceIndex(index)
-        Thread(target=lambda: video.downloadAndCombineVideo(self._videoItag, self._audioItag)).start()
+        self._interface.addNewDownloadToList(video.getJobId(), video.getVideoTitle())
+        self._submitDownload(video, self._videoItag, self._audioItag, video.getVideoTitle())
         self._downloadedLatest = False
 
+    def _submitDownload(self, video: Video, videoItag: int, audioItag: int, title: str, jobId: str = None, fetchOptions: bool = False) -> Job:
+        """
+        Queues a download into the scheduler, or into the broker if downloads are done by worker processes
+        :param video: the video to download
+        :param videoItag: tag of the video stream
+        :param audioItag: tag of the audio stream
+        :param title: title shown in the download list, saved so restored jobs can show it
+        :param jobId: id of the job, used when restoring a saved job
+        :param fetchOptions: whether the video options have to be fetched first
+        :return: the queued job, None if it was queued into the broker
+        """
+        # The job and the video share the id, so a restored job continues the temporary files of the video
+        if jobId is not None:
+            video.setJobId(jobId)
+
+        data = {"link": video.getLink(), "videoItag": videoItag, "audioItag": audioItag, "outputFolder": video.getOutputFolderPath(), "title": title,
+                "outputMode": video.getOutputMode(), "audioFormat": video.getAudioFormat()}
+        if self._broker is not None:
+            self._broker.submit(video.getJobId(), data, Scheduler.PRIORITIES.NORMAL)  # A worker fetches the options itself
+            return None
+
+        stages = []
+        if fetchOptions:
+            stages.append((Scheduler.STAGES.METADATA, video.fetchOptions))
+        stages.append((Scheduler.STAGES.DOWNLOAD, lambda: video.downloadStreams(videoItag, audioItag)))
+        stages.append((Scheduler.STAGES.MUX, video.combineStreams, video.getMuxCores))
+
+        job = Job(stages, priority=Scheduler.PRIORITIES.NORMAL, data=data, jobId=video.getJobId())
+        job.setOnCancelFunc(video.cancel)
+        job.setOnCleanupFunc(video.discard)
+        job.setOnFinishFunc(self._onJobFinished)
+        return self._scheduler.submit(job)
+
+    def _restoreQueue(self):
+        """
+        Queues the downloads which were unfinished when the program was closed
+        """
+        savedJobs = self._scheduler.loadPersistedJobs()
+        brokerJobs = self._broker.getUnfinishedJobs() if self._broker is not None else []
+        Video.sweepTempFiles([saved["jobId"] for saved in savedJobs + brokerJobs])
+
+        # The broker keeps its queue itself, only the rows have to be shown again
+        for queued in brokerJobs:
+            self._interface.addNewDownloadToList(queued["jobId"], queued["data"]["title"])
+
+        for saved in savedJobs:
+            data = saved["data"]
+            video = Video(data["link"])
+            video.setOnVideoCombinedFunc(self._onVideoCombined)
+            video.setOnProgressFunc(self._onProgress)
+            video.setOutputFolderPath(data["outputFolder"])
+            video.setOutputMode(data.get("outputMode", Video.OUTPUT_MODES.COMBINED), data.get("audioFormat", Video.AUDIO_FORMATS.M4A))
+            video.setJobId(saved["jobId"])
+            self._interface.addNewDownloadToList(saved["jobId"], data["title"])
+            self._submitDownload(video, data["videoItag"], data["audioItag"], data["title"], saved["jobId"], fetchOptions=True)
+
+    def _watchBroker(self, version: int):
+        """
+        Shows the progress and results which workers write into the broker. Runs in its own thread
+        :param version: version of the broker to start from
+        """
+        while True:
+            try:
+                jobs, version = self._broker.getUpdates(version)
+            except Exception as e:
+                print(f"Couldn't read the broker: {e}")
+                jobs = []
+
+            for job in jobs:
+                jobId: str = job["jobId"]
+                if job["state"] == Job.STATES.RUNNING and job["progress"]:
+                    for streamType, (downloaded, total) in job["progress"].items():
+                        self._onProgress(jobId, streamType, downloaded, total)
+                elif job["state"] == Job.STATES.QUEUED and job["attempts"] > 0:
+                    self._interface.modifyDownloadText(jobId, f"Retry {job['attempts']}")  # Failed or its worker stopped, waits for another worker
+                elif job["state"] in (Job.STATES.DONE, Job.STATES.FAILED, Job.STATES.CANCELLED):
+                    self._onVideoCombined(jobId, job["state"] == Job.STATES.DONE)
+            time.sleep(self._progressInterval / 1000)
+
     def _loadURL(self, url: str):
-        Thread(target=lambda: self._loadThread(url)).start()
+        # Loading is what the user is waiting for, so it skips ahead of queued downloads
+        self._scheduler.submit(Job([(Scheduler.STAGES.METADATA, lambda: self._loadThread(url))], priority=Scheduler.PRIORITIES.HIGH))
 
     def _loadThread(self, url):
         video = Video(url)
@@ -70,28 +276,54 @@ class Main:
         self._downloadedLatest = True
 
         video.setOnVideoCombinedFunc(self._onVideoCombined)
-        video.fetchOptions()
-        videoOptions: pytube.StreamQuery[pytube.Stream] = video.getVideoOptions().order_by("resolution").desc().filter(progressive=False)
-        audioOptions: pytube.StreamQuery[pytube.Stream] = video.getAudioOptions()
+        video.setOnProgressFunc(self._onProgress)
+        video.setOutputMode(self._outputMode, self._audioFormat)
+        if not video.fetchOptions():
+            return
+        self._showQualityOptions(video)
 
-        resolutionList: List[str] = []
-        audioList: List[str] = []
-        for stream in videoOptions:
-            res: str = stream.resolution
-            if res not in resolutionList:
-                resolutionList.append(stream.resolution)
+    def _showQualityOptions(self, video: Video):
+        """
+        Shows the options of the output mode of a video, from best to worst. The quality policy picks the ones selected first
+        """
+        catalog: StreamCatalog = video.getCatalog()
+        resolutions: List[str] = catalog.getResolutions()
+        bitrates: List[str] = catalog.getAudioBitrates()
+        if video.getOutputMode() == Video.OUTPUT_MODES.PROGRESSIVE:
+            resolutions, bitrates = catalog.getProgressiveResolutions(), []
+        elif video.getOutputMode() == Video.OUTPUT_MODES.AUDIO:
+            resolutions = []
 
-        for stream in audioOptions:
-            abr: str = stream.abr
-            if abr not in audioList:
-                audioList.append(stream.abr)
+        selectedVideo, selectedAudio = None, None
+        itags: Tuple[int, int] = self._qualityPolicy.select(video)
+        if itags is not None:
+            selectedVideo = catalog.getByItag(itags[0]).resolution if itags[0] is not None else None
+            selectedAudio = catalog.getByItag(itags[1]).abr if itags[1] is not None else None
 
-        self._interface.addQualityOptions(resolutionList, audioList)
+        self._interface.addQualityOptions(resolutions, bitrates, selectedVideo, selectedAudio)
 
     def start(self):
         self._interface.mainLoop()
 
 
+def runHeadless(arguments: List[str]) -> int:
+    """
+    Downloads without the interface. Takes the same arguments as Batch.py,
+    so "main.py --headless -" keeps downloading links written to standard input until it's closed
+    :param arguments: command line arguments after --headless
+    :return: exit code
+    """
+    import Batch
+    return Batch.runBatch(Batch.parseArguments(arguments))
+
+
 if __name__ == '__main__':
-    main = Main()
+    if len(sys.argv) > 1 and sys.argv[1] == "--headless":
+        sys.exit(runHeadless(sys.argv[2:]))
+
+    # "main.py --workers N" downloads in N worker processes instead of threads
+    workerCount: int = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 0
+    # "main.py --policy "<=1080p, prefer avc1"" selects other options than the best ones first
+    policy: QualityPolicy = QualityPolicy.parse(sys.argv[sys.argv.index("--policy") + 1]) if "--policy" in sys.argv else None
+    main = Main(workerCount, qualityPolicy=policy)
     main.start()
@@ -0,0 +1,244 @@
+import http.server
+import os
+import shutil
+import socket
+import ssl
+import tempfile
+import threading
+import time
+import unittest
+from typing import Dict, List, Tuple
+
+from Cache import MetadataCache
+from Download import Video
+from Muxer import Muxer
+
+STUB_FFMPEG: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs", "ffmpeg")
+
+VIDEO_ID: str = "dQw4w9WgXcQ"
+VIDEO_LINK: str = "https://youtu.be/" + VIDEO_ID
+
+# Contents of the streams of the fake video, different so a mixed up file is noticed
+VIDEO_BYTES: bytes = bytes(range(256)) * 800
+AUDIO_BYTES: bytes = bytes(range(255, -1, -1)) * 300
+OPUS_BYTES: bytes = b"opus" * 20000
+PROGRESSIVE_BYTES: bytes = b"progressive" * 10000
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keeps connections open like the stream servers
+    disable_nagle_algorithm = True  # Otherwise a body sent after its headers waits for the delayed ack of a reused connection
+
+    def setup(self):
+        super().setup()
+        with self.server.owner.lock:
+            self.server.owner.connections += 1
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            pass  # The client hung up between two requests
+
+    def do_GET(self):
+        owner: LocalServer = self.server.owner
+        content: bytes = owner.files.get(self.path.split("?")[0], None)
+        rangeHeader: str = self.headers.get("Range", None)
+        with owner.lock:
+            owner.requests.append((self.path, rangeHeader))
+        location: str = owner.redirects.get(self.path.split("?")[0], None)
+        if location is not None:
+            self.send_response(302)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if content is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = 0, len(content) - 1
+        if rangeHeader is not None:
+            first, last = rangeHeader.split("=")[1].split("-")
+            start, end = int(first), min(int(last), len(content) - 1) if last else len(content) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        else:
+            self.send_response(200)
+        body: memoryview = memoryview(content)[start:end + 1]  # Big files aren't copied for every request
+        if owner.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self._sendChunked(body)
+            return
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        dropAfter: int = owner.takeDrop()
+        try:
+            if dropAfter is None:
+                self._send(body)
+                return
+            # Sends a part of the promised bytes and hangs up, like a connection dropped by the network
+            self._send(body[:dropAfter])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client stopped, for example because its download was cancelled
+
+    def _send(self, body: bytes):
+        rate: float = self.server.owner.rate
+        if rate is None:
+            self.wfile.write(body)
+            return
+        # Paces every connection on its own, like a server which throttles each connection
+        start: float = time.monotonic()
+        for offset in range(0, len(body), 65536):
+            self.wfile.write(body[offset:offset + 65536])
+            time.sleep(max(0.0, start + (offset + 65536) / rate - time.monotonic()))
+
+    def _sendChunked(self, body: memoryview):
+        # Chunks of uneven sizes, so a chunk boundary falls anywhere in the reads of the client
+        offset: int = 0
+        size: int = 1000
+        while offset < len(body):
+            piece: memoryview = body[offset:offset + size]
+            self.wfile.write(f"{len(piece):x}\r\n".encode("ascii") + bytes(piece) + b"\r\n")
+            offset += len(piece)
+            size = size * 3 + 7
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Hundreds of downloads can connect at once, a short queue drops their connection attempts
+
+
+class LocalServer:
+    def __init__(self, files: Dict[str, bytes], rate: float = None, certificate: str = None, key: str = None):
+        """
+        HTTP/1.1 server on a free local port which serves files with Range requests like the stream servers of YouTube
+        :param files: path -> content
+        :param rate: bytes per second sent over a single connection. If None, as fast as possible
+        :param certificate: path to a certificate for 127.0.0.1 to serve https with. If None, http is served
+        :param key: path to the private key of the certificate
+        """
+        self.files: Dict[str, bytes] = files
+        self.rate: float = rate
+        self.redirects: Dict[str, str] = {}  # Path -> location it's redirected to
+        self.chunked: bool = False  # Whether bodies are sent with chunked transfer encoding instead of a length
+        self.lock: threading.Lock = threading.Lock()
+        self.requests: List[Tuple[str, str]] = []  # (path, Range header) of every request
+        self.connections: int = 0
+        self._drops: int = 0
+        self._dropAfter: int = 0
+
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._scheme: str = "http"
+        if certificate is not None:
+            context: ssl.SSLContext = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certificate, key)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+            self._scheme = "https"
+        self._server.owner = self
+        threading.Thread(target=self._server.serve_forever, name="test-server", daemon=True).start()
+
+    def dropConnections(self, count: int, after: int):
+        """
+        Drops the connections of the next responses partway
+        :param count: how many responses are dropped
+        :param after: how many bytes of the body are sent before the connection is dropped
+        """
+        with self.lock:
+            self._drops, self._dropAfter = count, after
+
+    def takeDrop(self) -> int:
+        """
+        Returns after how many bytes the current response is dropped, None if it's sent whole
+        """
+        with self.lock:
+            if self._drops <= 0:
+                return None
+            self._drops -= 1
+            return self._dropAfter
+
+    def getUrl(self, path: str) -> str:
+        return f"{self._scheme}://127.0.0.1:{self._server.server_address[1]}{path}"
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def addFakeVideo(cache: MetadataCache, server: LocalServer, videoId: str = VIDEO_ID, title: str = "Clip", videoBytes: bytes = VIDEO_BYTES,
+                 audioBytes: bytes = AUDIO_BYTES):
+    """
+    Puts the options of a video into a metadata cache, so Video.fetchOptions finds streams served by a local server without asking YouTube
+    :param videoBytes: content of the 1080p video stream, itag 137
+    :param audioBytes: content of the mp4 audio stream, itag 140
+    """
+    def describe(itag: int, path: str, mime: str, codecs: List[str], content: bytes, resolution: str = None, abr: str = None) -> Dict:
+        server.files[path] = content
+        return {"itag": itag, "url": server.getUrl(path), "mime": mime, "codecs": codecs, "resolution": resolution, "abr": abr,
+                "fps": 30 if resolution is not None else None, "bitrate": 1000, "filesize": len(content), "isOtf": False}
+
+    cache.put(videoId, {"title": title, "duration": 10, "streams": [
+        describe(137, f"/{videoId}/video", "video/mp4", ["avc1.640028"], videoBytes, resolution="1080p"),
+        describe(18, f"/{videoId}/progressive", "video/mp4", ["avc1.42001E", "mp4a.40.2"], PROGRESSIVE_BYTES, resolution="360p"),
+        describe(140, f"/{videoId}/audio", "audio/mp4", ["mp4a.40.2"], audioBytes, abr="128kbps"),
+        describe(251, f"/{videoId}/opus", "audio/webm", ["opus"], OPUS_BYTES, abr="160kbps")
+    ]})
+
+
+class DownloadTestCase(unittest.TestCase):
+    """
+    Runs every test in its own working folder with a local stream server, a fake video and the stub ffmpeg
+    """
+    def setUp(self):
+        self._previousFolder: str = os.getcwd()
+        self.folder: str = tempfile.mkdtemp(prefix="downloader-test-")
+        os.chdir(self.folder)  # Temporary folders of downloads are relative to the working folder
+
+        self.server: LocalServer = LocalServer({})
+        self.cache: MetadataCache = MetadataCache()
+        addFakeVideo(self.cache, self.server)
+        self.outputFolder: str = os.path.join(self.folder, "downloads")
+
+        self._previousCache: MetadataCache = Video.getMetadataCache()
+        self._previousMuxer: Muxer = Video.getMuxer()
+        self._previousStore = Video.getArtifactStore()
+        Video.setMetadataCache(self.cache)
+        Video.setMuxer(Muxer(STUB_FFMPEG, maxProcesses=4))
+        Video.setArtifactStore(None)
+
+    def tearDown(self):
+        Video.setMetadataCache(self._previousCache)
+        Video.setMuxer(self._previousMuxer)
+        Video.setArtifactStore(self._previousStore)
+        self.server.close()
+        os.chdir(self._previousFolder)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def makeVideo(self, link: str = VIDEO_LINK) -> Tuple[Video, List[Tuple[str, bool]]]:
+        """
+        Makes a video whose options are fetched already
+        :return: the video and the list its combined callback appends (job id, success) into
+        """
+        combined: List[Tuple[str, bool]] = []
+        video: Video = Video(link)
+        video.setOutputFolderPath(self.outputFolder)
+        video.setOnVideoCombinedFunc(lambda jobId, success: combined.append((jobId, success)))
+        self.assertTrue(video.fetchOptions())
+        return video, combined
+
+    def listOutput(self) -> List[str]:
+        return sorted(os.listdir(self.outputFolder)) if os.path.exists(self.outputFolder) else []
+
+    def listTempFolder(self) -> List[str]:
+        root: str = os.path.join(self.folder, "tempvideos")
+        return sorted(os.listdir(root)) if os.path.exists(root) else []
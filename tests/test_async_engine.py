@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+from typing import List
+
+import Transfer
+from AsyncEngine import AsyncEngine
+from tests.support import LocalServer
+
+
+class AsyncEngineTest(unittest.TestCase):
+    CONTENT: bytes = os.urandom(3 * 1048576 + 4321)
+
+    def setUp(self):
+        self.folder: str = tempfile.mkdtemp(prefix="engine-test-")
+        self.server: LocalServer = LocalServer({"/stream": AsyncEngineTest.CONTENT})
+        self.url: str = self.server.getUrl("/stream")
+        self.engine: AsyncEngine = AsyncEngine(readTimeout=5).start()
+
+    def tearDown(self):
+        self.engine.stop()
+        self.server.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def read(self, url: str, start: int = 0, size: int = len(CONTENT), **options) -> bytes:
+        async def collect() -> bytes:
+            return b"".join([chunk async for chunk in self.engine.streamRange(url, start, size, **options)])
+        return self.engine.run(collect(), timeout=30)
+
+    def getRangeStarts(self) -> List[int]:
+        return [int(header.split("=")[1].split("-")[0]) for _, header in self.server.requests if header is not None]
+
+    def test_chunkedBody(self):
+        self.server.chunked = True
+
+        async def readWhole() -> bytes:
+            response = await self.engine.request(self.url)
+            try:
+                return b"".join([chunk async for chunk in response.iterChunks(65536)])
+            finally:
+                response.release()
+        self.assertEqual(self.engine.run(readWhole(), timeout=30), AsyncEngineTest.CONTENT)
+        self.assertEqual(self.read(self.url, rangeSize=1048576), AsyncEngineTest.CONTENT)
+        self.assertEqual(self.server.connections, 1)  # A fully read chunked body leaves the connection reusable
+
+    def test_redirectsAreFollowed(self):
+        self.server.redirects["/relative"] = "/stream"
+        self.server.redirects["/absolute"] = self.server.getUrl("/relative")
+        self.assertEqual(self.read(self.server.getUrl("/absolute")), AsyncEngineTest.CONTENT)
+
+        self.server.redirects["/loop"] = "/loop"
+        with self.assertRaises(ConnectionError):
+            self.engine.run(self.engine.request(self.server.getUrl("/loop"), maxRedirects=3), timeout=30)
+        self.assertEqual(sum(path == "/loop" for path, _ in self.server.requests), 4)
+
+    def test_connectionsAreReused(self):
+        for _ in range(20):
+            self.assertEqual(self.read(self.url, size=1000), AsyncEngineTest.CONTENT[:1000])
+        self.assertEqual(self.server.connections, 1)
+
+        # A range left unread can't be reused, the next request opens a new connection
+        async def readFirstChunk():
+            async for _ in self.engine.streamRange(self.url, 0, len(AsyncEngineTest.CONTENT), chunkSize=1000):
+                break
+        self.engine.run(readFirstChunk(), timeout=30)
+        self.read(self.url, size=1000)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_droppedConnectionsContinue(self):
+        self.server.dropConnections(3, 300000)
+        self.assertEqual(self.read(self.url), AsyncEngineTest.CONTENT)
+        self.assertEqual(self.getRangeStarts()[:4], [0, 300000, 600000, 900000])
+
+    def test_downloadContinuesTheJournalOfBlockingTransfers(self):
+        dataPath: str = os.path.join(self.folder, "video")
+        offset: int = 1048576 + 17
+        with open(dataPath, "wb") as file:
+            file.write(AsyncEngineTest.CONTENT[:offset])
+        Transfer.Journal(dataPath, self.url, 137, len(AsyncEngineTest.CONTENT), offset).save()
+
+        self.assertTrue(self.engine.run(self.engine.downloadToFile(self.url, dataPath, len(AsyncEngineTest.CONTENT), 137), timeout=30))
+        self.assertEqual(self.getRangeStarts()[0], offset)
+        with open(dataPath, "rb") as file:
+            self.assertEqual(file.read(), AsyncEngineTest.CONTENT)
+        self.assertIsNone(Transfer.Journal.load(dataPath))
+
+    def test_emptyResponsesFail(self):
+        # The server has fewer bytes than expected and answers the rest with empty bodies, which used to be asked again forever
+        with self.assertRaises(ConnectionError):  # Not a timeout of run
+            self.read(self.url, size=len(AsyncEngineTest.CONTENT) + 100, maxRetries=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
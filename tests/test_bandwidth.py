@@ -0,0 +1,51 @@
+import time
+import unittest
+from unittest import mock
+
+from Bandwidth import BandwidthLimiter, parseRate
+
+
+def at(hour: int, minute: int) -> time.struct_time:
+    return time.struct_time((2026, 1, 1, hour, minute, 0, 3, 1, -1))
+
+
+class BandwidthTest(unittest.TestCase):
+    def test_parseRate(self):
+        self.assertEqual(parseRate("500K"), 500 * 1024)
+        self.assertEqual(parseRate("1.5MB"), 1.5 * 1024 * 1024)
+        self.assertEqual(parseRate("2m/s"), 2 * 1024 * 1024)
+        self.assertIsNone(parseRate("0"))
+
+    def test_scheduleUsesFirstMatchingRule(self):
+        limiter: BandwidthLimiter = BandwidthLimiter(100)
+        self.assertEqual(limiter.getRate(at(12, 0)), 100)
+
+        limiter.setSchedule([("08:00", "18:00", 1), ("22:00", "06:00", None), ("07:00", "09:00", 3)])
+        expected = {(0, 0): None, (5, 59): None, (6, 0): 100, (7, 0): 3, (7, 59): 3, (8, 0): 1, (8, 59): 1, (9, 0): 1,
+                    (17, 59): 1, (18, 0): 100, (21, 59): 100, (22, 0): None, (23, 59): None}
+        for (hour, minute), rate in expected.items():
+            self.assertEqual(limiter.getRate(at(hour, minute)), rate, f"{hour:02}:{minute:02}")
+
+        limiter.setRate(200)  # Times outside the rules follow the rate
+        self.assertEqual(limiter.getRate(at(12, 0)), 1)
+        self.assertEqual(limiter.getRate(at(19, 0)), 200)
+        limiter.setSchedule([])
+        self.assertEqual(limiter.getRate(at(12, 0)), 200)
+
+    def test_rateIsLookedUpOncePerMinute(self):
+        limiter: BandwidthLimiter = BandwidthLimiter(1048576)
+        limiter.setSchedule([("00:00", "23:59", 1048576)])
+        with mock.patch("Bandwidth.time.localtime", wraps=time.localtime) as localtime:
+            for _ in range(1000):
+                limiter.reserve("job", 1024)
+            self.assertLessEqual(localtime.call_count, 2)  # Twice if a minute ended meanwhile
+            calls: int = localtime.call_count
+
+            limiter.setRate(None)  # Changes take effect right away
+            limiter.setSchedule([])
+            self.assertEqual(limiter.reserve("job", 1024 * 1024 * 1024), 0.0)
+            self.assertEqual(localtime.call_count, calls + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import contextlib
+import io
+import os
+import threading
+import unittest
+from typing import List
+
+import Sink
+from Batch import BatchDownloader, BatchResult, parseArguments, runBatch
+from Catalog import QualityPolicy
+from Download import Video
+from Scheduler import Job, Scheduler
+from tests import support
+
+OTHER_LINK: str = "https://www.youtube.com/watch?v=aaaaaaaaaaa"
+BROKEN_LINK: str = "https://youtu.be/bbbbbbbbbbb"
+
+
+class BatchTest(support.DownloadTestCase):
+    def setUp(self):
+        super().setUp()
+        support.addFakeVideo(self.cache, self.server, "aaaaaaaaaaa", "Other clip")
+        support.addFakeVideo(self.cache, self.server, "bbbbbbbbbbb", "Broken clip")
+        del self.server.files["/bbbbbbbbbbb/video"]  # Its video stream can't be downloaded
+        self.downloader: BatchDownloader = BatchDownloader(self.outputFolder, Scheduler())
+
+    def writeList(self, name: str, lines: List[str]) -> str:
+        path: str = os.path.join(self.folder, name)
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        return path
+
+    def test_sourcesAreExpanded(self):
+        path: str = self.writeList("links.txt", ["# Saved links", "", f"  {OTHER_LINK}  ", "# " + BROKEN_LINK, support.VIDEO_LINK])
+        links: List[str] = list(BatchDownloader.expandSources([support.VIDEO_LINK, path, " ", OTHER_LINK]))
+        # Duplicates are kept, the store and the output names deal with videos listed twice
+        self.assertEqual(links, [support.VIDEO_LINK, OTHER_LINK, support.VIDEO_LINK, OTHER_LINK])
+
+    def test_resultsStreamAsJobsFinish(self):
+        gate: threading.Event = threading.Event()
+
+        def policy(link: str) -> QualityPolicy:
+            if link == OTHER_LINK:
+                self.assertTrue(gate.wait(10))  # The second video isn't even queued until the first result has been read
+            return QualityPolicy()
+
+        results = self.downloader.run([support.VIDEO_LINK, OTHER_LINK], policy)
+        first: BatchResult = next(results)
+        self.assertEqual((first.link, first.state, first.title), (support.VIDEO_LINK, Job.STATES.DONE, "Clip"))
+        gate.set()
+        second: BatchResult = next(results)
+        self.assertEqual((second.link, second.state, second.title), (OTHER_LINK, Job.STATES.DONE, "Other clip"))
+        self.assertEqual(list(results), [])
+        self.assertEqual(self.listOutput(), ["Clip.mp4", "Other clip.mp4"])
+
+    def test_failedVideoIsReported(self):
+        results: List[BatchResult] = list(self.downloader.run([BROKEN_LINK, support.VIDEO_LINK]))
+        states = sorted((result.link, result.state) for result in results)
+        self.assertEqual(states, [(BROKEN_LINK, Job.STATES.FAILED), (support.VIDEO_LINK, Job.STATES.DONE)])
+        self.assertEqual(self.listOutput(), ["Clip.mp4"])
+        self.assertEqual(self.listTempFolder(), [])
+
+    def test_unreadableSourceIsRaisedAfterQueuedVideos(self):
+        with open(os.path.join(self.folder, "links.txt"), "wb") as file:
+            file.write(b"\xff\xfe not a text file")
+        results = self.downloader.run([support.VIDEO_LINK, os.path.join(self.folder, "links.txt")])
+        self.assertEqual(next(results).state, Job.STATES.DONE)  # Queued before the file was read, so it's finished
+        with self.assertRaises(UnicodeDecodeError):
+            next(results)
+
+    def test_unreadableSourceFailsCommandLine(self):
+        with open(os.path.join(self.folder, "links.txt"), "wb") as file:
+            file.write(b"\xff\xfe not a text file")
+        previousSettings, previousWorkers = Sink.getSettings(), Video._downloadWorkers
+        try:
+            errors: io.StringIO = io.StringIO()
+            with contextlib.redirect_stderr(errors):
+                code: int = runBatch(parseArguments(["--ffmpeg", support.STUB_FFMPEG, "--no-store", "-o", self.outputFolder,
+                                                     os.path.join(self.folder, "links.txt")]))
+        finally:
+            Sink.configure(previousSettings)
+            Video.setDownloadWorkers(previousWorkers)
+        self.assertEqual(code, 2)
+        self.assertIn("Couldn't read the sources", errors.getvalue())
+
+    def runWithPolicy(self, arguments: List[str]) -> BatchResult:
+        parsed = parseArguments(arguments + [support.VIDEO_LINK])
+        downloader: BatchDownloader = BatchDownloader(self.outputFolder, Scheduler(), outputMode=parsed.mode, audioFormat=parsed.audio_format)
+        results: List[BatchResult] = list(downloader.run(parsed.sources, parsed.policy))
+        self.assertEqual(len(results), 1)
+        return results[0]
+
+    def test_policyPicksItags(self):
+        result: BatchResult = self.runWithPolicy(["--policy", "<=1080p, abr <=160k"])
+        self.assertEqual((result.state, result.videoItag, result.audioItag), (Job.STATES.DONE, 137, 140))  # Copied mp4 audio beats opus
+
+        result = self.runWithPolicy(["--policy", "<=720p", "--mode", Video.OUTPUT_MODES.PROGRESSIVE])
+        self.assertEqual((result.state, result.videoItag, result.audioItag), (Job.STATES.DONE, 18, None))
+
+        result = self.runWithPolicy(["--policy", "abr <=160k", "--mode", Video.OUTPUT_MODES.AUDIO, "--audio-format", Video.AUDIO_FORMATS.OPUS])
+        self.assertEqual((result.state, result.videoItag, result.audioItag), (Job.STATES.DONE, None, 251))
+
+        result = self.runWithPolicy(["--policy", "max 720p"])  # Only a progressive option is that small
+        self.assertEqual((result.state, result.videoItag, result.audioItag), (Job.STATES.FAILED, None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
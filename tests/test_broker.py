@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from typing import Dict, List, Tuple
+
+from Broker import Broker
+from Scheduler import Job
+
+
+class BrokerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder: str = tempfile.mkdtemp(prefix="broker-test-")
+        self.path: str = os.path.join(self.folder, "broker.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def getStates(self, broker: Broker) -> Dict[str, str]:
+        jobs, _ = broker.getUpdates()
+        return {job["jobId"]: job["state"] for job in jobs}
+
+    def test_workersClaimDistinctJobs(self):
+        broker: Broker = Broker(self.path)
+        for index in range(40):
+            broker.submit(f"job{index}", {"index": index})
+
+        claimed: List[Tuple[str, str]] = []
+        lock: threading.Lock = threading.Lock()
+
+        def work(workerId: str):
+            workerBroker: Broker = Broker(self.path)  # Like a worker process with its own connection
+            while True:
+                job = workerBroker.claim(workerId)
+                if job is None:
+                    return
+                with lock:
+                    claimed.append((job[0], workerId))
+
+        threads: List[threading.Thread] = [threading.Thread(target=work, args=(f"worker{index}",)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+
+        jobIds: List[str] = [jobId for jobId, _ in claimed]
+        self.assertEqual(sorted(jobIds), sorted(f"job{index}" for index in range(40)))  # Every job once
+        self.assertEqual(set(self.getStates(broker).values()), {Job.STATES.RUNNING})
+
+    def test_claimFollowsPriority(self):
+        broker: Broker = Broker(self.path)
+        broker.submit("low", {}, 10)
+        broker.submit("high", {}, 0)
+        broker.submit("normal", {}, 5)
+        self.assertEqual([broker.claim("worker")[0] for _ in range(3)], ["high", "normal", "low"])
+        self.assertIsNone(broker.claim("worker"))
+
+    def test_jobOfSilentWorkerIsQueuedAgain(self):
+        broker: Broker = Broker(self.path, heartbeatTimeout=0.2)
+        broker.submit("job", {"link": "video"})
+        self.assertEqual(broker.claim("crashed"), ("job", {"link": "video"}))
+        self.assertIsNone(broker.claim("other"))  # Its worker is still in time
+
+        time.sleep(0.3)
+        self.assertEqual(broker.claim("other"), ("job", {"link": "video"}))
+        self.assertFalse(broker.heartbeat("crashed", "job"))  # The late worker is told to stop
+        self.assertIsNone(broker.finish("crashed", "job", True))
+        self.assertTrue(broker.heartbeat("other", "job", {"downloaded": 10}))
+
+        self.assertEqual(broker.finish("other", "job", True, result={"title": "Clip"}), Job.STATES.DONE)
+        job: Dict = broker.getUpdates()[0][0]
+        self.assertEqual((job["state"], job["attempts"], job["progress"], job["result"]), (Job.STATES.DONE, 2, {"downloaded": 10}, {"title": "Clip"}))
+
+    def test_failedJobIsRetriedUntilMaxAttempts(self):
+        broker: Broker = Broker(self.path, maxAttempts=3)
+        broker.submit("job", {})
+        for attempt in range(1, 4):
+            self.assertEqual(broker.claim(f"worker{attempt}")[0], "job")
+            state: str = broker.finish(f"worker{attempt}", "job", False, f"error {attempt}")
+            self.assertEqual(state, Job.STATES.QUEUED if attempt < 3 else Job.STATES.FAILED)
+
+        self.assertIsNone(broker.claim("worker"))
+        job: Dict = broker.getUpdates()[0][0]
+        self.assertEqual((job["state"], job["attempts"], job["error"]), (Job.STATES.FAILED, 3, "error 3"))
+
+    def test_cancelStopsRunningJobAtNextHeartbeat(self):
+        broker: Broker = Broker(self.path)
+        broker.submit("running", {})
+        broker.submit("queued", {}, 10)
+        self.assertEqual(broker.claim("worker")[0], "running")
+        self.assertTrue(broker.heartbeat("worker", "running"))
+
+        self.assertTrue(broker.cancel("running"))
+        self.assertTrue(broker.cancel("queued"))
+        self.assertFalse(broker.heartbeat("worker", "running"))
+        self.assertIsNone(broker.finish("worker", "running", True))  # A cancelled job stays cancelled
+        self.assertIsNone(broker.claim("worker"))
+        self.assertFalse(broker.cancel("running"))  # Already finished
+        self.assertEqual(self.getStates(broker), {"running": Job.STATES.CANCELLED, "queued": Job.STATES.CANCELLED})
+
+    def test_updatesReturnEveryChangeOnce(self):
+        broker: Broker = Broker(self.path)
+        version: int = broker.getVersion()
+        self.assertEqual(broker.getUpdates(version), ([], version))
+
+        broker.submit("first", {})
+        broker.submit("second", {})
+        jobs, version = broker.getUpdates(version)
+        self.assertEqual([(job["jobId"], job["state"]) for job in jobs], [("first", Job.STATES.QUEUED), ("second", Job.STATES.QUEUED)])
+        self.assertEqual(broker.getUpdates(version), ([], version))
+
+        broker.claim("worker")
+        broker.heartbeat("worker", "first", {"downloaded": 1})
+        broker.heartbeat("worker", "first", {"downloaded": 2})  # Only the latest state of a job is returned
+        jobs, version = broker.getUpdates(version)
+        self.assertEqual([(job["jobId"], job["state"], job["progress"]) for job in jobs], [("first", Job.STATES.RUNNING, {"downloaded": 2})])
+
+        watcher: Broker = Broker(self.path)  # Another process watching the same database
+        broker.finish("worker", "first", True)
+        jobs, version = watcher.getUpdates(version)
+        self.assertEqual([(job["jobId"], job["state"]) for job in jobs], [("first", Job.STATES.DONE)])
+        self.assertEqual(watcher.getUpdates(version), ([], version))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+
+from Catalog import QualityPolicy
+from Download import Video
+from tests import support
+
+
+class CatalogTest(support.DownloadTestCase):
+    def test_combinedDownloadsPickAudioWhichIsCopied(self):
+        video, _ = self.makeVideo()
+        # Opus 251 has the higher bitrate but would be encoded again into the mp4 file
+        self.assertEqual(QualityPolicy().select(video), (137, 140))
+        self.assertEqual(QualityPolicy().selectFromCatalog(video.getCatalog(), copyCodecs=()), (137, 251))
+
+    def test_audioDownloadsPickTheCodecOfTheirFormat(self):
+        video, _ = self.makeVideo()
+        video.setOutputMode(Video.OUTPUT_MODES.AUDIO, Video.AUDIO_FORMATS.OPUS)
+        self.assertEqual(QualityPolicy().select(video), (None, 251))
+        video.setOutputMode(Video.OUTPUT_MODES.AUDIO, Video.AUDIO_FORMATS.M4A)
+        self.assertEqual(QualityPolicy().select(video), (None, 140))
+
+
+if __name__ == '__main__':
+    unittest.main()
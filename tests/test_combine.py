@@ -0,0 +1,70 @@
+import os
+import time
+import unittest
+
+from Download import Video
+from Muxer import Muxer
+from tests import support
+
+
+class CombineTest(support.DownloadTestCase):
+    def test_combinedVideoIsReportedWhenFFmpegExits(self):
+        video, combined = self.makeVideo()
+        self.assertTrue(video.downloadStreams(137, 140, "clip"))
+
+        # The combination used to be noticed by checking for the output file every second
+        start: float = time.monotonic()
+        self.assertTrue(video.combineStreams())
+        self.assertLess(time.monotonic() - start, 1.0)
+
+        self.assertEqual(combined, [(video.getJobId(), True)])
+        self.assertEqual(self.listOutput(), ["clip.mp4"])
+        with open(os.path.join(self.outputFolder, "clip.mp4"), "rb") as file:
+            self.assertEqual(file.read(), support.VIDEO_BYTES + support.AUDIO_BYTES)
+        self.assertEqual(self.listTempFolder(), [])
+
+    def test_failedCombinationIsReported(self):
+        video, combined = self.makeVideo()
+        self.assertTrue(video.downloadStreams(137, 140, "FAIL"))
+
+        start: float = time.monotonic()
+        self.assertFalse(video.combineStreams())
+        self.assertLess(time.monotonic() - start, 1.0)  # Used to wait for an output file which never came
+
+        self.assertEqual(combined, [(video.getJobId(), False)])
+        self.assertEqual(self.listOutput(), [])  # Neither a broken video nor the reserved name is left behind
+        self.assertEqual(self.listTempFolder(), [])
+
+    def test_combineReturnsTheExitStatus(self):
+        video, _ = self.makeVideo()
+        self.assertTrue(video.downloadStreams(137, 140, "clip"))
+        os.makedirs(self.outputFolder, exist_ok=True)
+
+        # Both combinations read the temporary files of the download, the second one fails
+        videoName, audioName, _ = video._pendingFiles
+        self.assertTrue(video.combine(videoName, audioName, "copy", ".mp4"))
+        self.assertFalse(video.combine(videoName, audioName, "FAIL copy", ".mp4"))
+        self.assertTrue(os.path.exists(os.path.join(self.outputFolder, "copy.mp4")))
+        self.assertFalse(os.path.exists(os.path.join(self.outputFolder, "FAIL copy.mp4")))
+        video.discard()
+
+    def test_missingFFmpegFailsTheDownload(self):
+        Video.setMuxer(Muxer(os.path.join(self.folder, "missing", "ffmpeg")))
+        video, combined = self.makeVideo()
+        self.assertFalse(video.downloadAndCombineVideo(137, 140, "clip"))
+        self.assertEqual(combined, [(video.getJobId(), False)])
+        self.assertEqual(self.listOutput(), [])
+
+    def test_jobsDontWaitForEachOther(self):
+        start: float = time.monotonic()
+        for index in range(5):
+            video, combined = self.makeVideo()
+            self.assertTrue(video.downloadAndCombineVideo(137, 140, f"clip {index}"))
+            self.assertEqual(combined, [(video.getJobId(), True)])
+        # Polling added at least a second to every job
+        self.assertLess(time.monotonic() - start, 5.0)
+        self.assertEqual(len(self.listOutput()), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
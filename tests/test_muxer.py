@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from typing import Dict, List
+from unittest import mock
+
+from Muxer import Capabilities, Muxer
+from Transcode import TranscodeSettings, Transcoder
+from tests import support
+
+
+class MuxerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder: str = tempfile.mkdtemp(prefix="muxer-test-")
+        self.logPath: str = os.path.join(self.folder, "ffmpeg.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def readLog(self) -> List[Dict]:
+        with open(self.logPath) as log:
+            return [json.loads(line) for line in log]
+
+    def test_capabilitiesAreProbedOnce(self):
+        # Counts the runs of the stub, the probes exit before the stub writes its own log
+        countPath: str = os.path.join(self.folder, "runs")
+        wrapperPath: str = os.path.join(self.folder, "ffmpeg")
+        with open(wrapperPath, "w") as wrapper:
+            wrapper.write(f"#!/bin/sh\necho run >> '{countPath}'\nexec '{support.STUB_FFMPEG}' \"$@\"\n")
+        os.chmod(wrapperPath, os.stat(wrapperPath).st_mode | stat.S_IEXEC)
+
+        muxer: Muxer = Muxer(wrapperPath)
+        for _ in range(3):
+            capabilities: Capabilities = muxer.getCapabilities()
+        self.assertEqual(capabilities.version, "6.1.1-stub")
+        self.assertEqual(capabilities.encoders, {"libx264", "h264_nvenc", "aac", "libopus", "libmp3lame"})
+        self.assertTrue(capabilities.hasEncoder("h264_nvenc"))
+        with open(countPath) as count:
+            self.assertEqual(len(count.readlines()), 2)  # -version and -encoders
+
+    def test_missingFFmpegHasNoCapabilities(self):
+        for path in (os.path.join(self.folder, "missing"), None):
+            muxer: Muxer = Muxer(path)
+            muxer._ffmpegPath = path  # None isn't searched again from PATH
+            capabilities: Capabilities = muxer.getCapabilities()
+            self.assertIsNone(capabilities.version)
+            self.assertEqual(capabilities.encoders, set())
+
+    def test_hardwareEncoderIsUsedOnlyIfFFmpegHasIt(self):
+        video, audio = SimpleNamespace(video_codec="vp9"), SimpleNamespace(audio_codec="opus")
+        encoders = Muxer(support.STUB_FFMPEG).getCapabilities().encoders
+        self.assertIn("h264_nvenc", Transcoder.plan(video, audio, TranscodeSettings(hardwareEncoder="h264_nvenc"), encoders).getOutputOptions())
+        options: List[str] = Transcoder.plan(video, audio, TranscodeSettings(hardwareEncoder="h264_vaapi"), encoders).getOutputOptions()
+        self.assertNotIn("h264_vaapi", options)
+        self.assertIn("libx264", options)
+
+    def test_buildCommand(self):
+        muxer: Muxer = Muxer("ffmpeg")
+        prefix: List[str] = ["ffmpeg", "-hide_banner", "-nostdin", "-loglevel", "error", "-y"]
+        self.assertEqual(muxer.buildCommand(["audio.webm"], "out.opus", ["-vn", "-c:a", "copy"]),
+                         prefix + ["-i", "audio.webm", "-vn", "-c:a", "copy", "out.opus"])
+        # Video is taken from the first input and audio from the second, even if the first one has audio too
+        self.assertEqual(muxer.buildCommand(["video.mp4", "pipe:0"], "out.mp4", ["-c", "copy"]),
+                         prefix + ["-i", "video.mp4", "-i", "pipe:0", "-map", "0:v:0", "-map", "1:a:0", "-c", "copy", "out.mp4"])
+
+    def test_runReturnsTheExitStatus(self):
+        inputPath: str = os.path.join(self.folder, "input")
+        with open(inputPath, "wb") as file:
+            file.write(b"content")
+        muxer: Muxer = Muxer(support.STUB_FFMPEG)
+        self.assertTrue(muxer.run([inputPath], os.path.join(self.folder, "out.mp4")))
+        self.assertFalse(muxer.run([inputPath], os.path.join(self.folder, "FAIL.mp4")))
+        self.assertFalse(Muxer(os.path.join(self.folder, "missing")).run([inputPath], os.path.join(self.folder, "other.mp4")))
+
+    def test_processesAreLimited(self):
+        inputPath: str = os.path.join(self.folder, "input")
+        open(inputPath, "wb").close()
+        muxer: Muxer = Muxer(support.STUB_FFMPEG, maxProcesses=2)
+        with mock.patch.dict(os.environ, {"STUB_FFMPEG_LOG": self.logPath, "STUB_FFMPEG_SLEEP": "0.3"}):
+            threads: List[threading.Thread] = [
+                threading.Thread(target=muxer.run, args=([inputPath], os.path.join(self.folder, f"out{index}.mp4"))) for index in range(6)]
+            start: float = time.monotonic()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed: float = time.monotonic() - start
+
+        runs: List[Dict] = self.readLog()
+        self.assertEqual(len(runs), 6)
+        # Most processes running at once, counted at the start of every run
+        overlap: int = max(sum(other["started"] <= run["started"] < other["finished"] for other in runs) for run in runs)
+        self.assertEqual(overlap, 2)
+        self.assertGreaterEqual(elapsed, 0.9)  # Three rounds of two processes
+
+        # A failed run frees its place too
+        self.assertFalse(muxer.run([inputPath], os.path.join(self.folder, "FAIL.mp4")))
+        self.assertFalse(muxer.run([inputPath], os.path.join(self.folder, "FAIL.mp4")))
+        self.assertTrue(muxer.run([inputPath], os.path.join(self.folder, "last.mp4")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from typing import List
+
+from Scheduler import Job, Scheduler
+
+STAGE: str = Scheduler.STAGES.DOWNLOAD
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder: str = tempfile.mkdtemp(prefix="scheduler-test-")
+        self._gates: List[threading.Event] = []
+
+    def tearDown(self):
+        for gate in self._gates:
+            gate.set()  # Lets blocked workers finish
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def makeGate(self) -> threading.Event:
+        gate: threading.Event = threading.Event()
+        self._gates.append(gate)
+        return gate
+
+    def submit(self, scheduler: Scheduler, func, priority: int = Scheduler.PRIORITIES.NORMAL, data=None, jobId: str = None) -> Job:
+        job: Job = Job([(STAGE, func)], priority, data, jobId)
+        finished: threading.Event = threading.Event()
+        job.setOnFinishFunc(lambda _: finished.set())
+        job.finished = finished
+        return scheduler.submit(job)
+
+    def waitUntil(self, condition, timeout: float = 5.0):
+        deadline: float = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("condition wasn't met in time")
+            time.sleep(0.005)
+
+    def test_smallerPriorityRunsFirst(self):
+        scheduler: Scheduler = Scheduler({STAGE: 1})
+        gate: threading.Event = self.makeGate()
+        blocker: Job = self.submit(scheduler, gate.wait)  # Keeps the only worker busy while the others are queued
+        self.waitUntil(lambda: blocker.getState() == Job.STATES.RUNNING)
+
+        order: List[str] = []
+        jobs: List[Job] = [self.submit(scheduler, lambda name=name: order.append(name), priority)
+                           for name, priority in (("low", Scheduler.PRIORITIES.LOW), ("normal", Scheduler.PRIORITIES.NORMAL),
+                                                  ("high", Scheduler.PRIORITIES.HIGH), ("normal again", Scheduler.PRIORITIES.NORMAL))]
+        gate.set()
+        for job in jobs:
+            self.assertTrue(job.finished.wait(5))
+        self.assertEqual(order, ["high", "normal", "normal again", "low"])
+
+    def runCounted(self, scheduler: Scheduler, jobCount: int, duration: float = 0.02) -> int:
+        """
+        Runs jobs which sleep and returns the most of them that ran at the same time
+        """
+        lock: threading.Lock = threading.Lock()
+        counts: List[int] = [0, 0]  # Running now, most at once
+
+        def work():
+            with lock:
+                counts[0] += 1
+                counts[1] = max(counts[1], counts[0])
+            time.sleep(duration)
+            with lock:
+                counts[0] -= 1
+
+        jobs: List[Job] = [self.submit(scheduler, work) for _ in range(jobCount)]
+        for job in jobs:
+            self.assertTrue(job.finished.wait(10))
+            self.assertEqual(job.getState(), Job.STATES.DONE)
+        return counts[1]
+
+    def test_stageLimitIsNotExceeded(self):
+        scheduler: Scheduler = Scheduler({STAGE: 3})
+        self.assertEqual(self.runCounted(scheduler, 30), 3)
+
+    def test_limitCanBeLoweredAndRaised(self):
+        scheduler: Scheduler = Scheduler({STAGE: 4})
+        scheduler.setLimit(STAGE, 2)
+        scheduler.setLimit(STAGE, 1)  # Lowered again before the first stop signals were taken
+        self.assertEqual(self.runCounted(scheduler, 12), 1)
+        self.waitUntil(lambda: scheduler._workerCounts[STAGE] == 1)
+
+        scheduler.setLimit(STAGE, 2)
+        scheduler.setLimit(STAGE, 4)
+        self.assertEqual(self.runCounted(scheduler, 30), 4)
+
+        # Raised right after lowering, while the stop signals are still queued
+        gates: List[threading.Event] = [self.makeGate() for _ in range(4)]
+        busy: List[Job] = [self.submit(scheduler, gate.wait) for gate in gates]
+        self.waitUntil(lambda: all(job.getState() == Job.STATES.RUNNING for job in busy))
+        scheduler.setLimit(STAGE, 1)
+        scheduler.setLimit(STAGE, 3)
+        for gate in gates:
+            gate.set()
+        self.assertEqual(self.runCounted(scheduler, 30), 3)
+        self.waitUntil(lambda: scheduler._workerCounts[STAGE] == 3)
+
+    def test_cancelQueuedJob(self):
+        scheduler: Scheduler = Scheduler({STAGE: 1})
+        gate: threading.Event = self.makeGate()
+        blocker: Job = self.submit(scheduler, gate.wait)
+        self.waitUntil(lambda: blocker.getState() == Job.STATES.RUNNING)
+
+        ran: threading.Event = threading.Event()
+        cleaned: threading.Event = threading.Event()
+        queued: Job = self.submit(scheduler, ran.set)
+        queued.setOnCleanupFunc(cleaned.set)
+        self.assertTrue(scheduler.cancel(queued.getJobId()))
+        gate.set()
+
+        self.assertTrue(queued.finished.wait(5))
+        self.assertEqual(queued.getState(), Job.STATES.CANCELLED)
+        self.assertFalse(ran.is_set())
+        self.assertTrue(cleaned.is_set())
+        self.assertFalse(scheduler.cancel(queued.getJobId()))  # Finished jobs are forgotten
+
+    def test_cancelRunningJob(self):
+        scheduler: Scheduler = Scheduler({STAGE: 1})
+        stop: threading.Event = self.makeGate()
+        started: threading.Event = threading.Event()
+
+        def work() -> bool:
+            started.set()
+            stop.wait()
+            return True
+
+        job: Job = self.submit(scheduler, work)
+        job.setOnCancelFunc(stop.set)
+        self.assertTrue(started.wait(5))
+        self.assertTrue(scheduler.cancel(job.getJobId()))
+
+        self.assertTrue(job.finished.wait(5))
+        self.assertEqual(job.getState(), Job.STATES.CANCELLED)  # The stage returned True, but the job was cancelled
+
+    def test_unfinishedJobsAreReloadedAfterRestart(self):
+        path: str = os.path.join(self.folder, "queue.json")
+        scheduler: Scheduler = Scheduler({STAGE: 1}, persistPath=path)
+        done: Job = self.submit(scheduler, lambda: True, data={"url": "done"}, jobId="done")
+        self.assertTrue(done.finished.wait(5))
+        gate: threading.Event = self.makeGate()
+        running: Job = self.submit(scheduler, gate.wait, data={"url": "running"}, jobId="running")
+        self.waitUntil(lambda: running.getState() == Job.STATES.RUNNING)
+        self.submit(scheduler, lambda: True, Scheduler.PRIORITIES.HIGH, {"url": "queued"}, "queued")
+        self.submit(scheduler, lambda: True)  # Jobs without data aren't saved
+
+        restarted: Scheduler = Scheduler({STAGE: 1}, persistPath=path)  # Like a new process after a crash
+        saved = sorted(restarted.loadPersistedJobs(), key=lambda saved: saved["jobId"])
+        self.assertEqual(saved, [{"jobId": "queued", "priority": Scheduler.PRIORITIES.HIGH, "data": {"url": "queued"}},
+                                 {"jobId": "running", "priority": Scheduler.PRIORITIES.NORMAL, "data": {"url": "running"}}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import Sink
+from Sink import FileSink, SinkSettings
+
+
+class SinkTest(unittest.TestCase):
+    def setUp(self):
+        self.folder: str = tempfile.mkdtemp(prefix="sink-test-")
+        self.path: str = os.path.join(self.folder, "video.mp4")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def read(self, path: str = None) -> bytes:
+        with open(path if path is not None else self.path, "rb") as file:
+            return file.read()
+
+    def test_smallWriteIsBufferedUntilClose(self):
+        sink: FileSink = FileSink(self.path, settings=SinkSettings(8192, preallocate=False))
+        self.assertEqual(sink.write(b"a" * 100), 100)
+        self.assertEqual(os.path.getsize(self.path), 0)  # Still in the buffer
+
+        self.assertEqual(sink.close(), 100)
+        self.assertEqual(self.read(), b"a" * 100)
+
+    def test_writeLargerThanBufferIsWrittenAtOnce(self):
+        data: bytes = os.urandom(20000)
+        sink: FileSink = FileSink(self.path, settings=SinkSettings(8192, preallocate=False))
+        sink.write(b"head")
+        sink.write(data)  # Fills the buffer twice and keeps the rest
+        self.assertEqual(os.path.getsize(self.path), 16384)
+        sink.close()
+
+        with FileSink(self.path, 4 + len(data), settings=SinkSettings(8192, preallocate=False)) as sink:
+            sink.write(data)  # The buffer is empty, so the bytes bypass it
+            self.assertEqual(os.path.getsize(self.path), 4 + 2 * len(data))
+        self.assertEqual(self.read(), b"head" + data + data)
+
+    def test_preallocatedFileIsTruncatedWhenStreamIsShort(self):
+        sink: FileSink = FileSink(self.path, 0, 65536, SinkSettings(8192))
+        if not sink._allocated:
+            sink.close()
+            self.skipTest("the file system can't preallocate")
+        self.assertEqual(os.path.getsize(self.path), 65536)
+
+        sink.write(b"b" * 1000)  # The server announced more than it sent
+        self.assertEqual(sink.close(), 1000)
+        self.assertEqual(self.read(), b"b" * 1000)
+
+    def test_incompleteCloseKeepsPreallocatedSize(self):
+        sink: FileSink = FileSink(self.path, 0, 65536, SinkSettings(8192))
+        sink.write(b"c" * 1000)
+        sink.close(False)  # A resumed download continues into the reserved blocks
+        self.assertEqual(self.read()[:1000], b"c" * 1000)
+        if sink._allocated:
+            self.assertEqual(os.path.getsize(self.path), 65536)
+
+    @unittest.skipUnless(Sink.directIOSupported(), "direct I/O isn't supported on this platform")
+    def test_directSinkResumesAtUnalignedOffset(self):
+        first: bytes = os.urandom(Sink.ALIGNMENT + 1234)
+        rest: bytes = os.urandom(3 * Sink.ALIGNMENT + 99)
+        with FileSink(self.path, 0, len(first) + len(rest), SinkSettings(8192, preallocate=False)) as sink:
+            sink.write(first)
+
+        sink = FileSink(self.path, len(first), len(first) + len(rest), SinkSettings(8192, preallocate=False, directIO=True))
+        if not sink._direct:
+            sink.close(False)
+            self.skipTest("the file system doesn't support direct I/O")
+        for start in range(0, len(rest), 1000):
+            sink.write(rest[start:start + 1000])
+        self.assertEqual(sink.close(), len(first) + len(rest))
+        self.assertEqual(self.read(), first + rest)
+
+    def test_commitRenamesToFinalPath(self):
+        partialPath: str = Sink.getPartialPath(self.path)
+        self.assertTrue(os.path.basename(partialPath).startswith(Sink.PARTIAL_PREFIX))
+        sink: FileSink = FileSink(partialPath, 0, 5000, SinkSettings(8192, sync=SinkSettings.SYNC.CLOSE), finalPath=self.path)
+        sink.write(b"d" * 5000)
+        sink.commit()
+
+        self.assertEqual(os.listdir(self.folder), ["video.mp4"])
+        self.assertEqual(self.read(), b"d" * 5000)
+
+    def test_discardRemovesPartialFile(self):
+        sink: FileSink = FileSink(Sink.getPartialPath(self.path), 0, 5000, SinkSettings(8192), finalPath=self.path)
+        sink.write(b"e" * 3000)
+        sink.discard()
+        sink.discard()  # Already closed and removed
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_segmentSinksShareAllocatedFile(self):
+        data: bytes = os.urandom(50000)
+        bounds = [(0, 12000), (12000, 30001), (30001, 50000)]
+        settings: SinkSettings = SinkSettings(4096)
+        Sink.allocateFile(self.path, len(data), settings)
+        self.assertEqual(os.path.getsize(self.path), len(data))
+
+        sinks = [FileSink(self.path, start, len(data), settings, ownsFile=False) for start, _ in bounds]
+        for position in range(0, 20000, 700):  # Interleaved like segments arriving at the same time
+            for sink, (start, end) in zip(sinks, bounds):
+                if start + position < end:
+                    sink.write(data[start + position:min(start + position + 700, end)])
+        for sink, (_, end) in zip(reversed(sinks), reversed(bounds)):
+            self.assertEqual(sink.close(), end)
+
+        self.assertEqual(self.read(), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
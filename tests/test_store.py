@@ -0,0 +1,56 @@
+import os
+import tempfile
+import time
+import unittest
+from typing import List
+
+from AsyncEngine import AsyncEngine
+from Download import Video
+from Muxer import Muxer
+from Store import ArtifactStore
+from tests import support
+
+
+class StoreTest(support.DownloadTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store: ArtifactStore = ArtifactStore(os.path.join(self.folder, "store"))
+        Video.setArtifactStore(self.store)
+
+    def countVideoRequests(self) -> int:
+        return sum(path.endswith("/video") for path, _ in self.server.requests)
+
+    def test_duplicateAsyncDownloadsDontHoldTheEngine(self):
+        # The waiting downloads used to take every blocking thread, which the download they waited for needed too
+        engine: AsyncEngine = AsyncEngine(blockingWorkers=2, muxer=Muxer(support.STUB_FFMPEG)).start()
+        previousEngine: AsyncEngine = Video._engine
+        Video.setAsyncEngine(engine)
+        try:
+            videos: List[Video] = [self.makeVideo()[0] for _ in range(5)]
+            futures = [video.submitDownload(137, 140, "clip") for video in videos]
+            self.assertEqual([future.result(timeout=20) for future in futures], [True] * 5)
+        finally:
+            Video.setAsyncEngine(previousEngine)
+            engine.stop()
+
+        self.assertEqual(len(self.listOutput()), 5)
+        self.assertEqual(self.countVideoRequests(), 1)  # The others were linked from the store
+
+    def test_waitingForAnotherDownloadTimesOut(self):
+        first, _ = self.makeVideo()
+        self.assertTrue(first.downloadStreams(137, 140, "clip"))  # Claims the video but doesn't finish it
+
+        Video.setArtifactStore(self.store, waitTimeout=0.2)
+        second, combined = self.makeVideo()
+        start: float = time.monotonic()
+        self.assertTrue(second.downloadAndCombineVideo(137, 140, "clip"))
+        self.assertLess(time.monotonic() - start, 5.0)
+        self.assertEqual(combined, [(second.getJobId(), True)])
+        self.assertEqual(self.countVideoRequests(), 2)  # Downloaded on its own
+
+        self.assertTrue(first.combineStreams())
+        self.assertEqual(self.listOutput(), ["clip (1).mp4", "clip.mp4"])
+
+
+if __name__ == '__main__':
+    unittest.main()
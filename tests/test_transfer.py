@@ -0,0 +1,70 @@
+import os
+import unittest
+
+import Transfer
+from tests import support
+
+
+class TransferTest(support.DownloadTestCase):
+    CONTENT: bytes = os.urandom(3 * 1048576 + 4321)
+
+    def setUp(self):
+        super().setUp()
+        self.server.files["/stream"] = TransferTest.CONTENT
+        self.url: str = self.server.getUrl("/stream")
+        self.path: str = os.path.join(self.folder, "stream.part")
+
+    def getRangeStarts(self):
+        return [int(rangeHeader.split("=")[1].split("-")[0]) for path, rangeHeader in self.server.requests if path == "/stream"]
+
+    def assertComplete(self):
+        with open(self.path, "rb") as file:
+            self.assertEqual(file.read(), TransferTest.CONTENT)
+        self.assertIsNone(Transfer.Journal.load(self.path))
+
+    def test_droppedConnectionsAreContinued(self):
+        self.server.dropConnections(3, 300000)
+        self.assertTrue(Transfer.downloadToFile(self.url, self.path, len(TransferTest.CONTENT), 137))
+        self.assertComplete()
+
+        # Every retry asks for the bytes after those it already has, instead of starting over
+        self.assertEqual(self.getRangeStarts(), [0, 300000, 600000, 900000])
+
+    def test_restartContinuesFromTheJournal(self):
+        chunks: list = []
+
+        def stopHalfway() -> bool:
+            chunks.append(None)
+            return len(chunks) > 25  # Like a process stopped partway
+
+        self.assertFalse(Transfer.downloadToFile(self.url, self.path, len(TransferTest.CONTENT), 137, "video",
+                                                 journalInterval=65536, isCancelled=stopHalfway))
+        journal: Transfer.Journal = Transfer.Journal.load(self.path)
+        self.assertEqual((journal.url, journal.itag, journal.expectedSize, journal.videoId), (self.url, 137, len(TransferTest.CONTENT), "video"))
+        self.assertGreater(journal.offset, 0)
+
+        # The connection of the restarted download drops too
+        del self.server.requests[:]
+        self.server.dropConnections(1, 100000)
+        self.assertTrue(Transfer.downloadToFile(self.url, self.path, len(TransferTest.CONTENT), 137, "video"))
+        self.assertComplete()
+        self.assertEqual(self.getRangeStarts(), [journal.offset, journal.offset + 100000])
+
+    def test_journalOfAnotherStreamIsIgnored(self):
+        with open(self.path, "wb") as file:
+            file.write(b"x" * 1000)
+        Transfer.Journal(self.path, self.url, 136, len(TransferTest.CONTENT), 1000).save()
+
+        self.assertTrue(Transfer.downloadToFile(self.url, self.path, len(TransferTest.CONTENT), 137))
+        self.assertComplete()
+        self.assertEqual(self.getRangeStarts(), [0])
+
+    def test_tooManyDropsFail(self):
+        self.server.dropConnections(100, 0)
+        with self.assertRaises(Transfer.RETRIED_ERRORS):
+            for _ in Transfer.streamRange(self.url, 0, len(TransferTest.CONTENT), maxRetries=2):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import time
+import unittest
+from typing import List
+
+from Worker import startWorkers
+from tests import support
+
+# Changed by the test before the workers start. A forked worker would see the change
+_parentState: str = "initial"
+
+
+def _recordState(path: str):
+    with open(path, "w") as file:
+        file.write(f"{os.getpid()} {_parentState}")
+
+
+class WorkerTest(support.DownloadTestCase):
+    def failVideoAfter(self, video, amount: int):
+        # Fails the download like a full disk, once the video stream has passed an amount of bytes
+        def onProgress(jobId: str, streamType: str, downloaded: int, total: int):
+            if streamType == video.STREAM_TYPES.VIDEO and downloaded >= amount:
+                raise OSError("No space left on device")
+        video.setOnProgressFunc(onProgress)
+
+    def getVideoRangeStarts(self) -> List[int]:
+        return [int(header.split("=")[1].split("-")[0]) for path, header in self.server.requests if path.endswith("/video") and header]
+
+    def test_failedAttemptKeepsStreamsForRetry(self):
+        video, _ = self.makeVideo()
+        video.setJobId("job")
+        video.setKeepPartialFiles(True)
+        self.failVideoAfter(video, 65536)
+        with self.assertRaises(OSError):
+            video.downloadStreams(137, 140, "clip")
+        self.assertEqual(self.listOutput(), [])  # The reserved name is freed for other downloads
+        self.assertEqual(len(self.listTempFolder()), 1)
+
+        retry, combined = self.makeVideo()
+        retry.setJobId("job")
+        self.assertTrue(retry.downloadAndCombineVideo(137, 140, "clip"))
+        self.assertEqual(combined, [("job", True)])
+        self.assertGreater(self.getVideoRangeStarts()[-1], 0)  # Continued from the bytes of the failed attempt
+        with open(os.path.join(self.outputFolder, "clip.mp4"), "rb") as file:
+            self.assertEqual(file.read(), support.VIDEO_BYTES + support.AUDIO_BYTES)
+        self.assertEqual(self.listTempFolder(), [])
+
+    def test_failedDownloadRemovesStreamsByDefault(self):
+        video, _ = self.makeVideo()
+        self.failVideoAfter(video, 65536)
+        with self.assertRaises(OSError):
+            video.downloadStreams(137, 140, "clip")
+        self.assertEqual(self.listOutput(), [])
+        self.assertEqual(self.listTempFolder(), [])
+
+    def test_workersDontInheritThisProcess(self):
+        global _parentState
+        _parentState = "changed"
+        path: str = os.path.join(self.folder, "state")
+        worker = startWorkers(1, os.path.join(self.folder, "broker.db"), initializer=_recordState, initArgs=(path,))[0]
+        try:
+            deadline: float = time.monotonic() + 30
+            while not os.path.exists(path) or os.path.getsize(path) == 0:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.05)
+        finally:
+            worker.terminate()
+            worker.join()
+        with open(path) as file:
+            pid, state = file.read().split()
+        self.assertNotEqual(int(pid), os.getpid())
+        self.assertEqual(state, "initial")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from Workspace import WorkspaceAllocator
+
+REPOSITORY: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class WorkspaceTest(unittest.TestCase):
+    def setUp(self):
+        self.root: str = tempfile.mkdtemp(prefix="workspace-test-")
+        self.allocator: WorkspaceAllocator = WorkspaceAllocator(self.root)
+        self._processes = []
+
+    def tearDown(self):
+        for process in self._processes:
+            process.kill()
+            process.wait()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def startOtherProcess(self, jobId: str) -> subprocess.Popen:
+        """
+        Starts a process which allocates the folder of a job and keeps it until it's killed
+        """
+        process = subprocess.Popen([sys.executable, "-c", "import sys\nfrom Workspace import WorkspaceAllocator\n"
+                                                          f"WorkspaceAllocator({self.root!r}).allocate({jobId!r})\nprint('ready', flush=True)\nsys.stdin.read()"],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=dict(os.environ, PYTHONPATH=REPOSITORY))
+        self._processes.append(process)
+        self.assertEqual(process.stdout.readline().strip(), "ready")
+        return process
+
+    def makeOld(self, path: str):
+        old: float = time.time() - 3600
+        os.utime(path, (old, old))
+
+    def test_folderOfRunningProcessIsKeptHoweverOld(self):
+        other: subprocess.Popen = self.startOtherProcess("long-mux")
+        path: str = self.allocator.getPath("long-mux")
+        self.makeOld(path)  # Nothing written into the folder for an hour, like during a long transcode
+
+        self.assertEqual(self.allocator.sweepOrphans(), 0)
+        self.assertTrue(os.path.isdir(path))
+
+        other.kill()  # A crash releases the lock
+        other.wait()
+        self.assertEqual(self.allocator.sweepOrphans(), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_orphanIsRemovedHoweverNew(self):
+        os.makedirs(self.allocator.getPath("crashed"))
+        with open(os.path.join(self.allocator.getPath("crashed"), "video.mp4"), "wb") as file:
+            file.write(b"partial")
+        self.assertEqual(self.allocator.sweepOrphans(), 1)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_keptAndOwnFoldersStay(self):
+        os.makedirs(self.allocator.getPath("restored"))
+        own: str = self.allocator.allocate("own")
+        self.assertEqual(self.allocator.sweepOrphans(keep=["restored"]), 0)
+        self.assertTrue(os.path.isdir(own))
+        self.assertTrue(os.path.isdir(self.allocator.getPath("restored")))
+
+    def test_folderOfAnotherProcessCantBeAllocated(self):
+        self.startOtherProcess("taken")
+        with self.assertRaises(FileExistsError):
+            self.allocator.allocate("taken")
+        with self.assertRaises(FileExistsError):
+            WorkspaceAllocator(self.root).allocate("taken")
+
+    def test_releasedFolderCanBeAllocatedAgain(self):
+        path: str = self.allocator.allocate("job")
+        with self.assertRaises(FileExistsError):
+            self.allocator.allocate("job")
+        self.allocator.release("job")
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.allocator.allocate("job"), path)
+
+    def test_onlyOldLooseFilesAreRemoved(self):
+        oldFile: str = os.path.join(self.root, "video0.mp4")
+        newFile: str = os.path.join(self.root, "video1.mp4")
+        for path in (oldFile, newFile):
+            open(path, "wb").close()
+        self.makeOld(oldFile)
+        self.assertEqual(self.allocator.sweepOrphans(), 1)
+        self.assertEqual(os.listdir(self.root), ["video1.mp4"])
+
+
+if __name__ == '__main__':
+    unittest.main()